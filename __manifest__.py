@@ -6,7 +6,7 @@
         This module integrates the Fiserv payment gateway with Odoo,
         allowing for secure payment processing in your e-commerce platform.
     """,
-    'version': '18.0.1.0',
+    'version': '18.0.1.1',
     'author': 'Diego Naranjo',
     'depends': ['base', 'sale', 'payment', 'portal', 'point_of_sale'],
     'data': [
@@ -15,8 +15,14 @@
         'views/payment_transaction_views.xml',
         'views/payment_provider_views.xml',
         'views/payment_form_templates.xml',
+        'views/pos_payment_method_views.xml',
+        'views/fiserv_close_report_views.xml',
+        'views/fiserv_settlement_views.xml',
+        'views/fiserv_slow_report_views.xml',
+        'data/product_data.xml',
         'data/payment_provider_data.xml',
         'data/mail_template_data.xml',
+        'data/ir_cron_data.xml',
     ],
     'installable': True,
     'application': True,
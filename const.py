@@ -16,6 +16,15 @@ SUPPORTED_CARD_BRANDS = {
     'NARANJA': {'name': 'Naranja', 'credit': True, 'debit': False},
 }
 
+# Planes de cuotas creados por defecto para cada tarjeta: (cuotas, tasa de interés)
+DEFAULT_INSTALLMENT_PLANS = [
+    (1, 0.0),
+    (3, 10.0),
+    (6, 18.0),
+    (9, 32.0),
+    (12, 44.0),
+]
+
 # Modos de checkout disponibles
 CHECKOUT_MODES = {
     'combinedpage': 'Combined Page',
@@ -83,6 +92,27 @@ REDIR_URLS = {
     'prod': 'https://www5.ipg-online.com/connect/gateway/processing'
 }
 
+# Parámetro del sistema para reemplazar la URL de test (simulador local)
+TEST_REDIR_URL_PARAM = 'fiserv_gateway.test_redirect_url'
+
+# Parámetro del sistema que activa los tiempos por etapa de los pagos (timing.py)
+STAGE_TIMING_PARAM = 'fiserv_gateway.stage_timing'
+
+# Parámetros del sistema que habilitan /payment/fiserv/metrics: token (Bearer o
+# ?token=) y/o IPs o redes permitidas separadas por comas
+METRICS_TOKEN_PARAM = 'fiserv_gateway.metrics_token'
+METRICS_ALLOWED_IPS_PARAM = 'fiserv_gateway.metrics_allowed_ips'
+
+# Parámetro del sistema con los presupuestos de latencia en ms por endpoint,
+# p. ej. 'prepare_redirect:800,return:1500,notify:1000' (slowpath.py)
+SLOW_BUDGETS_PARAM = 'fiserv_gateway.slow_budgets'
+
+# URLs de la API REST de Fiserv (consultas, capturas, anulaciones y devoluciones)
+API_URLS = {
+    'test': 'https://cert.api.firstdata.com/gateway/v2',
+    'prod': 'https://prod.api.firstdata.com/gateway/v2'
+}
+
 # Configuración por defecto de 3DS
 THREEDS_CONFIG = {
     'authenticateTransaction': 'true',
@@ -1,7 +1,11 @@
 import os
 import json
+import functools
+import hmac
+import ipaddress
 import logging
 import pprint
+import time
 import traceback
 from werkzeug.utils import redirect
 from werkzeug.urls import url_quote
@@ -10,9 +14,34 @@ from datetime import datetime
 from odoo.http import request, Response
 from odoo.exceptions import ValidationError
 from odoo.tools.float_utils import float_compare
+from .. import const, metrics, slowpath, timing
 
 _logger = logging.getLogger(__name__)
 
+
+def _timed(pipeline):
+    """
+    Times a route as a payment pipeline, see timing.py and _fiserv_timing(),
+    adds its latency to the metrics (see metrics.py) and reports it when it
+    exceeds its budget (see slowpath.py and fiserv.slow.report).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            reports = request.env['fiserv.slow.report'].sudo()
+            budget = reports._get_budget(pipeline)
+            try:
+                with request.env['payment.transaction']._fiserv_timing(pipeline, force=bool(budget)), \
+                        slowpath.watch(pipeline, budget, reports._store_report):
+                    return method(self, *args, **kwargs)
+            finally:
+                metrics.observe('fiserv_request_duration_seconds', time.perf_counter() - started, endpoint=pipeline)
+                if metrics.publish_due():
+                    request.env['fiserv.metrics.snapshot'].sudo()._publish()
+        return wrapper
+    return decorator
+
 class FiservController(http.Controller):
     @http.route('/payment/fiserv/transaction', type='json', auth='public')
     def fiserv_transaction(self, **kwargs):
@@ -61,6 +90,7 @@ class FiservController(http.Controller):
     @http.route(['/payment/fiserv/return', '/payment/fiserv/success', '/payment/fiserv/fail'], 
                 type='http', auth='public', csrf=False, website=True, 
                 methods=['POST'], save_session=False)
+    @_timed('return')
     def fiserv_return(self, **post):
         """Handles the payment gateway return after transaction processing.
         
@@ -85,6 +115,7 @@ class FiservController(http.Controller):
             # Find transaction by reference
             reference = post.get('oid') or post.get('order_id') or post.get('reference')
             if not reference:
+                metrics.inc('fiserv_notifications_total', endpoint='return', outcome='missing_reference')
                 logger.log_error({
                     'error_type': 'missing_reference',
                     'post_data': post
@@ -93,20 +124,21 @@ class FiservController(http.Controller):
 
             # Use sudo() to bypass access rights
             env = request.env(su=True)
-            tx = env['payment.transaction'].search([
-                ('reference', '=', reference),
-                ('provider_code', '=', 'fiserv')
-            ], limit=1)
+            with timing.stage('lookup'):
+                tx = env['payment.transaction']._search_fiserv_attempt(reference, post.get('txndatetime'))
 
             if not tx:
+                metrics.inc('fiserv_notifications_total', endpoint='return', outcome='not_found')
                 logger.log_error({
                     'error_type': 'transaction_not_found',
                     'reference': reference
                 })
                 return request.redirect('/shop/confirmation')
-                
+            timing.set_key(tx.reference)
+
             # Early return if already processed
             if tx.state == 'done':
+                metrics.inc('fiserv_notifications_total', endpoint='return', outcome='duplicate')
                 return request.redirect('/shop/confirmation')
 
             # Process approval code before validation
@@ -138,7 +170,8 @@ class FiservController(http.Controller):
                 'status': 'success' if not error_code else 'error'
             })
             
-            logger.save_transaction_log(log_data, filename_prefix='fiserv_verification')
+            with timing.stage('log'):
+                logger.save_transaction_log(log_data, filename_prefix='fiserv_verification')
             
             # Process notification with new cursor
             with env.cr.savepoint():
@@ -148,8 +181,11 @@ class FiservController(http.Controller):
                         tx.sudo()._handle_feedback_data('fiserv', post)
                     else:
                         tx.sudo()._handle_notification_data('fiserv', post)
-                    env.cr.commit()
+                    with timing.stage('commit'):
+                        env.cr.commit()
+                    metrics.inc('fiserv_notifications_total', endpoint='return', outcome='processed')
                 except Exception as e:
+                    metrics.inc('fiserv_notifications_total', endpoint='return', outcome='failed')
                     logger.log_error({
                         'error_type': 'notification_processing_error',
                         'error_message': str(e),
@@ -161,6 +197,7 @@ class FiservController(http.Controller):
             return request.redirect('/shop/confirmation')
                 
         except Exception as e:
+            metrics.inc('fiserv_notifications_total', endpoint='return', outcome='error')
             log_data.update({
                 'status': 'error',
                 'error_message': str(e),
@@ -176,6 +213,7 @@ class FiservController(http.Controller):
 
     
     @http.route('/payment/fiserv/notify', type='http', auth='public', csrf=False, website=True, methods=['POST'], save_session=False)
+    @_timed('notify')
     def fiserv_notify(self, **post):
         """Processes asynchronous notifications from Fiserv gateway.
         
@@ -191,6 +229,7 @@ class FiservController(http.Controller):
         try:
             # Validar hash de notificación
             if 'notification_hash' not in post and 'response_hash' not in post:
+                metrics.inc('fiserv_notifications_total', endpoint='notify', outcome='missing_hash')
                 logger.log_error({
                     'error_type': 'missing_hash',
                     'notification_data': post
@@ -198,16 +237,20 @@ class FiservController(http.Controller):
                 return 'ERROR: Missing hash'
                 
             # Obtener y validar transacción
-            tx_sudo = request.env['payment.transaction'].sudo()._get_tx_from_notification_data('fiserv', post)
+            with timing.stage('lookup'):
+                tx_sudo = request.env['payment.transaction'].sudo()._get_tx_from_notification_data('fiserv', post)
             if not tx_sudo:
+                metrics.inc('fiserv_notifications_total', endpoint='notify', outcome='not_found')
                 logger.log_error({
                     'error_type': 'transaction_not_found',
                     'notification_data': post
                 })
                 return 'ERROR: Transaction not found'
+            timing.set_key(tx_sudo.reference)
                 
             # Evitar procesamiento duplicado
             if tx_sudo.state == 'done':
+                metrics.inc('fiserv_notifications_total', endpoint='notify', outcome='duplicate')
                 logger.log_debug({
                     'message': 'Transaction already processed',
                     'transaction_reference': tx_sudo.reference
@@ -216,9 +259,11 @@ class FiservController(http.Controller):
                     
             # Procesar notificación
             tx_sudo._handle_notification_data('fiserv', post)
+            metrics.inc('fiserv_notifications_total', endpoint='notify', outcome='processed')
             return 'OK'
             
         except Exception as e:
+            metrics.inc('fiserv_notifications_total', endpoint='notify', outcome='error')
             logger.log_error({
                 'error_type': 'notification_processing_error',
                 'error_message': str(e),
@@ -227,6 +272,7 @@ class FiservController(http.Controller):
             return f'ERROR: {str(e)}'
 
     @http.route('/payment/fiserv/prepare_redirect', type='json', auth='public')
+    @_timed('prepare_redirect')
     def prepare_redirect(self, **data):
         """Prepares redirect data for payment gateway submission.
         Validates and processes payment data before redirect:
@@ -343,21 +389,25 @@ class FiservController(http.Controller):
             }
             
             # Save log
-            request.env['fiserv.transaction.log'].sudo().save_transaction_log(
-                log_data, 
-                filename_prefix='fiserv_redirect'
-            )
+            timing.set_key(reference)
+            with timing.stage('log'):
+                request.env['fiserv.transaction.log'].sudo().save_transaction_log(
+                    log_data, 
+                    filename_prefix='fiserv_redirect'
+                )
 
             # Get values ​​for rendering
-            rendering_values = tx_sudo._get_specific_rendering_values({
-                'card_brand': data['card_brand'],
-                'installments': data['installments'],
-                'amount': float(data['total_with_interest']),
-                'total_with_interest': data['total_with_interest'],
-                'interest_rate': float(data.get('interest_rate', 0.0)),
-                'oid': reference
-            })
+            with timing.stage('rendering_values'):
+                rendering_values = tx_sudo._get_specific_rendering_values({
+                    'card_brand': data['card_brand'],
+                    'installments': data['installments'],
+                    'amount': float(data['total_with_interest']),
+                    'total_with_interest': data['total_with_interest'],
+                    'interest_rate': float(data.get('interest_rate', 0.0)),
+                    'oid': reference
+                })
 
+            metrics.inc('fiserv_redirect_preparations_total', outcome='ok')
             return {
                 'result': True,
                 'redirect_url': rendering_values['api_url'],
@@ -367,9 +417,48 @@ class FiservController(http.Controller):
             }
         
         except Exception as e:
+            metrics.inc('fiserv_redirect_preparations_total', outcome='error')
             _logger.exception("Error en preparación de redirección Fiserv")
             return {'error': str(e)}
 
+    @http.route('/payment/fiserv/metrics', type='http', auth='public', methods=['GET'], save_session=False)
+    def fiserv_metrics(self, **kwargs):
+        """Payment metrics of all the workers in the Prometheus text format.
+
+        Only answers to the token of METRICS_TOKEN_PARAM (Authorization: Bearer
+        or ?token=) or to the addresses of METRICS_ALLOWED_IPS_PARAM; anyone
+        else, or everyone when neither is configured, gets a 404.
+
+        Returns:
+            http.Response: text/plain exposition
+        """
+        if not self._metrics_allowed():
+            return request.not_found()
+        body = request.env['fiserv.metrics.snapshot'].sudo()._render_metrics()
+        return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def _metrics_allowed(self):
+        params = request.env['ir.config_parameter'].sudo()
+        token = params.get_param(const.METRICS_TOKEN_PARAM)
+        if token:
+            authorization = request.httprequest.headers.get('Authorization', '')
+            given = authorization[7:] if authorization.startswith('Bearer ') else request.httprequest.args.get('token', '')
+            if hmac.compare_digest(given.encode(), token.encode()):
+                return True
+
+        allowed = params.get_param(const.METRICS_ALLOWED_IPS_PARAM, '')
+        try:
+            remote = ipaddress.ip_address(request.httprequest.remote_addr)
+        except ValueError:
+            return False
+        for network in allowed.split(','):
+            try:
+                if network.strip() and remote in ipaddress.ip_network(network.strip(), strict=False):
+                    return True
+            except ValueError:
+                _logger.warning("Invalid address in %s: %s", const.METRICS_ALLOWED_IPS_PARAM, network)
+        return False
+
     @http.route('/payment/fiserv/get_card_brands', type='json', auth='user')
     def get_card_brands(self):
         """Retrieves available credit card brands from active Fiserv card configurations.
@@ -606,15 +695,15 @@ class FiservController(http.Controller):
         """Verifies initial Fiserv payment method configuration.
 
         Checks for:
-        - Existence of payment method with ID 6
+        - Existence of a payment method flagged to use Fiserv
         - Credit card functionality
         - Available card brands
         
         Used during module installation and configuration verification.
         """        
-        payment_method = self.env['pos.payment.method'].search([('id', '=', 6)], limit=1)
+        payment_method = self.env['pos.payment.method'].search([('use_fiserv', '=', True)], limit=1)
         if not payment_method:
-            raise ValidationError("Fiserv payment method (ID 6) not found")
+            raise ValidationError("No POS payment method is configured to use Fiserv")
             
         if not payment_method.is_credit_card:
             raise ValidationError("Payment method must be configured for credit cards")
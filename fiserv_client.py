@@ -0,0 +1,180 @@
+"""
+Client for the Fiserv REST API (server to server calls).
+
+The hosted payment page covers the payment itself; this client covers what
+happens afterwards: status inquiry, capture of authorizations, voids and
+refunds. It does not depend on Odoo so it can be used from threads and
+tested against tools/api_stub.py.
+
+Connections are pooled: one requests.Session per (provider, URL, API key) is
+kept for the life of the process, with keep-alive, timeouts and retries
+with exponential backoff. Retries on HTTP status only apply to GET
+requests; POST requests (capture, void, refund) are only retried when the
+connection could not be established, so they are never sent twice.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_logger = logging.getLogger(__name__)
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 20)
+
+# Connections kept open per host, enough for the reconciliation job threads
+POOL_MAXSIZE = 16
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class FiservAPIError(Exception):
+    """Error returned by the Fiserv API or raised while calling it."""
+
+    def __init__(self, message, status_code=None, payload=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload or {}
+
+
+def _build_session():
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=2,
+        status=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Content-Type': 'application/json',
+        'Accept': 'application/json',
+        'Connection': 'keep-alive',
+    })
+    return session
+
+
+def get_session(key):
+    """Returns the pooled session for key, creating it on first use."""
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = _build_session()
+    return session
+
+
+def close_sessions(pool_key=None):
+    """
+    Closes the pooled sessions of pool_key, e.g. after the API credentials
+    of that provider changed, or every pooled session without pool_key.
+    """
+    with _sessions_lock:
+        for key in [key for key in _sessions if pool_key is None or key[0] == pool_key]:
+            _sessions.pop(key).close()
+
+
+class FiservClient:
+    """
+    Fiserv REST API client for one store.
+
+    Usage:
+        client = FiservClient(base_url, api_key, api_secret, pool_key=provider.id)
+        client.get_order('S00042')
+        client.capture('84538652787', 100.0, 'ARS')
+    """
+
+    def __init__(self, base_url, api_key, api_secret, store_id=None, pool_key=None, timeout=DEFAULT_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.store_id = store_id
+        self.timeout = timeout
+        self.session = get_session((pool_key, self.base_url, api_key))
+
+    def _sign(self, client_request_id, timestamp, body):
+        message = f'{self.api_key}{client_request_id}{timestamp}{body}'
+        digest = hmac.new(self.api_secret.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).digest()
+        return base64.b64encode(digest).decode()
+
+    def _request(self, method, path, payload=None):
+        """
+        Sends a signed request and returns the decoded JSON response.
+
+        Raises:
+            FiservAPIError: On connection errors, timeouts, non JSON answers
+                and HTTP errors
+        """
+        body = json.dumps(payload, separators=(',', ':')) if payload is not None else ''
+        client_request_id = str(uuid.uuid4())
+        timestamp = str(int(time.time() * 1000))
+        headers = {
+            'Api-Key': self.api_key,
+            'Client-Request-Id': client_request_id,
+            'Timestamp': timestamp,
+            'Message-Signature': self._sign(client_request_id, timestamp, body),
+        }
+        url = f'{self.base_url}{path}'
+        try:
+            response = self.session.request(method, url, data=body or None, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            _logger.warning("Fiserv API %s %s failed: %s", method, path, e)
+            raise FiservAPIError(f"Could not reach Fiserv: {e}") from e
+
+        try:
+            data = response.json() if response.content else {}
+        except ValueError:
+            raise FiservAPIError(
+                f"Invalid response from Fiserv (HTTP {response.status_code})", response.status_code
+            )
+
+        if response.status_code >= 400:
+            error = data.get('error') or {}
+            message = error.get('message') or data.get('transactionStatus') or response.reason
+            raise FiservAPIError(f"Fiserv error: {message}", response.status_code, data)
+        return data
+
+    def _secondary_transaction(self, transaction_id, request_type, amount=None, currency=None):
+        payload = {'requestType': request_type}
+        if amount is not None:
+            payload['transactionAmount'] = {'total': f'{amount:.2f}', 'currency': currency}
+        if self.store_id:
+            payload['storeId'] = self.store_id
+        return self._request('POST', f'/payments/{transaction_id}', payload)
+
+    def get_order(self, order_id):
+        """Returns the order and its transactions (status inquiry by order id)."""
+        return self._request('GET', f'/orders/{order_id}')
+
+    def get_transaction(self, transaction_id):
+        """Returns a transaction by its Fiserv transaction id."""
+        return self._request('GET', f'/payments/{transaction_id}')
+
+    def capture(self, transaction_id, amount, currency):
+        """Captures a pre-authorization (PostAuth)."""
+        return self._secondary_transaction(transaction_id, 'PostAuthTransaction', amount, currency)
+
+    def void(self, transaction_id):
+        """Voids a transaction not yet settled."""
+        return self._secondary_transaction(transaction_id, 'VoidTransaction')
+
+    def refund(self, transaction_id, amount, currency):
+        """Refunds a settled transaction, fully or partially."""
+        return self._secondary_transaction(transaction_id, 'ReturnTransaction', amount, currency)
@@ -0,0 +1,238 @@
+"""
+Counters and latency histograms of the payment paths, rendered in the
+Prometheus text format by /payment/fiserv/metrics.
+
+    metrics.inc('fiserv_notifications_total', endpoint='notify', outcome='duplicate')
+    metrics.observe('fiserv_request_duration_seconds', 0.123, endpoint='notify')
+
+Each thread increments its own shard, so the request path takes no lock:
+inc() and observe() only touch dicts owned by the calling thread, and the
+shard of a finished thread is folded into a retired one. snapshot() adds up
+the shards of the process. Odoo workers are separate processes: each one
+publishes its snapshot (see fiserv.metrics.snapshot) and the route renders
+merge() of all of them. Does not depend on Odoo.
+"""
+import threading
+import time
+import weakref
+
+# Upper bounds of the latency histogram buckets, in seconds (+Inf is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Seconds between two publications of the process snapshot
+PUBLISH_INTERVAL = 30
+
+# name: (type, help) of the exported metrics
+METRICS = {
+    'fiserv_notifications_total': (
+        'counter', "Fiserv notifications and returns by endpoint and outcome."),
+    'fiserv_signature_failures_total': (
+        'counter', "Fiserv notifications rejected because of an invalid hash."),
+    'fiserv_redirect_preparations_total': (
+        'counter', "Hosted page redirects prepared, by outcome."),
+    'fiserv_request_duration_seconds': (
+        'histogram', "Latency of the Fiserv payment routes."),
+    'fiserv_stage_duration_seconds': (
+        'histogram', "Latency of the stages of the Fiserv payment pipelines, 'total' being the whole run."),
+    'fiserv_log_records_total': (
+        'counter', "Deferred log records by state (queued, written, dropped)."),
+    'fiserv_log_queue_depth': (
+        'gauge', "Deferred log records waiting for their transaction to end."),
+    'fiserv_cache_requests_total': (
+        'counter', "Lookups of the module caches by result (hit, miss)."),
+    'fiserv_cache_hit_ratio': (
+        'gauge', "Hit ratio of the module caches."),
+    'fiserv_metrics_workers': (
+        'gauge', "Worker snapshots aggregated in this scrape."),
+}
+
+_local = threading.local()
+_lock = threading.Lock()
+_shards = set()
+_last_publish = 0.0
+
+
+class _Shard:
+    __slots__ = ('counters', 'histograms', '__weakref__')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+_retired = _Shard()
+
+
+class _Owner:
+    """Lives in the thread local storage: collected when its thread ends."""
+    __slots__ = ('__weakref__',)
+
+
+def _retire(shard):
+    with _lock:
+        _shards.discard(shard)
+        _add(_retired, shard.counters.copy(), shard.histograms.copy())
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        _local.owner = _Owner()
+        weakref.finalize(_local.owner, _retire, shard)
+        with _lock:
+            _shards.add(shard)
+    return shard
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+
+def inc(name, value=1, **labels):
+    """Adds value to a counter of the current process."""
+    counters = _shard().counters
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Adds a duration to a latency histogram of the current process."""
+    histograms = _shard().histograms
+    key = _key(name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        # Counts per bucket, then +Inf, sum and count
+        histogram = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+    index = 0
+    while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+        index += 1
+    histogram[index] += 1
+    histogram[-2] += seconds
+    histogram[-1] += 1
+
+
+def _add(target, counters, histograms):
+    for key, value in counters.items():
+        target.counters[key] = target.counters.get(key, 0) + value
+    for key, values in histograms.items():
+        histogram = target.histograms.get(key)
+        if histogram is None:
+            target.histograms[key] = list(values)
+        else:
+            for index, value in enumerate(values):
+                histogram[index] += value
+
+
+def _as_lists(shard):
+    return {
+        'counters': [[name, [list(label) for label in labels], value]
+                     for (name, labels), value in sorted(shard.counters.items())],
+        'histograms': [[name, [list(label) for label in labels], values]
+                       for (name, labels), values in sorted(shard.histograms.items())],
+    }
+
+
+def snapshot():
+    """
+    Totals of the current process as a JSON serializable dict:
+    {'counters': [[name, labels, value]], 'histograms': [[name, labels, values]]},
+    labels being a list of [label, value] pairs.
+    """
+    total = _Shard()
+    with _lock:
+        _add(total, _retired.counters, _retired.histograms)
+        for shard in _shards:
+            # dict.copy() is atomic, the owner thread may be incrementing
+            _add(total, shard.counters.copy(), shard.histograms.copy())
+    return _as_lists(total)
+
+
+def merge(snapshots):
+    """Adds up the snapshot() of several processes."""
+    total = _Shard()
+    for data in snapshots:
+        _add(
+            total,
+            {(name, tuple(map(tuple, labels))): value for name, labels, value in data.get('counters', [])},
+            {(name, tuple(map(tuple, labels))): values for name, labels, values in data.get('histograms', [])},
+        )
+    return _as_lists(total)
+
+
+def publish_due(interval=PUBLISH_INTERVAL):
+    """True at most once per interval and process: time to publish the snapshot."""
+    global _last_publish
+    now = time.monotonic()
+    if now - _last_publish < interval or not _lock.acquire(blocking=False):
+        return False
+    try:
+        if now - _last_publish < interval:
+            return False
+        _last_publish = now
+        return True
+    finally:
+        _lock.release()
+
+
+def total(data, name, **labels):
+    """Sum of the counters of a snapshot named name and matching labels."""
+    wanted = set(labels.items())
+    return sum(
+        count for counter, counter_labels, count in data['counters']
+        if counter == name and wanted <= set(map(tuple, counter_labels))
+    )
+
+
+def _format_labels(labels, extra=()):
+    pairs = [tuple(label) for label in labels] + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (label, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for label, value in pairs
+    )
+    return '{%s}' % ','.join('%s="%s"' % pair for pair in escaped)
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(data, gauges=()):
+    """
+    Prometheus text exposition of a snapshot, plus gauges given as
+    (name, labels, value) tuples, labels being a dict.
+    """
+    samples = {}
+    for name, labels, value in data['counters']:
+        samples.setdefault(name, []).append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+    for name, labels, values in data['histograms']:
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+            cumulative += count
+            lines.append('%s_bucket%s %s' % (name, _format_labels(labels, [('le', str(bound))]), cumulative))
+        lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(values[-2])))
+        lines.append('%s_count%s %s' % (name, _format_labels(labels), values[-1]))
+    for name, labels, value in gauges:
+        samples.setdefault(name, []).append(
+            '%s%s %s' % (name, _format_labels(sorted(labels.items())), _format_value(value)))
+
+    output = []
+    for name in sorted(samples):
+        metric_type, help_text = METRICS.get(name, ('untyped', ''))
+        output.append('# HELP %s %s' % (name, help_text))
+        output.append('# TYPE %s %s' % (name, metric_type))
+        output.extend(samples[name])
+    return '\n'.join(output) + '\n'
+
+
+def reset():
+    """Clears the counters of the current process."""
+    with _lock:
+        _retired.counters.clear()
+        _retired.histograms.clear()
+        for shard in _shards:
+            shard.counters.clear()
+            shard.histograms.clear()
@@ -0,0 +1,32 @@
+from odoo import api, SUPERUSER_ID
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Up to 18.0.1.0 the Fiserv POS payment method was hardcoded as id 6.
+    Flag it with use_fiserv so existing shops keep working, through the ORM
+    so that pos.order.fiserv_payment_id is recomputed for its orders.
+    Fiserv providers without a rounding adjustment product get the
+    AJUSTE_RED one, if the database has it.
+    """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    payment_method = env['pos.payment.method'].browse(6).exists()
+    if payment_method and not payment_method.use_fiserv:
+        payment_method.write({'use_fiserv': True})
+        _logger.info("Fiserv: payment method %s flagged with use_fiserv", payment_method.display_name)
+
+    # The rounding adjustment product used to be searched by code on every
+    # order; providers the column default did not fill get it once here
+    adjustment_product = env['product.product'].search([('default_code', '=', 'AJUSTE_RED')], limit=1)
+    if adjustment_product:
+        providers = env['payment.provider'].search([
+            ('code', '=', 'fiserv'),
+            ('fiserv_adjustment_product_id', '=', False),
+        ])
+        providers.write({'fiserv_adjustment_product_id': adjustment_product.id})
+        if providers:
+            _logger.info("Fiserv: adjustment product %s set on providers %s",
+                         adjustment_product.display_name, providers.ids)
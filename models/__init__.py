@@ -3,4 +3,9 @@ from . import payment_transaction
 from . import fiserv_log
 from . import sale_order
 from . import decimal_precision
-from . import pos_payment
\ No newline at end of file
+from . import pos_payment
+from . import product_template
+from . import fiserv_close_report
+from . import fiserv_settlement
+from . import fiserv_metrics
+from . import fiserv_slow_report
\ No newline at end of file
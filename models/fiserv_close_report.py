@@ -0,0 +1,100 @@
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+
+class FiservCloseReport(models.TransientModel):
+    """
+    End-of-session close report ("cierre de lote") of the Fiserv POS payments.
+
+    Totals by card brand and installment plan for a session or a date range,
+    to be matched against the Fiserv batch. The totals come from a single
+    grouped query over pos.payment.
+    """
+    _name = 'fiserv.close.report'
+    _description = 'Cierre de lote Fiserv'
+
+    session_id = fields.Many2one('pos.session', string='Sesión')
+    date_from = fields.Datetime(string='Desde')
+    date_to = fields.Datetime(string='Hasta')
+    config_ids = fields.Many2many('pos.config', string='Puntos de venta',
+                                  help='Vacío para incluir todos los puntos de venta')
+    line_ids = fields.One2many('fiserv.close.report.line', 'report_id', string='Totales', readonly=True)
+    currency_id = fields.Many2one('res.currency', default=lambda self: self.env.company.currency_id)
+    amount_total = fields.Monetary(string='Total cobrado', compute='_compute_totals')
+    total_with_interest = fields.Monetary(string='Total con interés', compute='_compute_totals')
+    payment_count = fields.Integer(string='Cantidad de pagos', compute='_compute_totals')
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        if self.env.context.get('active_model') == 'pos.session' and self.env.context.get('active_id'):
+            res['session_id'] = self.env.context['active_id']
+        return res
+
+    @api.depends('line_ids.amount', 'line_ids.total_with_interest', 'line_ids.payment_count')
+    def _compute_totals(self):
+        for report in self:
+            report.amount_total = sum(report.line_ids.mapped('amount'))
+            report.total_with_interest = sum(report.line_ids.mapped('total_with_interest'))
+            report.payment_count = sum(report.line_ids.mapped('payment_count'))
+
+    def _get_payment_domain(self):
+        self.ensure_one()
+        domain = [('payment_method_id.use_fiserv', '=', True)]
+        if self.session_id:
+            domain.append(('session_id', '=', self.session_id.id))
+        else:
+            if not self.date_from or not self.date_to:
+                raise UserError(_("Seleccione una sesión o un rango de fechas."))
+            domain += [('payment_date', '>=', self.date_from), ('payment_date', '<=', self.date_to)]
+            if self.config_ids:
+                domain.append(('session_id.config_id', 'in', self.config_ids.ids))
+        return domain
+
+    def action_compute(self):
+        """Computes the totals by card brand and installment plan."""
+        self.ensure_one()
+        groups = self.env['pos.payment']._read_group(
+            self._get_payment_domain(),
+            ['card_config_id', 'installments', 'interest_rate'],
+            ['__count', 'amount:sum', 'total_with_interest:sum'],
+        )
+        commands = [(5, 0, 0)]
+        for card_config, installments, interest_rate, count, amount, total_with_interest in groups:
+            commands.append((0, 0, {
+                'card_config_id': card_config.id,
+                'installments': installments,
+                'interest_rate': interest_rate,
+                'payment_count': count,
+                'amount': amount,
+                'total_with_interest': total_with_interest,
+            }))
+        self.line_ids = commands
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+
+class FiservCloseReportLine(models.TransientModel):
+    _name = 'fiserv.close.report.line'
+    _description = 'Línea de cierre de lote Fiserv'
+    _order = 'card_config_id, installments'
+
+    report_id = fields.Many2one('fiserv.close.report', required=True, ondelete='cascade')
+    currency_id = fields.Many2one(related='report_id.currency_id')
+    card_config_id = fields.Many2one('fiserv.card.config', string='Tarjeta')
+    installments = fields.Integer(string='Cuotas')
+    interest_rate = fields.Float(string='Tasa de interés', digits=(16, 4))
+    payment_count = fields.Integer(string='Pagos')
+    amount = fields.Monetary(string='Cobrado')
+    total_with_interest = fields.Monetary(string='Total con interés')
+    interest_amount = fields.Monetary(string='Interés', compute='_compute_interest_amount')
+
+    @api.depends('amount', 'total_with_interest')
+    def _compute_interest_amount(self):
+        for line in self:
+            line.interest_amount = line.total_with_interest - line.amount
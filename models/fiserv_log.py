@@ -2,16 +2,129 @@ import os
 import json
 import logging
 from datetime import datetime
+from functools import partial
 from odoo import models, api
+from odoo.tools import config
+from .. import metrics
 
 _logger = logging.getLogger(__name__)
 
+# Default directory, see get_log_dir()
+LOG_BASE_DIR = '/var/log/odoo/fiserv'
+
+_log_dir_override = None
+
+# Subdirectories by record type
+LOG_TYPES = {
+    'transaction': 'transactions',
+    'error': 'errors',
+    'notification': 'notifications',
+    'debug': 'debug'
+}
+
+
+def get_log_dir():
+    """
+    Base directory of the Fiserv logs: the one given to set_log_dir(), else
+    the fiserv_log_dir option of the Odoo configuration file, else LOG_BASE_DIR.
+    """
+    return _log_dir_override or config.get('fiserv_log_dir') or LOG_BASE_DIR
+
+
+def set_log_dir(path):
+    """Overrides the log directory of this process, None restores it."""
+    global _log_dir_override
+    _log_dir_override = path
+
+
+def _prepare_log_entry(log_data, filename_prefix=None, log_type='transaction'):
+    """
+    Builds the target file path and the serializable entry for a log record.
+    Does not touch the filesystem.
+    """
+    subdir = LOG_TYPES.get(log_type, 'misc')
+    log_dir = os.path.join(get_log_dir(), subdir)
+
+    # Generate timestamp
+    timestamp = log_data.get('timestamp')
+    if not isinstance(timestamp, str):
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    else:
+        timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').strftime('%Y%m%d_%H%M%S')
+
+    # Get reference
+    reference = log_data.get('transaction_reference')
+    if not reference:
+        reference = f"TX{log_data.get('transaction_id', 'unknown')}"
+
+    # Build filename without timestamp
+    prefix = filename_prefix or f'fiserv_{subdir}'
+    filename = f'{prefix}_{reference}.log'
+    filepath = os.path.join(log_dir, filename)
+
+    # Add timestamp to log_data
+    log_data.update({
+        'log_type': log_type,
+        'timestamp': timestamp,
+        'log_filename': filename
+    })
+
+    return filepath, json.loads(json.dumps(log_data, default=str))
+
+
+def _append_log_entries(filepath, entries):
+    """
+    Appends entries to the JSON list stored in filepath, creating it if needed.
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    # Read existing logs or start new list
+    existing_logs = []
+    if os.path.exists(filepath):
+        with open(filepath, 'r') as f:
+            try:
+                existing_logs = json.load(f)
+                if not isinstance(existing_logs, list):
+                    existing_logs = [existing_logs]
+            except json.JSONDecodeError:
+                existing_logs = []
+
+    existing_logs.extend(entries)
+
+    # Save updated logs
+    with open(filepath, 'w') as f:
+        json.dump(existing_logs, f, indent=4, ensure_ascii=False)
+
+
+def _flush_log_entries(pending):
+    """
+    Post-commit callback: writes the queued entries, one read/write per file.
+    """
+    by_file = {}
+    for filepath, entry in pending:
+        by_file.setdefault(filepath, []).append(entry)
+    metrics.inc('fiserv_log_records_total', len(pending), state='written')
+    del pending[:]
+
+    for filepath, entries in by_file.items():
+        try:
+            _append_log_entries(filepath, entries)
+        except Exception:
+            _logger.warning("Could not write Fiserv log file %s", filepath, exc_info=True)
+
+
+def _drop_log_entries(pending):
+    """Post-rollback callback: the queued entries are discarded."""
+    metrics.inc('fiserv_log_records_total', len(pending), state='dropped')
+    del pending[:]
+
+
 class FiservTransactionLog(models.Model):
     """
     FiservTransactionLog manages detailed logging operations for the Fiserv payment module.
 
     Organizes logs into subdirectories by type:
-    - transactions/: Normal transaction logs 
+    - transactions/: Normal transaction logs
     - errors/: Error logs
     - notifications/: Gateway notification logs
     - debug/: Debug logs
@@ -22,6 +135,7 @@ class FiservTransactionLog(models.Model):
 
     Main methods:
     - save_transaction_log(): Base method for log saving
+    - defer_transaction_log(): Queues a record and writes it after commit
     - log_error(): Records errors
     - log_notification(): Records notifications
     - log_debug(): Records debug information
@@ -43,7 +157,13 @@ class FiservTransactionLog(models.Model):
 
     # Log transaction
     self.env['fiserv.transaction.log'].save_transaction_log({
-        'transaction_id': tx_id, 
+        'transaction_id': tx_id,
+        'amount': amount
+    })
+
+    # Log from a compute method (no I/O until the transaction commits)
+    self.env['fiserv.transaction.log'].defer_transaction_log({
+        'transaction_id': tx_id,
         'amount': amount
     })
     """
@@ -53,67 +173,29 @@ class FiservTransactionLog(models.Model):
     @api.model
     def save_transaction_log(self, log_data, filename_prefix=None, log_type='transaction'):
         try:
-            base_dir = '/var/log/odoo/fiserv'
-            
-            # Subdirectories by record type
-            log_types = {
-                'transaction': 'transactions', 
-                'error': 'errors',
-                'notification': 'notifications',
-                'debug': 'debug'
-            }
-            
-            # Create directory structure
-            for directory in log_types.values():
-                os.makedirs(os.path.join(base_dir, directory), exist_ok=True)
-            
-            subdir = log_types.get(log_type, 'misc')
-            log_dir = os.path.join(base_dir, subdir)
-            
-            # Generate timestamp 
-            timestamp = log_data.get('timestamp')
-            if not isinstance(timestamp, str):
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            else:
-                timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').strftime('%Y%m%d_%H%M%S')
-
-            # Get reference
-            reference = log_data.get('transaction_reference')
-            if not reference:
-                reference = f"TX{log_data.get('transaction_id', 'unknown')}"
-
-            # Build filename without timestamp
-            prefix = filename_prefix or f'fiserv_{subdir}'
-            filename = f'{prefix}_{reference}.log'
-            filepath = os.path.join(log_dir, filename)
-
-            # Add timestamp to log_data
-            log_data.update({
-                'log_type': log_type,
-                'timestamp': timestamp,
-                'log_filename': filename
-            })
-
-            # Read existing logs or start new list
-            existing_logs = []
-            if os.path.exists(filepath):
-                with open(filepath, 'r') as f:
-                    try:
-                        existing_logs = json.load(f)
-                        if not isinstance(existing_logs, list):
-                            existing_logs = [existing_logs]
-                    except json.JSONDecodeError:
-                        existing_logs = []
-
-            # Add new log
-            serializable_data = json.loads(json.dumps(log_data, default=str))
-            existing_logs.append(serializable_data)
-
-            # Save updated logs
-            with open(filepath, 'w') as f:
-                json.dump(existing_logs, f, indent=4, ensure_ascii=False)
+            filepath, entry = _prepare_log_entry(log_data, filename_prefix, log_type)
+            _append_log_entries(filepath, [entry])
             return True
-            
+
+        except Exception as e:
+            return False
+
+    @api.model
+    def defer_transaction_log(self, log_data, filename_prefix=None, log_type='transaction'):
+        """
+        Queues a log record on the current cursor and writes it once the
+        transaction commits. Records of a rolled back transaction are dropped.
+        Safe to call from compute methods: no filesystem access happens here.
+        """
+        try:
+            pending = self.env.cr.postcommit.data.setdefault('fiserv.transaction.log', [])
+            if not pending:
+                self.env.cr.postcommit.add(partial(_flush_log_entries, pending))
+                self.env.cr.postrollback.add(partial(_drop_log_entries, pending))
+            pending.append(_prepare_log_entry(log_data, filename_prefix, log_type))
+            metrics.inc('fiserv_log_records_total', state='queued')
+            return True
+
         except Exception as e:
             return False
 
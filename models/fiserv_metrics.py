@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from odoo import api, fields, models
+from odoo.tools.cache import STAT
+
+from .. import metrics
+from .payment_provider import _read_module_image
+
+_logger = logging.getLogger(__name__)
+
+# Snapshots older than this are left out of the gauges (worker gone)
+LIVE_SECONDS = 5 * 60
+
+# Snapshots of workers gone for this long are deleted by the autovacuum
+STALE_DAYS = 7
+
+# ormcached methods whose lookups are exported, by cache label
+ORMCACHED_METHODS = {
+    '_get_plan_rates': 'plan_rates',
+    '_get_fiserv_product_profile': 'product_profile',
+}
+
+
+class FiservMetricsSnapshot(models.Model):
+    """
+    Last snapshot of the payment metrics (see metrics.py) of each Odoo worker.
+
+    Counters live in the memory of each worker process; every worker writes
+    its totals here at most every metrics.PUBLISH_INTERVAL seconds, in its
+    own transaction, and /payment/fiserv/metrics adds the rows up. Rows of
+    workers that are gone are kept so the counters do not go back, until
+    the autovacuum removes them after STALE_DAYS.
+    """
+    _name = 'fiserv.metrics.snapshot'
+    _description = 'Métricas Fiserv por proceso'
+    _order = 'write_date desc'
+
+    name = fields.Char(string='Proceso', required=True, readonly=True)
+    data = fields.Text(string='Datos', readonly=True)
+
+    _sql_constraints = [
+        ('name_unique', 'unique(name)', 'Ya existe una instantánea para este proceso.')
+    ]
+
+    @api.model
+    def _get_worker_name(self):
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    @api.model
+    def _get_cache_counters(self):
+        """Hits and misses of the module caches in this process, as snapshot counters."""
+        totals = {}
+        dbname = self.env.cr.dbname
+        for (db, model_name, method), counter in list(STAT.items()):
+            cache = ORMCACHED_METHODS.get(getattr(method, '__name__', None))
+            if db == dbname and cache:
+                totals[(cache, 'hit')] = totals.get((cache, 'hit'), 0) + counter.hit
+                totals[(cache, 'miss')] = totals.get((cache, 'miss'), 0) + counter.miss
+        info = _read_module_image.cache_info()
+        totals[('module_image', 'hit')] = info.hits
+        totals[('module_image', 'miss')] = info.misses
+        return [
+            ['fiserv_cache_requests_total', [['cache', cache], ['result', result]], count]
+            for (cache, result), count in sorted(totals.items())
+        ]
+
+    @api.model
+    def _publish(self):
+        """
+        Writes the snapshot of this process in a separate transaction, so
+        it is visible to the other workers whatever happens to the current
+        one. Returns the snapshot.
+        """
+        data = metrics.snapshot()
+        data['counters'].extend(self._get_cache_counters())
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute("""
+                    INSERT INTO fiserv_metrics_snapshot (name, data, create_uid, create_date, write_uid, write_date)
+                    VALUES (%s, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')
+                    ON CONFLICT (name) DO UPDATE
+                    SET data = EXCLUDED.data, write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+                """, (self._get_worker_name(), json.dumps(data), self.env.uid, self.env.uid))
+        except Exception:
+            _logger.warning("Could not publish the Fiserv metrics snapshot", exc_info=True)
+        return data
+
+    @api.model
+    def _render_metrics(self):
+        """Prometheus text of the snapshots of all the workers."""
+        own = self._publish()
+        self.env.cr.execute("""
+            SELECT name, data, write_date >= (now() at time zone 'UTC') - %s * interval '1 second'
+            FROM fiserv_metrics_snapshot
+        """, (LIVE_SECONDS,))
+        snapshots = {}
+        live = {}
+        for name, data, is_live in self.env.cr.fetchall():
+            try:
+                snapshots[name] = json.loads(data or '{}')
+                live[name] = is_live
+            except ValueError:
+                continue
+        # The current transaction may not see the row just written
+        worker = self._get_worker_name()
+        snapshots[worker] = own
+        live[worker] = True
+
+        data = metrics.merge(snapshots.values())
+        live_data = metrics.merge(snapshot for name, snapshot in snapshots.items() if live[name])
+        gauges = [
+            ('fiserv_metrics_workers', {}, sum(live.values())),
+            ('fiserv_log_queue_depth', {}, max(0, (
+                metrics.total(live_data, 'fiserv_log_records_total', state='queued')
+                - metrics.total(live_data, 'fiserv_log_records_total', state='written')
+                - metrics.total(live_data, 'fiserv_log_records_total', state='dropped')
+            ))),
+        ]
+        for cache in sorted(set(ORMCACHED_METHODS.values()) | {'module_image'}):
+            hits = metrics.total(data, 'fiserv_cache_requests_total', cache=cache, result='hit')
+            misses = metrics.total(data, 'fiserv_cache_requests_total', cache=cache, result='miss')
+            if hits + misses:
+                gauges.append(('fiserv_cache_hit_ratio', {'cache': cache}, round(hits / (hits + misses), 4)))
+        return metrics.render(data, gauges)
+
+    @api.autovacuum
+    def _gc_stale_snapshots(self):
+        self.sudo().search([
+            ('write_date', '<', fields.Datetime.now() - timedelta(days=STALE_DAYS))
+        ]).unlink()
@@ -0,0 +1,293 @@
+import logging
+import os
+import tempfile
+import time
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+from .. import settlement
+
+_logger = logging.getLogger(__name__)
+
+# Rows written per INSERT while importing
+WRITE_CHUNK_SIZE = 10000
+
+# Default number of processes of new imports
+PROCESSES_PARAM = 'fiserv_gateway.settlement_processes'
+
+MATCH_TYPES = [
+    ('txn_id', 'ID de transacción'),
+    ('reference', 'Referencia'),
+    ('approval_code', 'Código de autorización'),
+    ('none', 'Sin coincidencia'),
+]
+
+
+class FiservSettlementImport(models.Model):
+    """
+    Import of a Fiserv settlement ("liquidación") file.
+
+    The file is streamed from the filestore through a memory map and every
+    row is matched against the Fiserv transactions with in-memory indexes
+    built once per import (transaction id, reference and authorization code).
+    Lines and transaction links are written in bulk, WRITE_CHUNK_SIZE rows
+    per query. With more than one process the file is parsed and matched by
+    a process pool (see settlement.iter_rows_parallel) while this process
+    writes the results.
+    """
+    _name = 'fiserv.settlement.import'
+    _description = 'Importación de liquidación Fiserv'
+    _order = 'id desc'
+
+    name = fields.Char(string='Nombre', required=True, default=lambda self: _('Liquidación'))
+    settlement_file = fields.Binary(string='Archivo', attachment=True, required=True)
+    filename = fields.Char(string='Nombre de archivo')
+    file_format = fields.Selection([
+        ('csv', 'CSV'),
+        ('fixed', 'Ancho fijo'),
+    ], string='Formato', default='csv', required=True)
+    delimiter = fields.Char(string='Separador', default=';', size=1)
+    state = fields.Selection([
+        ('draft', 'Borrador'),
+        ('queued', 'En cola'),
+        ('done', 'Procesado'),
+    ], string='Estado', default='draft', readonly=True)
+    line_ids = fields.One2many('fiserv.settlement.line', 'import_id', string='Líneas', readonly=True)
+    row_count = fields.Integer(string='Filas', readonly=True)
+    matched_count = fields.Integer(string='Conciliadas', readonly=True)
+    unmatched_count = fields.Integer(string='Sin conciliar', readonly=True)
+    amount_mismatch_count = fields.Integer(string='Diferencias de importe', readonly=True)
+    duration = fields.Float(string='Duración (s)', readonly=True, digits=(16, 2))
+    processes = fields.Integer(
+        string='Procesos',
+        default=lambda self: int(self.env['ir.config_parameter'].sudo().get_param(PROCESSES_PARAM, 1)),
+        help='Procesos usados para leer y conciliar el archivo. 0 usa todos los núcleos.'
+    )
+    worker_stats = fields.Text(string='Rendimiento por proceso', readonly=True)
+    error = fields.Char(string='Error', readonly=True, help='Motivo por el que falló la última importación en cola')
+
+    def action_import(self):
+        """
+        Imports single process imports right away. Parallel ones are queued
+        for the settlement cron: worker processes are only forked from a
+        single threaded process, which an HTTP request is not guaranteed
+        to run in.
+        """
+        parallel = self.filtered(lambda record: record.processes != 1)
+        for record in self - parallel:
+            record._import_settlement()
+        if parallel:
+            parallel.write({'state': 'queued', 'error': False})
+            self.env.ref('fiserv_gateway.ir_cron_fiserv_settlement_import')._trigger()
+
+    @api.model
+    def _cron_import_queued(self):
+        """Imports the queued settlements, committing after each one."""
+        for record in self.search([('state', '=', 'queued')], order='id'):
+            try:
+                record._import_settlement()
+                self.env.cr.commit()
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.exception("Fiserv settlement %s could not be imported", record.name)
+                record.write({'state': 'draft', 'error': str(e) or type(e).__name__})
+                self.env.cr.commit()
+
+    def _get_settlement_path(self):
+        """
+        Returns the path of the uploaded file and whether it is a temporary
+        copy, for files stored in the database instead of the filestore.
+        """
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'settlement_file'),
+            ('res_id', '=', self.id),
+        ], limit=1)
+        if not attachment:
+            raise UserError(_("Cargue un archivo de liquidación."))
+        if attachment.store_fname:
+            return attachment._full_path(attachment.store_fname), False
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.fiserv') as tmp:
+            tmp.write(attachment.raw)
+        return tmp.name, True
+
+    def _get_parse_options(self):
+        self.ensure_one()
+        if self.file_format == 'csv':
+            return {'delimiter': self.delimiter or ';'}
+        return {}
+
+    @api.model
+    def _build_transaction_index(self):
+        """
+        Returns the lookup dicts of the settled Fiserv transactions:
+        (by_txn_id, by_reference, by_approval_code), each mapping a key to
+        (transaction_id, amount). Authorization codes repeat over time, so
+        ambiguous ones map to None.
+        """
+        cr = self.env.cr
+        by_txn_id, by_reference, by_approval_code = {}, {}, {}
+        cr.execute("""
+            SELECT tx.id, tx.amount, tx.fiserv_txn_id, tx.provider_reference,
+                   tx.fiserv_approval_code, tx.reference
+              FROM payment_transaction tx
+              JOIN payment_provider provider ON provider.id = tx.provider_id
+             WHERE provider.code = 'fiserv'
+               AND tx.state IN ('done', 'authorized')
+        """)
+        while rows := cr.fetchmany(WRITE_CHUNK_SIZE):
+            for tx_id, amount, txn_id, provider_reference, approval_code, reference in rows:
+                entry = (tx_id, amount)
+                for key in (txn_id, provider_reference):
+                    if key:
+                        by_txn_id[key] = entry
+                if reference:
+                    by_reference[reference] = entry
+                code = settlement.short_approval_code(approval_code)
+                if code:
+                    by_approval_code[code] = None if code in by_approval_code else entry
+
+        # The hosted form sends the sale order name as order id
+        cr.execute("""
+            SELECT rel.transaction_id, tx.amount, so.name
+              FROM sale_order_transaction_rel rel
+              JOIN sale_order so ON so.id = rel.sale_order_id
+              JOIN payment_transaction tx ON tx.id = rel.transaction_id
+              JOIN payment_provider provider ON provider.id = tx.provider_id
+             WHERE provider.code = 'fiserv'
+               AND tx.state IN ('done', 'authorized')
+        """)
+        while rows := cr.fetchmany(WRITE_CHUNK_SIZE):
+            for tx_id, amount, order_name in rows:
+                by_reference.setdefault(order_name, (tx_id, amount))
+
+        return by_txn_id, by_reference, by_approval_code
+
+    def _import_settlement(self):
+        self.ensure_one()
+        started = time.monotonic()
+        self.env.flush_all()
+        self.env.cr.execute("DELETE FROM fiserv_settlement_line WHERE import_id = %s", [self.id])
+        # A re-import links the transactions found this time only
+        self.env.cr.execute(
+            "UPDATE payment_transaction SET fiserv_settlement_id = NULL WHERE fiserv_settlement_id = %s", [self.id]
+        )
+
+        index = self._build_transaction_index()
+        path, is_temporary = self._get_settlement_path()
+        counts = {'rows': 0, 'matched': 0, 'mismatch': 0}
+        buffer = []
+        stats = []
+        try:
+            options = self._get_parse_options()
+            parallel = self.processes != 1 and settlement.fork_is_safe()
+            if self.processes != 1 and not parallel:
+                _logger.warning(
+                    "Fiserv settlement %s parsed in a single process: this process runs several threads",
+                    self.name
+                )
+            if parallel:
+                results = settlement.iter_rows_parallel(
+                    path, self.file_format, self.processes or None, index, stats, **options
+                )
+            else:
+                results = (
+                    (row, settlement.match_row(row, index))
+                    for row in settlement.iter_rows(path, self.file_format, **options)
+                )
+            for row, (tx_id, match_type, difference) in results:
+                buffer.append((row, tx_id, match_type, difference))
+                counts['rows'] += 1
+                if tx_id:
+                    counts['matched'] += 1
+                    if difference:
+                        counts['mismatch'] += 1
+                if len(buffer) >= WRITE_CHUNK_SIZE:
+                    self._write_settlement_lines(buffer)
+                    buffer = []
+            if buffer:
+                self._write_settlement_lines(buffer)
+        except (UnicodeDecodeError, ValueError) as e:
+            raise UserError(_("No se pudo leer el archivo de liquidación: %s", e))
+        finally:
+            if is_temporary:
+                os.unlink(path)
+
+        self.invalidate_recordset(['line_ids'])
+        self.env['payment.transaction'].invalidate_model(['fiserv_settlement_id'])
+        self.write({
+            'state': 'done',
+            'error': False,
+            'row_count': counts['rows'],
+            'matched_count': counts['matched'],
+            'unmatched_count': counts['rows'] - counts['matched'],
+            'amount_mismatch_count': counts['mismatch'],
+            'duration': time.monotonic() - started,
+            'worker_stats': self._format_worker_stats(stats),
+        })
+        _logger.info(
+            "Fiserv settlement %s imported: %s rows, %s matched in %.1fs",
+            self.name, counts['rows'], counts['matched'], self.duration
+        )
+        if stats:
+            _logger.info("Fiserv settlement %s workers:\n%s", self.name, self.worker_stats)
+
+    @api.model
+    def _format_worker_stats(self, stats):
+        return '\n'.join(
+            "PID %(worker)s: %(ranges)s rangos, %(rows)s filas en %(seconds).1fs "
+            "(%(rows_per_second).0f filas/s, %(mb_per_second).1f MB/s)" % worker
+            for worker in settlement.worker_throughput(stats)
+        ) or False
+
+    def _write_settlement_lines(self, buffer):
+        """
+        Inserts the settlement lines of buffer and links the matched
+        transactions, one query each.
+        """
+        columns = list(zip(*[
+            (row.line_number, row.txn_id, row.approval_code, row.reference, row.amount,
+             row.installments, row.card_brand, row.date, tx_id, match_type, difference)
+            for row, tx_id, match_type, difference in buffer
+        ]))
+        self.env.cr.execute("""
+            INSERT INTO fiserv_settlement_line (
+                import_id, line_number, txn_id, approval_code, reference, amount,
+                installments, card_brand, settlement_date, transaction_id, match_type,
+                amount_difference, create_uid, write_uid, create_date, write_date
+            )
+            SELECT %s, unnest(%s::int[]), unnest(%s::varchar[]), unnest(%s::varchar[]),
+                   unnest(%s::varchar[]), unnest(%s::numeric[]), unnest(%s::int[]),
+                   unnest(%s::varchar[]), unnest(%s::varchar[]), unnest(%s::int[]),
+                   unnest(%s::varchar[]), unnest(%s::numeric[]),
+                   %s, %s, now() at time zone 'UTC', now() at time zone 'UTC'
+        """, [self.id, *[list(column) for column in columns], self.env.uid, self.env.uid])
+
+        matched = [tx_id for _row, tx_id, _type, _diff in buffer if tx_id]
+        if matched:
+            self.env.cr.execute("""
+                UPDATE payment_transaction
+                   SET fiserv_settlement_id = %s
+                 WHERE id = ANY(%s)
+            """, [self.id, matched])
+
+
+class FiservSettlementLine(models.Model):
+    _name = 'fiserv.settlement.line'
+    _description = 'Línea de liquidación Fiserv'
+    _order = 'import_id, line_number'
+
+    import_id = fields.Many2one('fiserv.settlement.import', required=True, ondelete='cascade', index=True)
+    line_number = fields.Integer(string='Línea')
+    txn_id = fields.Char(string='ID de transacción')
+    approval_code = fields.Char(string='Código de autorización')
+    reference = fields.Char(string='Referencia')
+    amount = fields.Float(string='Importe', digits=(16, 2))
+    installments = fields.Integer(string='Cuotas')
+    card_brand = fields.Char(string='Tarjeta')
+    settlement_date = fields.Char(string='Fecha')
+    transaction_id = fields.Many2one('payment.transaction', string='Transacción', index=True)
+    match_type = fields.Selection(MATCH_TYPES, string='Conciliación', default='none')
+    amount_difference = fields.Float(string='Diferencia', digits=(16, 2))
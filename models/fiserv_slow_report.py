@@ -0,0 +1,107 @@
+import functools
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models, tools
+
+from .. import const, slowpath
+
+_logger = logging.getLogger(__name__)
+
+# Reports older than this are deleted by the autovacuum
+REPORT_DAYS = 30
+
+
+class FiservSlowReport(models.Model):
+    """
+    Context of a Fiserv payment request that exceeded its latency budget
+    (see slowpath.py): stage timings, SQL queries and, for the requests
+    profiled after a previous breach, the top cumulative functions.
+
+    Budgets are set per endpoint with the SLOW_BUDGETS_PARAM system
+    parameter; without it nothing is measured beyond the stage timing.
+    Reports are written in their own transaction so the ones of failed
+    requests are kept, once the request transaction has ended so the
+    transaction it created can be linked.
+    """
+    _name = 'fiserv.slow.report'
+    _description = 'Solicitud lenta Fiserv'
+    _order = 'id desc'
+    _rec_name = 'reference'
+
+    endpoint = fields.Selection([
+        ('prepare_redirect', 'Preparación de redirección'),
+        ('return', 'Retorno'),
+        ('notify', 'Notificación'),
+    ], string='Endpoint', required=True, readonly=True)
+    reference = fields.Char(string='Referencia', readonly=True, index=True)
+    transaction_id = fields.Many2one('payment.transaction', string='Transacción', readonly=True, ondelete='set null')
+    duration_ms = fields.Float(string='Duración (ms)', readonly=True, digits=(16, 1))
+    budget_ms = fields.Float(string='Presupuesto (ms)', readonly=True, digits=(16, 1))
+    query_count = fields.Integer(string='Consultas SQL', readonly=True)
+    query_time_ms = fields.Float(string='Tiempo SQL (ms)', readonly=True, digits=(16, 1))
+    stages = fields.Text(string='Etapas', readonly=True)
+    profile = fields.Text(string='Perfil', readonly=True)
+    error = fields.Char(string='Error', readonly=True)
+
+    @api.model
+    @tools.ormcache()
+    def _get_budgets(self):
+        """
+        {endpoint: milliseconds} of SLOW_BUDGETS_PARAM, parsed once. Writing
+        a system parameter clears the cache.
+        """
+        return slowpath.parse_budgets(self.env['ir.config_parameter'].sudo().get_param(const.SLOW_BUDGETS_PARAM))
+
+    @api.model
+    def _get_budget(self, endpoint):
+        """Latency budget of endpoint in milliseconds, 0 when not watched."""
+        return self._get_budgets().get(endpoint, 0)
+
+    @api.model
+    def _store_report(self, report):
+        """
+        slowpath.watch() callback. The report is written after the request
+        transaction commits or rolls back: a separate cursor does not see the
+        transaction created by the request (prepare_redirect) before that.
+        Reports of failed requests are written right away.
+        """
+        cr = self.env.cr
+        if report['error'] or cr.closed:
+            self._write_report(report)
+            return
+        callback = functools.partial(self._write_report, report)
+        cr.postcommit.add(callback)
+        cr.postrollback.add(callback)
+
+    @api.model
+    def _write_report(self, report):
+        """Creates the report in a separate transaction."""
+        stages = '\n'.join(f'{name}: {milliseconds:.1f} ms' for name, milliseconds in report['stages_ms'])
+        try:
+            with self.env.registry.cursor() as cr:
+                env = self.env(cr=cr, su=True)
+                transaction = env['payment.transaction']
+                if report['key']:
+                    transaction = transaction.search([('reference', '=', report['key'])], limit=1)
+                env[self._name].create({
+                    'endpoint': report['endpoint'],
+                    'reference': report['key'],
+                    'transaction_id': transaction.id,
+                    'duration_ms': report['duration_ms'],
+                    'budget_ms': report['budget_ms'],
+                    'query_count': report['query_count'] or 0,
+                    'query_time_ms': report['query_time_ms'] or 0.0,
+                    'stages': stages,
+                    'profile': report['profile'],
+                    'error': report['error'],
+                })
+        except Exception:
+            _logger.warning("Could not store the Fiserv slow request report of %s %s",
+                            report['endpoint'], report['key'], exc_info=True)
+
+    @api.autovacuum
+    def _gc_old_reports(self):
+        self.sudo().search([
+            ('create_date', '<', fields.Datetime.now() - timedelta(days=REPORT_DAYS))
+        ]).unlink()
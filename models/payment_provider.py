@@ -1,18 +1,35 @@
-from odoo import _, api, fields, models, modules
+from odoo import _, api, fields, models, modules, tools
 from odoo.exceptions import UserError, ValidationError
 from odoo.tools.misc import file_path
 from werkzeug import urls
 from .. import const
+from ..fiserv_client import FiservAPIError, FiservClient, close_sessions
 import base64
+import functools
 import hashlib
 import logging
-import requests
 import os
 
 _logger = logging.getLogger(__name__)
 
+
+@functools.lru_cache(maxsize=None)
+def _read_module_image(*path_parts):
+    """
+    Returns the base64 content of an image shipped with the module, or None
+    if it does not exist. Read from disk once per process.
+    """
+    module_path = modules.get_module_path('fiserv_gateway')
+    image_path = os.path.join(module_path, *path_parts) if module_path else None
+    if not image_path or not os.path.exists(image_path):
+        return None
+    with open(image_path, 'rb') as f:
+        return base64.b64encode(f.read())
+
+
 class FiservCardInstallment(models.Model):
     _name = 'fiserv.card.installment'
+    _inherit = ['pos.load.mixin']
     _description = 'Cuotas para Configuración de Tarjetas Fiserv'
     _order = 'installments'
 
@@ -34,6 +51,46 @@ class FiservCardInstallment(models.Model):
             result.append((record.id, name))
         return result
 
+    @api.model
+    def _load_pos_data_domain(self, data):
+        return [('active', '=', True), ('card_config_id.active', '=', True)]
+
+    @api.model
+    def _load_pos_data_fields(self, config_id):
+        return ['id', 'card_config_id', 'installments', 'interest_rate', 'installment_to_send']
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env.registry.clear_cache()
+        self.env['fiserv.card.config']._notify_pos_plans_updated()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        self.env['fiserv.card.config']._notify_pos_plans_updated()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        self.env['fiserv.card.config']._notify_pos_plans_updated()
+        return res
+
+    @api.model
+    @tools.ormcache()
+    def _get_plan_rates(self):
+        """
+        Returns {(card_config_id, installments): interest_rate} for all the
+        active plans. Cached until a plan is created, modified or deleted.
+        """
+        plans = self.sudo().search_read([], ['card_config_id', 'installments', 'interest_rate'], load=False)
+        return {
+            (plan['card_config_id'], plan['installments']): plan['interest_rate']
+            for plan in plans
+        }
+
 class FiservCardConfig(models.Model):
     """
     This model manages the configuration of credit/debit card brands for the Fiserv payment gateway.
@@ -60,6 +117,7 @@ class FiservCardConfig(models.Model):
     This configuration is used both in website checkout and POS environments.
     """
     _name = 'fiserv.card.config'
+    _inherit = ['pos.load.mixin']
     _description = 'Configuración de Tarjetas Fiserv'
     _order = 'sequence, id'
 
@@ -94,33 +152,26 @@ class FiservCardConfig(models.Model):
 
     @api.model
     def init(self):
-        """Initialize card configurations from const data"""
-        for code, card_data in const.SUPPORTED_CARD_BRANDS.items():
-            existing = self.search([('code', '=', code)])
-            if not existing:
-                card_config = self.create({
-                    'code': code,
-                    'name': card_data['name'],
-                    'credit': card_data.get('credit', True),
-                    'debit': card_data.get('debit', True),
-                })
-
-                # Create installment by default
-                default_installments = [
-                    (1, 0.0),  # (Installments, interest_rate)
-                    (3, 10.0),
-                    (6, 18.0),
-                    (9, 32.0),
-                    (12, 44.0),
-                ]
-                
-                for num, rate in default_installments:
-                    self.env['fiserv.card.installment'].create({
-                        'card_config_id': card_config.id,
-                        'installments': num,
-                        'interest_rate': rate,
-                        'installment_to_send': str(num),
-                    })
+        """
+        Initialize card configurations from const data.
+        Missing brands are created with their default installment plans in a
+        single create() call.
+        """
+        existing_codes = set(self.with_context(active_test=False).search([]).mapped('code'))
+        vals_list = [{
+            'code': code,
+            'name': card_data['name'],
+            'credit': card_data.get('credit', True),
+            'debit': card_data.get('debit', True),
+            'installments': [(0, 0, {
+                'installments': num,
+                'interest_rate': rate,
+                'installment_to_send': str(num),
+            }) for num, rate in const.DEFAULT_INSTALLMENT_PLANS],
+        } for code, card_data in const.SUPPORTED_CARD_BRANDS.items() if code not in existing_codes]
+
+        if vals_list:
+            self.create(vals_list)
 
     def name_get(self):
         return [(record.id, f"{record.name} ({'Crédito' if record.credit else 'Débito'})") 
@@ -130,6 +181,40 @@ class FiservCardConfig(models.Model):
         ('unique_code', 'unique(code)', 'El código de tarjeta debe ser único')
     ]
 
+    @api.model
+    def _load_pos_data_domain(self, data):
+        return [('active', '=', True)]
+
+    @api.model
+    def _load_pos_data_fields(self, config_id):
+        return ['id', 'code', 'name', 'sequence', 'credit', 'debit']
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self._notify_pos_plans_updated()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self._notify_pos_plans_updated()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self._notify_pos_plans_updated()
+        return res
+
+    @api.model
+    def _notify_pos_plans_updated(self):
+        """
+        Tells the open POS sessions to reload the card brands and installment
+        plans they loaded at startup.
+        """
+        configs = self.env['pos.config'].sudo().search([('current_session_id', '!=', False)])
+        for config in configs:
+            config._notify(('FISERV_PLANS_UPDATED', {}))
+
     def action_open_card_config(self):
         self.ensure_one()
         return {
@@ -163,6 +248,25 @@ class PaymentProvider(models.Model):
         required_if_provider='fiserv',
         groups='base.group_system'
     )
+
+    fiserv_api_key = fields.Char(
+        string="API Key",
+        help="API key for server to server calls (status inquiry, capture, void, refund)",
+        groups='base.group_system'
+    )
+
+    fiserv_api_secret = fields.Char(
+        string="API Secret",
+        help="API secret used to sign the server to server calls",
+        groups='base.group_system'
+    )
+
+    fiserv_api_url = fields.Char(
+        string="API URL",
+        help="Leave empty to use the Fiserv URL of the selected environment. "
+             "Set it to the local stub (tools/api_stub.py) to test offline.",
+        groups='base.group_system'
+    )
         
     description = fields.Text(
         string='Description',
@@ -207,7 +311,34 @@ class PaymentProvider(models.Model):
         default=True,
         help="Enable payment in installments"
     )
-    
+
+    fiserv_interest_mode = fields.Selection([
+        ('reprice', 'Re-price order lines'),
+        ('surcharge', 'Single surcharge line'),
+    ], string='Interest Booking', default='reprice',
+        help="'Re-price order lines' spreads the financing interest over the unit price "
+             "of every order line. 'Single surcharge line' books the interest as one "
+             "dedicated line and leaves the original prices untouched.")
+
+    fiserv_interest_product_id = fields.Many2one(
+        'product.product',
+        string='Interest Product',
+        default=lambda self: self.env.ref(
+            'fiserv_gateway.product_fiserv_interest', raise_if_not_found=False
+        ),
+        help="Product used for the financing surcharge line. Its taxes are applied to the interest."
+    )
+
+    fiserv_adjustment_product_id = fields.Many2one(
+        'product.product',
+        string='Rounding Adjustment Product',
+        default=lambda self: self.env['product.product'].search(
+            [('default_code', '=', 'AJUSTE_RED')], limit=1
+        ),
+        help="Product used for the line that absorbs the rounding difference with the "
+             "total charged by Fiserv. Its taxes are applied to the adjustment."
+    )
+
     fiserv_checkout_mode = fields.Selection(
         selection=lambda self: list(const.CHECKOUT_MODES.items()),
         default='combinedpage',
@@ -415,6 +546,11 @@ class PaymentProvider(models.Model):
             raise ValidationError(_("Payment environment not configured"))            
         if self.fiserv_environment not in ['test', 'prod']:
             raise ValidationError(_("Invalid payment environment"))        
+        if self.fiserv_environment == 'test':
+            # Lets load tests point the hosted page at tools/gateway_simulator.py
+            simulator_url = self.env['ir.config_parameter'].sudo().get_param(const.TEST_REDIR_URL_PARAM)
+            if simulator_url:
+                return simulator_url
         try:
             return const.REDIR_URLS[self.fiserv_environment]
         except KeyError:
@@ -436,32 +572,29 @@ class PaymentProvider(models.Model):
         """
         Creates or retrieves the default 'Tarjetas' payment method.
         Sets up child payment methods for each supported card type.
+
+        Idempotent: existing methods are only written when a value or the
+        image content differs, and missing ones are created in one batch.
         """
         self.ensure_one()
         if self.code != 'fiserv':
             return super()._get_default_payment_method()
 
-        module_path = modules.get_module_path('fiserv_gateway')
-        if not module_path:
-            _logger.error("No se pudo encontrar el path del módulo fiserv_gateway")
-            return False
+        PaymentMethod = self.env['payment.method'].with_context(active_test=False)
+        methods = PaymentMethod.search([('code', 'in', list(const.DEFAULT_PAYMENT_METHOD_CODES))])
+        methods_by_code = {method.code: method for method in methods}
+        image_checksums = self._get_payment_method_image_checksums(methods)
 
-        default_method = self.env['payment.method'].search([('code', '=', 'tarjetas')], limit=1)
+        default_method = methods_by_code.get('tarjetas')
         if not default_method:
-            image_path = os.path.join(module_path, 'static', 'images', 'tarjetas.webp')
-            image_base64 = None
-            if os.path.exists(image_path):
-                with open(image_path, 'rb') as f:
-                    image_base64 = base64.b64encode(f.read())
-
-            default_method = self.env['payment.method'].create({
+            default_method = PaymentMethod.create({
                 'name': 'Tarjetas',
                 'code': 'tarjetas',
                 'active': True,
                 'support_tokenization': True,
                 'is_primary': True,
                 'provider_ids': [(4, self.id)],
-                'image': image_base64,
+                'image': _read_module_image('static', 'images', 'tarjetas.webp'),
             })
 
         card_image_mapping = {
@@ -473,34 +606,70 @@ class PaymentProvider(models.Model):
             'tuya': 'tuya.png',
         }
 
-        for method_code in const.DEFAULT_PAYMENT_METHOD_CODES - {'tarjetas'}:
-            child_method = self.env['payment.method'].search([('code', '=', method_code)], limit=1)
-            formatted_name = method_code.replace('_', ' ').title()
-            
-            image_base64 = None
-            if method_code in card_image_mapping:
-                image_path = os.path.join(module_path, 'static', 'images', card_image_mapping[method_code])
-                if os.path.exists(image_path):
-                    with open(image_path, 'rb') as f:
-                        image_base64 = base64.b64encode(f.read())
-
+        to_create = []
+        for method_code in sorted(const.DEFAULT_PAYMENT_METHOD_CODES - {'tarjetas'}):
+            image_name = card_image_mapping.get(method_code)
             values = {
-                'name': formatted_name,
+                'name': method_code.replace('_', ' ').title(),
                 'code': method_code,
                 'primary_payment_method_id': default_method.id,
                 'active': True,
                 'support_tokenization': True,
                 'is_primary': False,
-                'image': image_base64,
+                'image': _read_module_image('static', 'images', image_name) if image_name else None,
             }
 
+            child_method = methods_by_code.get(method_code)
             if not child_method:
-                self.env['payment.method'].create(values)
-            else:
-                child_method.write(values)
+                to_create.append(values)
+                continue
+
+            changes = self._get_payment_method_changes(child_method, values, image_checksums)
+            if changes:
+                child_method.write(changes)
+
+        if to_create:
+            PaymentMethod.create(to_create)
 
         return default_method
 
+    def _get_payment_method_image_checksums(self, methods):
+        """
+        Returns {payment_method_id: checksum} of the stored images, read from
+        the attachments without loading their content.
+        """
+        if not methods:
+            return {}
+        attachments = self.env['ir.attachment'].sudo().search_read([
+            ('res_model', '=', 'payment.method'),
+            ('res_field', '=', 'image'),
+            ('res_id', 'in', methods.ids),
+        ], ['res_id', 'checksum'])
+        return {attachment['res_id']: attachment['checksum'] for attachment in attachments}
+
+    def _get_payment_method_changes(self, method, values, image_checksums):
+        """
+        Returns the subset of values that differs from what method stores.
+        The image is compared by the checksum of its stored (resized) content.
+        """
+        changes = {}
+        for name, value in values.items():
+            if name == 'image':
+                continue
+            current = method[name]
+            if isinstance(current, models.BaseModel):
+                current = current.id
+            if current != value:
+                changes[name] = value
+
+        image = values.get('image')
+        if image:
+            stored = method._fields['image']._image_process(image, self.env)
+            checksum = hashlib.sha1(base64.b64decode(stored or b'')).hexdigest()
+            if image_checksums.get(method.id) != checksum:
+                changes['image'] = image
+        return changes
+
     def _update_existing_payment_methods(self):
         """
         Updates existing payment methods to match current configuration.
@@ -542,6 +711,13 @@ class PaymentProvider(models.Model):
                 'payment_method_ids': [(4, tarjetas_method.id)]
             })
     
+    def _compute_feature_support_fields(self):
+        """Fiserv refunds through the API, in full or in part."""
+        super()._compute_feature_support_fields()
+        self.filtered(lambda p: p.code == 'fiserv').update({
+            'support_refund': 'partial',
+        })
+
     @api.depends('code')
     def _compute_support_authorize(self):
         """
@@ -610,27 +786,93 @@ class PaymentProvider(models.Model):
         for provider in providers:
             if provider.code == 'fiserv':
                 # Cargar y redimensionar la imagen
-                module_path = modules.get_module_path('fiserv_gateway')
-                image_path = os.path.join(module_path, 'static', 'description', 'icon.png')
-                
-                if os.path.exists(image_path):
-                    with open(image_path, 'rb') as f:
-                        image_content = f.read()
-                        provider.write({
-                            'image_128': base64.b64encode(image_content),
-                            'support_refund': False,
-                            'support_tokenization': True,
-                            'available_country_ids': [(6, 0, [self.env.ref('base.ar').id])]
-                        })
+                image = _read_module_image('static', 'description', 'icon.png')
+                if image:
+                    provider.write({
+                        'image_128': image,
+                        'support_tokenization': True,
+                        'available_country_ids': [(6, 0, [self.env.ref('base.ar').id])]
+                    })
                 
                 if not provider.reference:
                     provider.reference = provider._default_reference()
                 
                 provider._get_default_payment_method()
                 provider._ensure_payment_method_assignment()
-        
+
         return providers
 
+    def write(self, vals):
+        """
+        Closes the pooled API sessions when the API credentials change.
+        """
+        res = super().write(vals)
+        if {'fiserv_api_key', 'fiserv_api_secret', 'fiserv_api_url', 'fiserv_environment'} & set(vals):
+            for provider in self:
+                close_sessions(provider.id)
+        return res
+
+    def _fiserv_get_client(self):
+        """
+        Returns the Fiserv REST API client of the provider. The underlying
+        HTTP session is pooled per provider and reused between calls.
+        """
+        self.ensure_one()
+        provider = self.sudo()
+        if not provider.fiserv_api_key or not provider.fiserv_api_secret:
+            raise ValidationError(_("Fiserv: API credentials are not configured."))
+        base_url = provider.fiserv_api_url or const.API_URLS[provider.fiserv_environment or 'test']
+        return FiservClient(
+            base_url,
+            provider.fiserv_api_key,
+            provider.fiserv_api_secret,
+            store_id=provider.fiserv_store_name,
+            pool_key=provider.id,
+        )
+
+    def _fiserv_make_request(self, method_name, *args):
+        """
+        Calls method_name on the provider's API client.
+
+        Raises:
+            ValidationError: If the call fails, with the Fiserv error message
+        """
+        try:
+            return getattr(self._fiserv_get_client(), method_name)(*args)
+        except FiservAPIError as e:
+            self.env['fiserv.transaction.log'].sudo().log_error({
+                'error_type': 'api_request_error',
+                'api_method': method_name,
+                'status_code': e.status_code,
+                'error_message': str(e),
+                'response': e.payload,
+            })
+            raise ValidationError(_("Fiserv: %s", str(e)))
+
+    def _get_fiserv_product(self, field_name):
+        """
+        Returns the product configured in field_name, empty when none is.
+        Providers configured before the adjustment product field existed are
+        backfilled by the 18.0.1.1 migration, not searched here.
+        """
+        self.ensure_one()
+        return self.sudo()[field_name]
+
+    @api.model
+    @tools.ormcache('product_id', 'company_id')
+    def _get_fiserv_product_profile(self, product_id, company_id):
+        """
+        Returns the sale tax ids of the product for the given company.
+        Cached per product and company so the order adjustment path does not
+        read the product taxes; the cache is cleared when the taxes of a
+        Fiserv interest or adjustment product are written.
+        """
+        if not product_id:
+            return ()
+        product = self.env['product.product'].sudo().browse(product_id)
+        company = self.env['res.company'].browse(company_id)
+        return tuple(product.taxes_id._filter_taxes_by_company(company).ids)
+
     @api.model
     def _get_fiserv_card_brand_mapping(self):
         """
@@ -3,9 +3,11 @@ from odoo.exceptions import UserError, ValidationError
 from decimal import Decimal, getcontext
 from werkzeug import urls
 from odoo.http import request 
-from datetime import datetime
-from .. import const
-import hashlib
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from odoo.tools import float_compare, str2bool
+from .. import const, metrics, timing, utils
+from ..fiserv_client import FiservAPIError
 import logging
 import json
 import pprint
@@ -13,6 +15,24 @@ import hmac
 
 _logger = logging.getLogger(__name__)
 
+# Format of the txndatetime sent with the hosted payment form
+TXNDATETIME_FORMAT = '%Y:%m:%d-%H:%M:%S'
+
+# Seconds a Fiserv transaction time may precede the txndatetime sent (clock skew)
+TXN_TIME_TOLERANCE = 120
+
+
+def _fiserv_fetch_order(client, order_id):
+    """
+    Order inquiry run in the reconciliation worker threads.
+    Returns (response, None) or (None, FiservAPIError).
+    """
+    try:
+        return client.get_order(order_id), None
+    except FiservAPIError as e:
+        return None, e
+
+
 class PaymentTransaction(models.Model):
     _inherit = 'payment.transaction'
 
@@ -88,6 +108,27 @@ class PaymentTransaction(models.Model):
         readonly=True,
         help='Response code received from Fiserv gateway'
     )
+
+    fiserv_settlement_id = fields.Many2one(
+        'fiserv.settlement.import',
+        string='Liquidación',
+        readonly=True,
+        index='btree_not_null',
+        help='Archivo de liquidación de Fiserv en el que se concilió la transacción'
+    )
+
+    fiserv_txndatetime = fields.Char(
+        string='Fiserv txndatetime',
+        readonly=True,
+        index='btree_not_null',
+        help='txndatetime enviado a Fiserv en el último intento de pago de esta transacción'
+    )
+
+    fiserv_chargetotal = fields.Char(
+        string='Fiserv chargetotal',
+        readonly=True,
+        help='chargetotal enviado a Fiserv en el último intento de pago de esta transacción'
+    )
     
     def _get_specific_rendering_values(self, processing_values):
         """
@@ -147,7 +188,7 @@ class PaymentTransaction(models.Model):
             sale_order = self.sale_order_ids and self.sale_order_ids[0] or False
             shipping_partner = sale_order and sale_order.partner_shipping_id or partner
             
-            current_datetime = datetime.now().strftime('%Y:%m:%d-%H:%M:%S')
+            current_datetime = datetime.now().strftime(TXNDATETIME_FORMAT)
             store_name = self.provider_id.fiserv_store_name
             shared_secret = self.provider_id.fiserv_shared_secret
             currency = '032'
@@ -168,6 +209,9 @@ class PaymentTransaction(models.Model):
                 currency = currency,
                 shared_secret=shared_secret
             )
+
+            # Identifies this attempt among the ones sharing the order id (oid)
+            self.write({'fiserv_txndatetime': current_datetime, 'fiserv_chargetotal': charge_total})
             
             phone = (self.partner_id.phone or '').replace('+54', '0').replace(' ', '')
             street = (self.partner_id.street or '').replace('.', '')
@@ -327,9 +371,7 @@ class PaymentTransaction(models.Model):
                 # Note: shared_secret is intentionally omitted for security
             })
             
-            string_to_hash = f"{store_name}{datetime_str}{charge_total}{currency}{shared_secret}"
-            ascii_hex = string_to_hash.encode().hex()
-            hash_value = hashlib.sha1(ascii_hex.encode()).hexdigest()
+            hash_value = utils.request_hash(store_name, datetime_str, charge_total, currency, shared_secret)
             
             # Log successful hash generation
             logger.save_transaction_log({
@@ -474,44 +516,52 @@ class PaymentTransaction(models.Model):
             return super()._handle_notification_data(provider_code, notification_data)
         
         logger = self.env['fiserv.transaction.log'].sudo()
-        
-        try:
-            # Log incoming notification
-            logger.log_notification({
-                'transaction_reference': notification_data.get('oid'),
-                'raw_notification': notification_data,
-                'stage': 'received'
-            })
 
-            if not self._verify_fiserv_signature(notification_data):
-                logger.log_error({
-                    'transaction_reference': notification_data.get('oid'), 
-                    'error_type': 'invalid_signature',
-                    'notification_data': notification_data
-                })
-                raise ValidationError(_("Invalid notification signature"))
+        with self._fiserv_timing('notification'):
+            try:
+                # Log incoming notification
+                with timing.stage('log'):
+                    logger.log_notification({
+                        'transaction_reference': notification_data.get('oid'),
+                        'raw_notification': notification_data,
+                        'stage': 'received'
+                    })
 
-            self._validate_transaction_state()
-            self._update_transaction_data(notification_data)
-            self._process_fiserv_status(notification_data)
+                with timing.stage('signature'):
+                    valid_signature = self._verify_fiserv_signature(notification_data)
+                if not valid_signature:
+                    metrics.inc('fiserv_signature_failures_total')
+                    logger.log_error({
+                        'transaction_reference': notification_data.get('oid'), 
+                        'error_type': 'invalid_signature',
+                        'notification_data': notification_data
+                    })
+                    raise ValidationError(_("Invalid notification signature"))
+
+                with timing.stage('state_check'):
+                    self._validate_transaction_state()
+                with timing.stage('update_transaction'):
+                    self._update_transaction_data(notification_data)
+                with timing.stage('process_status'):
+                    self._process_fiserv_status(notification_data)
             
-            # Log successful processing
-            logger.save_transaction_log({
-                'transaction_reference': self.reference,
-                'status': 'success',
-                'notification_processed': True,
-                'transaction_state': self.state
-            })
+                # Log successful processing
+                logger.save_transaction_log({
+                    'transaction_reference': self.reference,
+                    'status': 'success',
+                    'notification_processed': True,
+                    'transaction_state': self.state
+                })
                 
-        except Exception as e:
-            # Log error details
-            logger.log_error({
-                'transaction_reference': notification_data.get('oid'),
-                'error_type': 'notification_processing_error',
-                'error_message': str(e),
-                'notification_data': notification_data
-            })
-            raise ValidationError(_("Error processing payment notification: %s") % str(e))
+            except Exception as e:
+                # Log error details
+                logger.log_error({
+                    'transaction_reference': notification_data.get('oid'),
+                    'error_type': 'notification_processing_error',
+                    'error_message': str(e),
+                    'notification_data': notification_data
+                })
+                raise ValidationError(_("Error processing payment notification: %s") % str(e))
 
     def _handle_feedback_data(self, provider_code, data):
         """Handle the feedback data received from Fiserv on success return URL.
@@ -532,61 +582,68 @@ class PaymentTransaction(models.Model):
             return super()._handle_feedback_data(provider_code, data)
             
         logger = self.env['fiserv.transaction.log'].sudo()
-        
-        try:
-            # Log feedback receipt
-            logger.save_transaction_log({
-                'transaction_reference': self.reference,
-                'feedback_data': data,
-                'stage': 'feedback_received'
-            })
+
+        with self._fiserv_timing('feedback'):
+            try:
+                # Log feedback receipt
+                with timing.stage('log'):
+                    logger.save_transaction_log({
+                        'transaction_reference': self.reference,
+                        'feedback_data': data,
+                        'stage': 'feedback_received'
+                    })
             
-            # Basic validation
-            if not data.get('approval_code'):
-                raise ValidationError(_("Missing approval code in feedback data"))
+                # Basic validation
+                if not data.get('approval_code'):
+                    raise ValidationError(_("Missing approval code in feedback data"))
                 
-            # Extract status from approval code
-            status_code = data['approval_code'].split(':')[0] if ':' in data['approval_code'] else data['approval_code']
-            
-            # Update transaction data
-            feedback_data = {
-                'fiserv_approval_code': data.get('approval_code'),
-                'fiserv_card_number': data.get('cardnumber', '').replace('X', '*'),
-                'fiserv_response_code': status_code,
-                'fiserv_error_message': data.get('fail_reason') or data.get('status_message')
-            }
+                # Extract status from approval code
+                status_code = data['approval_code'].split(':')[0] if ':' in data['approval_code'] else data['approval_code']
             
-            self.write(feedback_data)
+                # Update transaction data
+                feedback_data = {
+                    'fiserv_approval_code': data.get('approval_code'),
+                    'fiserv_card_number': data.get('cardnumber', '').replace('X', '*'),
+                    'fiserv_response_code': status_code,
+                    'fiserv_error_message': data.get('fail_reason') or data.get('status_message')
+                }
             
-            # Map status to Odoo transaction state
-            if status_code == 'Y':
-                self._set_done()
-                # If payment successful, confirm the order
-                if hasattr(self, 'sale_order_ids') and self.sale_order_ids:
-                    self.sale_order_ids._confirm_fiserv_payment()
-            elif status_code == 'N':
-                self._set_canceled("Payment declined by Fiserv")
-            else:
-                self._set_error("Invalid payment status received")
+                with timing.stage('update_transaction'):
+                    self.write(feedback_data)
+            
+                # Map status to Odoo transaction state
+                if status_code == 'Y':
+                    with timing.stage('set_state'):
+                        self._set_done()
+                    # If payment successful, confirm the order
+                    if hasattr(self, 'sale_order_ids') and self.sale_order_ids:
+                        with timing.stage('confirm_order'):
+                            self.sale_order_ids._confirm_fiserv_payment()
+                elif status_code == 'N':
+                    with timing.stage('set_state'):
+                        self._set_canceled("Payment declined by Fiserv")
+                else:
+                    with timing.stage('set_state'):
+                        self._set_error("Invalid payment status received")
                 
-            # Log successful processing
-            logger.save_transaction_log({
-                'transaction_reference': self.reference,
-                'status': 'success',
-                'feedback_processed': True,
-                'transaction_state': self.state
-            })
+                # Log successful processing
+                logger.save_transaction_log({
+                    'transaction_reference': self.reference,
+                    'status': 'success',
+                    'feedback_processed': True,
+                    'transaction_state': self.state
+                })
             
-            return True
+                return True
             
-        except Exception as e:
-            logger.log_error({
-                'transaction_reference': self.reference,
-                'error_type': 'feedback_processing_error',
-                'error_message': str(e),
-                'feedback_data': data
-            })
-            raise ValidationError(_("Error processing payment feedback: %s") % str(e))
+            except Exception as e:
+                logger.log_error({
+                    'transaction_reference': self.reference,
+                    'error_type': 'feedback_processing_error',
+                    'error_message': str(e),
+                    'feedback_data': data
+                })
+                raise ValidationError(_("Error processing payment feedback: %s") % str(e))
     
     def _update_transaction_data(self, notification_data):
         """
@@ -807,11 +864,12 @@ class PaymentTransaction(models.Model):
             # Process related orders
             for order in self.sale_order_ids.filtered(lambda o: o.state in ['draft', 'sent']):
                 # Force update order amounts with interest
-                order.with_context(
-                    fiserv_adjusting_interest=True,
-                    fiserv_transaction_id=self.id,
-                    fiserv_final_amount=float(charge_total)
-                )._update_amounts_with_interest()
+                with timing.stage('reprice_order'):
+                    order.with_context(
+                        fiserv_adjusting_interest=True,
+                        fiserv_transaction_id=self.id,
+                        fiserv_final_amount=float(charge_total)
+                    )._update_amounts_with_interest()
                 
                 logger.save_transaction_log({
                     'transaction_reference': self.reference,
@@ -820,7 +878,8 @@ class PaymentTransaction(models.Model):
                     'amount_with_interest': float(charge_total)
                 })
                 
-                order.with_context(bypass_follower_check=True).action_confirm()
+                with timing.stage('action_confirm'):
+                    order.with_context(bypass_follower_check=True).action_confirm()
                 
         except Exception as e:
             logger.log_error({
@@ -893,19 +952,19 @@ class PaymentTransaction(models.Model):
                 'components': {k:v for k,v in components.items() if k != 'sharedsecret'}
             })
 
+            shared_secret = self.provider_id.fiserv_shared_secret
             if 'notification_hash' in notification_data:
-                concat_string = components['chargetotal'] + self.provider_id.fiserv_shared_secret + \
-                                components['currency'] + components['txndatetime'] + \
-                                components['storename'] + components['approval_code']
+                calculated_hash = utils.notification_hash(
+                    components['chargetotal'], shared_secret, components['currency'],
+                    components['txndatetime'], components['storename'], components['approval_code']
+                )
                 received_hash = notification_data['notification_hash']
             else:
-                concat_string = self.provider_id.fiserv_shared_secret + components['approval_code'] + \
-                                components['chargetotal'] + components['currency'] + \
-                                components['txndatetime'] + components['storename']
+                calculated_hash = utils.response_hash(
+                    shared_secret, components['approval_code'], components['chargetotal'],
+                    components['currency'], components['txndatetime'], components['storename']
+                )
                 received_hash = notification_data.get('response_hash', '')
-
-            bin_hex = concat_string.encode('utf-8').hex()
-            calculated_hash = hashlib.sha1(bin_hex.encode('utf-8')).hexdigest()
             
             matches = calculated_hash == received_hash
             
@@ -937,6 +996,287 @@ class PaymentTransaction(models.Model):
                 self.reference, self.state, ', '.join(valid_states)
             ))
 
+    def _fiserv_timing(self, pipeline, force=False):
+        """
+        Stage timing of a payment pipeline (see timing.py), enabled with the
+        STAGE_TIMING_PARAM system parameter. Each run is also written to the
+        transaction's fiserv_timing log file once the transaction commits.
+        With force the stages are timed without the parameter (and not
+        logged), e.g. for the slow request reports.
+        """
+        enabled = str2bool(self.env['ir.config_parameter'].sudo().get_param(const.STAGE_TIMING_PARAM, 'False'))
+        return timing.pipeline(
+            pipeline, self[:1].reference or None, enabled or force,
+            on_finish=self._fiserv_log_timing if enabled else None,
+        )
+
+    def _fiserv_log_timing(self, run):
+        self.env['fiserv.transaction.log'].sudo().defer_transaction_log(
+            dict(run.as_dict(), transaction_reference=run.key or 'unknown'),
+            filename_prefix='fiserv_timing',
+            log_type='debug',
+        )
+
+    @api.model
+    def _search_fiserv_attempt(self, oid, txndatetime=None):
+        """
+        Fiserv transaction a notification or return refers to. The oid is
+        the transaction reference or, as sent by the hosted form, the name
+        of its sale order: every attempt of the order shares it, so the
+        attempt is then identified by the txndatetime it sent. Never falls
+        back to another attempt of the order.
+        """
+        tx = self.sudo().search([
+            ('reference', '=', oid),
+            ('provider_code', '=', 'fiserv')
+        ], limit=1, order='create_date DESC')
+        if not tx and txndatetime:
+            tx = self.sudo().search([
+                ('sale_order_ids.name', '=', oid),
+                ('fiserv_txndatetime', '=', txndatetime),
+                ('provider_code', '=', 'fiserv')
+            ], limit=1)
+        return tx
+
+    def _get_fiserv_order_id(self):
+        """Order id (oid) sent to Fiserv with the hosted payment form."""
+        self.ensure_one()
+        sale_order = self.sale_order_ids[:1]
+        return sale_order.name if sale_order else str(self.reference)
+
+    @api.model
+    def _cron_fiserv_reconcile_pending(self, batch_size=200, max_workers=8, stale_minutes=30,
+                                       abandon_hours=24, commit=True):
+        """
+        Resolves Fiserv transactions whose notification never arrived.
+
+        Draft and pending transactions older than stale_minutes are selected
+        by batches of batch_size and their status is queried on the Fiserv
+        API with up to max_workers concurrent requests. Only the HTTP calls run
+        in the worker threads; the results are applied in this thread through
+        _process_fiserv_status, each transaction in its own savepoint, and each
+        batch is committed on its own. Transactions unknown to Fiserv after
+        abandon_hours are canceled.
+
+        Every attempt of a sale order is sent with the same order id, so an
+        answer is only applied to the attempt it matches (see
+        _fiserv_match_api_transaction), and the attempts of orders that
+        already have a done transaction are skipped.
+
+        Returns:
+            dict: Number of transactions checked, resolved, canceled, skipped and failed
+        """
+        now = fields.Datetime.now()
+        domain = [
+            ('provider_code', '=', 'fiserv'),
+            ('state', 'in', ['draft', 'pending']),
+            ('create_date', '<', now - timedelta(minutes=stale_minutes)),
+        ]
+        summary = {'checked': 0, 'resolved': 0, 'canceled': 0, 'skipped': 0, 'failed': 0}
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fiserv_reconcile') as executor:
+            while True:
+                batch = self.search(domain + [('id', '>', last_id)], order='id', limit=batch_size)
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                batch._fiserv_reconcile_batch(executor, now - timedelta(hours=abandon_hours), summary)
+                if commit:
+                    self.env.cr.commit()
+                self.env.invalidate_all()
+
+        _logger.info("Fiserv reconciliation of pending transactions: %s", summary)
+        return summary
+
+    def _fiserv_reconcile_batch(self, executor, abandon_before, summary):
+        """
+        Queries the status of the transactions in self concurrently and
+        applies the answers. Updates summary in place.
+        """
+        clients = {}
+        jobs = []
+        for tx in self:
+            if tx.sale_order_ids.transaction_ids.filtered(lambda t: t.state == 'done'):
+                summary['skipped'] += 1
+                continue
+            provider = tx.provider_id
+            if provider.id not in clients:
+                try:
+                    clients[provider.id] = provider._fiserv_get_client()
+                except ValidationError:
+                    clients[provider.id] = None
+            if clients[provider.id]:
+                jobs.append((tx, provider.id, tx._get_fiserv_order_id()))
+
+        # Threads only perform HTTP: no environment nor cursor is used there.
+        # The attempts of an order share its order id: it is queried once.
+        futures = {}
+        for tx, provider_id, order_id in jobs:
+            if (provider_id, order_id) not in futures:
+                futures[(provider_id, order_id)] = executor.submit(_fiserv_fetch_order, clients[provider_id], order_id)
+
+        logger = self.env['fiserv.transaction.log'].sudo()
+        for tx, provider_id, order_id in jobs:
+            summary['checked'] += 1
+            response, error = futures[(provider_id, order_id)].result()
+            try:
+                with self.env.cr.savepoint():
+                    if error is not None:
+                        if error.status_code == 404 and tx.create_date < abandon_before:
+                            tx._set_canceled(_("Fiserv has no record of this payment."))
+                            summary['canceled'] += 1
+                        elif error.status_code != 404:
+                            summary['failed'] += 1
+                        continue
+
+                    notification_data = tx._fiserv_api_to_notification_data(response)
+                    if not notification_data:
+                        continue
+                    tx._process_fiserv_status(notification_data)
+                    summary['resolved'] += 1
+            except Exception as e:
+                summary['failed'] += 1
+                _logger.warning("Fiserv reconciliation of %s failed", tx.reference, exc_info=True)
+                logger.log_error({
+                    'transaction_reference': tx.reference,
+                    'error_type': 'reconciliation_error',
+                    'error_message': str(e),
+                })
+                tx.invalidate_recordset()
+
+    def _fiserv_api_to_notification_data(self, order_data):
+        """
+        Converts an order inquiry answer of the Fiserv API into the
+        notification format handled by _process_fiserv_status.
+        Returns None while the order has no transaction matching this attempt.
+        """
+        self.ensure_one()
+        transaction = self._fiserv_match_api_transaction(order_data.get('transactions') or [])
+        if not transaction:
+            return None
+        processor = transaction.get('processor') or {}
+        status = transaction.get('transactionStatus')
+        amount = (transaction.get('approvedAmount') or {}).get('total')
+        return {
+            'oid': order_data.get('orderId'),
+            'status': {'APPROVED': 'APROBADO', 'WAITING': 'PENDING'}.get(status, 'RECHAZADO'),
+            'approval_code': processor.get('approvalCode', ''),
+            'txnid': transaction.get('ipgTransactionId'),
+            'chargetotal': amount if amount is not None else self.amount,
+            'number_of_installments': str(self.fiserv_installments or 1),
+        }
+
+    def _fiserv_match_api_transaction(self, transactions):
+        """
+        Returns the transaction of a Fiserv order inquiry made by this
+        attempt, or None. Matches the ipgTransactionId when it is known,
+        otherwise the chargetotal sent and a transaction time between the
+        txndatetime of this attempt and the one of the next attempt of the
+        same order. Transactions already linked to another attempt and
+        attempts never sent to Fiserv do not match.
+        """
+        self.ensure_one()
+        ipg_transaction_id = self.provider_reference or self.fiserv_txn_id
+        if ipg_transaction_id:
+            return next((t for t in transactions if t.get('ipgTransactionId') == ipg_transaction_id), None)
+        if not self.fiserv_txndatetime or not self.fiserv_chargetotal:
+            return None
+
+        attempts = self.sale_order_ids.transaction_ids - self
+        taken = {t for t in attempts.mapped('provider_reference') + attempts.mapped('fiserv_txn_id') if t}
+        later = sorted(t for t in attempts.mapped('fiserv_txndatetime') if t and t > self.fiserv_txndatetime)
+        # txndatetime is the local time of the server that sent the form
+        sent_at = datetime.strptime(self.fiserv_txndatetime, TXNDATETIME_FORMAT).timestamp()
+        next_sent_at = datetime.strptime(later[0], TXNDATETIME_FORMAT).timestamp() if later else None
+
+        candidates = []
+        for transaction in transactions:
+            time = transaction.get('transactionTime') or 0
+            total = (transaction.get('approvedAmount') or {}).get('total')
+            if (transaction.get('ipgTransactionId') in taken or total is None
+                    or time < sent_at - TXN_TIME_TOLERANCE
+                    or (next_sent_at is not None and time >= next_sent_at - TXN_TIME_TOLERANCE)):
+                continue
+            if float_compare(float(total), float(self.fiserv_chargetotal), precision_digits=2) == 0:
+                candidates.append(transaction)
+        # Retries within the same hosted page: the last one is the outcome
+        return max(candidates, key=lambda t: t.get('transactionTime') or 0, default=None)
+
+    def _send_capture_request(self, amount_to_capture=None):
+        """
+        Captures an authorized Fiserv payment through the API.
+        """
+        child_capture_tx = super()._send_capture_request(amount_to_capture=amount_to_capture)
+        if self.provider_code != 'fiserv':
+            return child_capture_tx
+
+        tx = child_capture_tx or self
+        response = self.provider_id._fiserv_make_request(
+            'capture', self.provider_reference, tx.amount, self.currency_id.name
+        )
+        tx._fiserv_apply_api_response(response, 'capture')
+        return child_capture_tx
+
+    def _send_void_request(self, amount_to_void=None):
+        """
+        Voids an authorized Fiserv payment through the API.
+        """
+        child_void_tx = super()._send_void_request(amount_to_void=amount_to_void)
+        if self.provider_code != 'fiserv':
+            return child_void_tx
+
+        tx = child_void_tx or self
+        response = self.provider_id._fiserv_make_request('void', self.provider_reference)
+        tx._fiserv_apply_api_response(response, 'void')
+        return child_void_tx
+
+    def _send_refund_request(self, amount_to_refund=None):
+        """
+        Refunds a Fiserv payment through the API.
+        The refund transaction created by the parent holds a negative amount.
+        """
+        refund_tx = super()._send_refund_request(amount_to_refund=amount_to_refund)
+        if self.provider_code != 'fiserv':
+            return refund_tx
+
+        response = self.provider_id._fiserv_make_request(
+            'refund', self.provider_reference, -refund_tx.amount, self.currency_id.name
+        )
+        refund_tx._fiserv_apply_api_response(response, 'refund')
+        return refund_tx
+
+    def _fiserv_apply_api_response(self, response, operation):
+        """
+        Updates the transaction state from a Fiserv API response to a
+        capture, void or refund.
+        """
+        self.ensure_one()
+        logger = self.env['fiserv.transaction.log'].sudo()
+        status = response.get('transactionStatus')
+        processor = response.get('processor') or {}
+
+        logger.save_transaction_log({
+            'transaction_reference': self.reference,
+            'operation': operation,
+            'status': status,
+            'api_response': response,
+        })
+
+        if response.get('ipgTransactionId') and not self.provider_reference:
+            self.provider_reference = response['ipgTransactionId']
+
+        if status == 'APPROVED':
+            if operation == 'void':
+                self._set_canceled()
+            else:
+                self._set_done()
+        elif status == 'WAITING':
+            self._set_pending()
+        else:
+            message = processor.get('responseMessage') or status or _("Unknown error")
+            self.fiserv_response_code = processor.get('responseCode')
+            self._set_error(_("Fiserv %(operation)s rejected: %(message)s", operation=operation, message=message))
+
     def get_card_brand_display(self):
         """
         Gets descriptive name for card brand.
@@ -952,9 +1292,12 @@ class PaymentTransaction(models.Model):
         """
         Locates existing transaction based on notification data.
         - Searches by exact reference
-        - Searches by sale order if reference not found
+        - Searches by sale order and txndatetime if reference not found
         - Validates and logs search
         """
+        if provider_code != 'fiserv':
+            return super()._get_tx_from_notification_data(provider_code, notification_data)
+
         logger = self.env['fiserv.transaction.log'].sudo()
         
         reference = notification_data.get('oid')
@@ -971,11 +1314,7 @@ class PaymentTransaction(models.Model):
             'provider_code': provider_code
         })
 
-        # Search transaction by exact reference
-        tx = self.sudo().search([
-            ('reference', '=', reference),
-            ('provider_code', '=', provider_code)
-        ], limit=1, order='create_date DESC')
+        tx = self._search_fiserv_attempt(reference, notification_data.get('txndatetime'))
 
         if not tx:
             logger.log_error({
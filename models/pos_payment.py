@@ -2,7 +2,7 @@ from odoo import api, fields, models
 from odoo.exceptions import ValidationError
 import json
 import os
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from .. import const
 import logging
 
@@ -11,6 +11,13 @@ _logger = logging.getLogger(__name__)
 class PosPaymentMethod(models.Model):
     _inherit = 'pos.payment.method'
 
+    use_fiserv = fields.Boolean(
+        string='Usar Fiserv',
+        index=True,
+        default=False,
+        help='Los pagos con este método se procesan con Fiserv y admiten cuotas'
+    )
+
     fiserv_provider_id = fields.Many2one(
         'payment.provider',
         domain=[('code', '=', 'fiserv')],
@@ -21,6 +28,9 @@ class PosPaymentMethod(models.Model):
         'fiserv.card.config',
         string='Marcas de Tarjeta',
         domain=[('active', '=', True)],
+        compute='_compute_card_config',
+        store=True,
+        readonly=False,
         help='Tarjetas disponibles para este método de pago'
     )
         
@@ -40,29 +50,47 @@ class PosPaymentMethod(models.Model):
         readonly=True
     )
 
-    @api.model
+    fiserv_interest_mode = fields.Selection(
+        related='fiserv_provider_id.fiserv_interest_mode',
+        readonly=True
+    )
+
+    fiserv_interest_product_id = fields.Many2one(
+        related='fiserv_provider_id.fiserv_interest_product_id',
+        readonly=True
+    )
+
     def _is_fiserv_method(self):
-        return self.id == 6
+        return bool(self.use_fiserv)
 
-    @api.constrains('id', 'card_config_ids')
+    @api.model
+    def _load_pos_data_fields(self, config_id):
+        return super()._load_pos_data_fields(config_id) + [
+            'use_fiserv', 'fiserv_interest_mode', 'fiserv_interest_product_id'
+        ]
+
+    @api.constrains('use_fiserv', 'card_config_ids')
     def _check_fiserv_card_brand(self):
         for record in self:
-            if record.id == 6 and not record.card_config_ids:
+            if record.use_fiserv and not record.card_config_ids:
                 raise ValidationError('Debe seleccionar al menos una marca de tarjeta')
 
-    @api.depends('fiserv_provider_id')
+    @api.depends('use_fiserv', 'fiserv_provider_id')
     def _compute_card_config(self):
         for record in self:
-            if record.id == 6 and record.fiserv_provider_id:
+            if not record.use_fiserv:
+                record.card_config_ids = False
+            elif record.fiserv_provider_id and not record.card_config_ids:
                 record.card_config_ids = self.env['fiserv.card.config'].search([
                     ('active', '=', True)
                 ])
             else:
-                record.card_config_ids = False
+                # Brands already chosen by hand are kept
+                record.card_config_ids = record.card_config_ids
 
     def _get_payment_method_information(self):
         res = super()._get_payment_method_information()
-        if self.id == 6:
+        if self.use_fiserv:
             try:
                 card_configs = self.card_config_ids.filtered('active')
                 installment_data = {}
@@ -105,7 +133,7 @@ class PosPaymentMethod(models.Model):
     def get_installments(self, payment_method_id):
         try:
             payment_method = request.env['pos.payment.method'].browse(int(payment_method_id))
-            if payment_method.id != 6:
+            if not payment_method.use_fiserv:
                 return []
                 
             # Get active card configurations and filter by enabled installments
@@ -178,27 +206,6 @@ class PosPaymentMethod(models.Model):
         }
         logger.log_error(log_data)
     
-    def _prepare_invoice_vals(self):
-        """Agrega información de cuotas e intereses a la factura."""
-        vals = super()._prepare_invoice_vals()
-        
-        card_payment = self.payment_ids.filtered(
-            lambda p: p.payment_method_id.is_credit_card and p.installments > 1
-        )
-        
-        if card_payment:
-            card_brand_name = card_payment.fiserv_card_brands.name
-            vals.update({
-                'narration': f"""
-                Pago con tarjeta: {card_brand_name}
-                Cuotas: {card_payment.installments}
-                Tasa de interés: {card_payment.interest_rate:.2f}%
-                Total con interés: {card_payment.total_with_interest:.2f}
-                """
-            })
-            
-        return vals
-
     def _get_installment_amount(self, payment):
         """Calcula el monto de cada cuota."""
         if payment.installments > 1:
@@ -206,12 +213,115 @@ class PosPaymentMethod(models.Model):
         return payment.amount
     
         
+class PosOrder(models.Model):
+    _inherit = 'pos.order'
+
+    fiserv_payment_id = fields.Many2one(
+        'pos.payment',
+        string='Pago Fiserv en cuotas',
+        compute='_compute_fiserv_payment_id',
+        store=True,
+        help='Pago con Fiserv que lleva los datos de cuotas e intereses de la orden'
+    )
+
+    @api.depends('payment_ids.payment_method_id.use_fiserv', 'payment_ids.installments')
+    def _compute_fiserv_payment_id(self):
+        for order in self:
+            order.fiserv_payment_id = order.payment_ids.filtered(
+                lambda p: p.payment_method_id.use_fiserv and p.installments > 1
+            )[:1]
+
+    @api.model
+    def sync_from_ui(self, orders):
+        """
+        Bulk upload of orders from the POS: reads the installment plans and
+        the card brands used by all the orders once, before they are processed.
+        """
+        card_ids = {
+            payment[2].get('card_config_id')
+            for order in orders
+            for payment in order.get('payment_ids') or []
+            if isinstance(payment, (list, tuple)) and len(payment) == 3 and isinstance(payment[2], dict)
+        }
+        card_ids.discard(None)
+        card_ids.discard(False)
+        if card_ids:
+            self.env['fiserv.card.installment']._get_plan_rates()
+            self.env['fiserv.card.config'].browse(card_ids).fetch(['name'])
+        return super().sync_from_ui(orders)
+
+    def _prepare_invoice_vals(self):
+        """Agrega información de cuotas e intereses a la factura."""
+        vals = super()._prepare_invoice_vals()
+
+        payment = self.fiserv_payment_id
+        if payment:
+            vals['narration'] = (
+                f"Pago con tarjeta: {payment.card_config_id.name or ''}\n"
+                f"Cuotas: {payment.installments}\n"
+                f"Tasa de interés: {payment.interest_rate:.2f}%\n"
+                f"Total con interés: {payment.total_with_interest:.2f}"
+            )
+
+        return vals
+
+    @api.model
+    def _process_order(self, order, existing_order):
+        order_id = super()._process_order(order, existing_order)
+        self.browse(order_id)._reconcile_fiserv_interest_line()
+        return order_id
+
+    def _reconcile_fiserv_interest_line(self):
+        """
+        Surcharge mode: the POS books the installment interest as a single
+        line with the provider's interest product. Flags that line and logs
+        orders whose interest line does not match the Fiserv payment.
+        """
+        for order in self:
+            method = order.fiserv_payment_id.payment_method_id
+            product = method.fiserv_interest_product_id
+            if method.fiserv_interest_mode != 'surcharge' or not product:
+                continue
+
+            interest_lines = order.lines.filtered(lambda l: l.product_id == product)
+            interest_lines.filtered(lambda l: not l.is_fiserv_interest).write({'is_fiserv_interest': True})
+
+            payment = order.fiserv_payment_id
+            coefficient = 1 + payment.interest_rate / 100
+            expected = order.currency_id.round(payment.amount - payment.amount / coefficient)
+            booked = sum(interest_lines.mapped('price_subtotal_incl'))
+            if order.currency_id.compare_amounts(expected, booked):
+                self.env['fiserv.transaction.log'].sudo().log_error({
+                    'error_type': 'pos_interest_line_mismatch',
+                    'transaction_reference': order.pos_reference or order.name,
+                    'pos_order_id': order.id,
+                    'payment_amount': payment.amount,
+                    'interest_rate': payment.interest_rate,
+                    'expected_interest': expected,
+                    'booked_interest': booked,
+                })
+
+
+class PosConfig(models.Model):
+    _inherit = 'pos.config'
+
+    def _get_special_products(self):
+        """The Fiserv interest products are loaded even if not available in POS."""
+        products = super()._get_special_products()
+        methods = self.env['pos.payment.method'].sudo().search([('use_fiserv', '=', True)])
+        return products | methods.fiserv_interest_product_id
+
+
 class PosPayment(models.Model):
     _inherit = 'pos.payment'
 
+    # Indexed for the date ranges of the Fiserv close report
+    payment_date = fields.Datetime(index=True)
+
     card_config_id = fields.Many2one(
         'fiserv.card.config',
-        string='Marca de tarjeta'
+        string='Marca de tarjeta',
+        index=True
     )
 
     installments = fields.Integer(
@@ -222,43 +332,39 @@ class PosPayment(models.Model):
     total_with_interest = fields.Monetary(
         string='Total con interés',
         currency_field='currency_id',
-        compute='_compute_total_with_interest',
+        compute='_compute_fiserv_interest',
         store=True
     )
     
     interest_rate = fields.Float(
         string='Tasa de interés',
         digits=(16, 4),
-        compute='_compute_interest_rate',
+        compute='_compute_fiserv_interest',
         store=True
     )
     
+    @api.model
+    def _load_pos_data_fields(self, config_id):
+        # The POS writes the installment plan on the payment line; an empty
+        # list already loads every field
+        fields_list = super()._load_pos_data_fields(config_id)
+        return fields_list + ['card_config_id', 'installments'] if fields_list else fields_list
+
     @api.depends('card_config_id', 'installments', 'amount')
-    def _compute_total_with_interest(self):
+    def _compute_fiserv_interest(self):
+        # Plan rates are cached: a whole sync batch is computed without queries
+        rates = self.env['fiserv.card.installment']._get_plan_rates()
         for payment in self:
+            rate = None
             if payment.installments > 1 and payment.card_config_id:
-                installment = payment.card_config_id.installments.filtered(
-                    lambda i: i.installments == payment.installments
-                )
-                if installment:
-                    interest_rate = installment.interest_rate / 100
-                    payment.total_with_interest = payment.amount * (1 + interest_rate)
-                else:
-                    payment.total_with_interest = payment.amount
+                rate = rates.get((payment.card_config_id._origin.id, payment.installments))
+            if rate is not None:
+                payment.interest_rate = rate
+                payment.total_with_interest = payment.amount * (1 + rate / 100)
             else:
+                payment.interest_rate = 0.0
                 payment.total_with_interest = payment.amount
 
-    @api.depends('card_config_id', 'installments')
-    def _compute_interest_rate(self):
-        for payment in self:
-            if payment.installments > 1 and payment.card_config_id:
-                installment = payment.card_config_id.installments.filtered(
-                    lambda i: i.installments == payment.installments
-                )
-                payment.interest_rate = installment.interest_rate if installment else 0.0
-            else:
-                payment.interest_rate = 0.0
-                
     def _update_payment_line_values(self, values):
         res = super()._update_payment_line_values(values)
         if values.get('card_config_id'):
@@ -279,45 +385,51 @@ class PosOrderLine(models.Model):
         help='Precio original antes de aplicar intereses'
     )
     
+    is_fiserv_interest = fields.Boolean(
+        string='Es interés Fiserv',
+        default=False,
+        readonly=True,
+        copy=False,
+        help='Línea que registra el interés por cuotas en modo recargo'
+    )
+
+    price_with_interest = fields.Float(
+        string='Precio con Interés',
+        digits='Product Price',
+        compute='_compute_price_with_interest',
+        store=True,
+        help='Precio unitario original con el interés de la financiación en cuotas'
+    )
+
     @api.model_create_multi
     def create(self, vals_list):
         for vals in vals_list:
             vals['original_price'] = vals.get('price_unit', 0.0)
         return super().create(vals_list)
 
-    @api.depends('price_unit', 'order_id.payment_ids.interest_rate')
-    def _compute_amount(self):
-        for line in self:
-            payment = line.order_id.payment_ids.filtered(
-                lambda p: p.payment_method_id.id == 6 
-                and p.installments > 1 
-                and p.interest_rate > 0
-            )
-            if payment:
-                price = Decimal(str(line.original_price or line.price_unit))
-                interest = Decimal(str(1 + payment[0].interest_rate))
-                line.price_unit = float(
-                    (price * interest).quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
-                )
-            super(PosOrderLine, line)._compute_amount()
-    
     def init_original_price(self):
         """Inicializa el precio original cuando se crea la línea"""
         self.original_price = self.price_unit
         return True
 
-    @api.depends('price_unit', 'order_id.payment_ids.interest_rate')
+    @api.depends('original_price', 'price_unit', 'order_id.fiserv_payment_id.interest_rate')
     def _compute_price_with_interest(self):
+        # One coefficient per order, then a single pass over the lines.
+        # In surcharge mode the interest is its own line: prices stay as they are.
+        coefficients = {
+            order.id: Decimal(str(order.fiserv_payment_id.interest_rate or 0.0)) / 100 + 1
+            for order in self.order_id
+            if order.fiserv_payment_id.payment_method_id.fiserv_interest_mode != 'surcharge'
+        }
         for line in self:
-            payment = line.order_id.payment_ids.filtered(
-                lambda p: p.payment_method_id.id == 6 and p.installments > 1
-            )
-            if payment and payment.interest_rate:
-                coefficient = 1 + payment.interest_rate
-                # Usar el precio original en lugar del price_unit actual
-                line.price_with_interest = line.original_price * coefficient
+            price = line.original_price or line.price_unit
+            coefficient = coefficients.get(line.order_id.id)
+            if coefficient and coefficient != 1:
+                line.price_with_interest = float(
+                    (Decimal(str(price)) * coefficient).quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
+                )
             else:
-                line.price_with_interest = line.original_price or line.price_unit       
+                line.price_with_interest = price
 
     def _log_payment_error(self, error_type, error_data):
         """
@@ -335,3 +447,13 @@ class PosOrderLine(models.Model):
             'timestamp': fields.Datetime.now()
         }
         logger.log_error(log_data)                
+
+class PosSession(models.Model):
+    _inherit = 'pos.session'
+
+    @api.model
+    def _load_pos_data_models(self, config_id):
+        """Card brands and installment plans are loaded once with the session."""
+        data = super()._load_pos_data_models(config_id)
+        data += ['fiserv.card.config', 'fiserv.card.installment']
+        return data
@@ -0,0 +1,25 @@
+from odoo import models
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    def write(self, vals):
+        """
+        Changing the sale taxes of a Fiserv interest or adjustment product
+        invalidates the tax profiles cached on payment.provider.
+        """
+        res = super().write(vals)
+        if 'taxes_id' in vals and self._is_fiserv_line_product():
+            self.env.registry.clear_cache()
+        return res
+
+    def _is_fiserv_line_product(self):
+        """True when a Fiserv provider uses one of the products for its interest or adjustment lines."""
+        variants = self.with_context(active_test=False).product_variant_ids
+        return bool(self.env['payment.provider'].sudo().search_count([
+            ('code', '=', 'fiserv'),
+            '|',
+            ('fiserv_interest_product_id', 'in', variants.ids),
+            ('fiserv_adjustment_product_id', 'in', variants.ids),
+        ], limit=1))
@@ -1,15 +1,23 @@
+import os
 import json
+import time
 import logging
-from .. import const
+from datetime import datetime
+from .. import const, timing
+from .fiserv_log import get_log_dir
 from odoo.http import request, Response
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import float_compare
 from decimal import Decimal, ROUND_HALF_DOWN, ROUND_HALF_UP, getcontext, InvalidOperation
 
 _logger = logging.getLogger(__name__)
 
 getcontext().prec = 20
 
+# Last order id processed by _fiserv_resync_history
+RESYNC_PARAM = 'fiserv_gateway.resync_last_order_id'
+
 class FiservPrecisionMixin(models.AbstractModel):
     _name = 'fiserv.precision.mixin'
     _description = 'Mixin for handling decimal precision in Fiserv calculations'
@@ -50,7 +58,24 @@ class FiservPrecisionMixin(models.AbstractModel):
         base = self._str_to_decimal(base_amount)
         rate = self._str_to_decimal(interest_rate)
         return base * (1 + rate)
-    
+
+    def _price_excluding_taxes(self, total_included, taxes, currency, product=None, partner=None):
+        """
+        Convert a tax-included amount into the unit price that yields it once
+        the given taxes are applied. Handles both price-included and
+        price-excluded taxes through compute_all.
+        """
+        total_included = self._str_to_decimal(total_included)
+        if not taxes:
+            return total_included
+        # A large base keeps the currency rounding of compute_all out of the factor
+        base = Decimal('1000000')
+        res = taxes.compute_all(float(base), currency, 1.0, product=product, partner=partner)
+        factor = self._str_to_decimal(res['total_included']) / base
+        if not factor:
+            return total_included
+        return total_included / factor
+
 class SaleOrderLine(models.Model):
     
     _inherit = ['sale.order.line', 'fiserv.precision.mixin']
@@ -86,7 +111,15 @@ class SaleOrderLine(models.Model):
         copy=False,
         help='Identifica las líneas de ajuste por redondeo de Fiserv'
     )
-    
+
+    is_fiserv_interest = fields.Boolean(
+        string='Es recargo Fiserv',
+        default=False,
+        readonly=True,
+        copy=False,
+        help='Identifica la línea de recargo por financiación en cuotas'
+    )
+
     @api.depends('product_uom_qty', 'price_unit', 'tax_id')
     def _compute_amount(self):
         """
@@ -336,35 +369,83 @@ class SaleOrder(models.Model):
                     
             with self.env.cr.savepoint():
                 fiserv_total = self._str_to_decimal(tx.fiserv_total_with_interest)
-                original_total = self._str_to_decimal(self.amount_total)
-                
+                interest_line = self.order_line.filtered(lambda l: l.is_fiserv_interest)
+                # An existing surcharge line is part of the interest, not of the base
+                original_total = self._str_to_decimal(self.amount_total) - \
+                    self._str_to_decimal(sum(interest_line.mapped('price_total')))
+
                 if fiserv_total <= original_total:
                     return
-                    
-                # Calculate adjustment factor
-                adjustment_factor = fiserv_total / original_total
-                
-                # Update lines in batch to improve performance
-                update_vals = []
-                for line in self.order_line.filtered(lambda l: not l.is_fiserv_adjustment):
-                    original_price = self._str_to_decimal(line.price_unit)
-                    new_price = original_price * adjustment_factor
-                    
-                    update_vals.append((1, line.id, {
-                        'fiserv_original_price': float(original_price),
-                        'price_unit': self._decimal_to_float(new_price),
-                        'fiserv_interest_coefficient': float(adjustment_factor)
-                    }))
-                
-                if update_vals:
-                    self.with_context(ctx).write({'order_line': update_vals})
-                    
+
+                if tx.provider_id.fiserv_interest_mode == 'surcharge' \
+                        and tx.provider_id.fiserv_interest_product_id:
+                    self.with_context(ctx)._update_interest_line(
+                        fiserv_total - original_total, tx.provider_id
+                    )
+                else:
+                    self.with_context(ctx)._update_line_prices_with_interest(
+                        fiserv_total / original_total
+                    )
+
                 # Recompute amounts with new context
                 self.with_context(ctx)._compute_amounts()
-                
+
         except Exception as e:
             _logger.exception("Error updating amounts with interest: %s", str(e))
-                                
+
+    def _update_line_prices_with_interest(self, adjustment_factor):
+        """
+        Spreads the financing interest over the unit price of every order line.
+        """
+        self.ensure_one()
+        # Update lines in batch to improve performance
+        update_vals = []
+        for line in self.order_line.filtered(
+            lambda l: not l.is_fiserv_adjustment and not l.is_fiserv_interest
+        ):
+            original_price = self._str_to_decimal(line.price_unit)
+            new_price = original_price * adjustment_factor
+
+            update_vals.append((1, line.id, {
+                'fiserv_original_price': float(original_price),
+                'price_unit': self._decimal_to_float(new_price),
+                'fiserv_interest_coefficient': float(adjustment_factor)
+            }))
+
+        if update_vals:
+            self.write({'order_line': update_vals})
+
+    def _update_interest_line(self, interest_amount, provider):
+        """
+        Books the financing interest as a single surcharge line.
+        The line is priced so that, once the product taxes are applied, it adds
+        exactly interest_amount to the order. Original prices are left untouched,
+        so this costs one write regardless of the number of order lines.
+        """
+        self.ensure_one()
+        product, taxes = self._get_fiserv_line_profile(provider, 'fiserv_interest_product_id')
+        price_unit = self._price_excluding_taxes(
+            interest_amount, taxes, self.currency_id,
+            product=product, partner=self.partner_shipping_id
+        )
+        line_vals = {
+            'product_uom_qty': 1.0,
+            'price_unit': self._decimal_to_float(price_unit),
+            'tax_id': [(6, 0, taxes.ids)],
+        }
+
+        interest_line = self.order_line.filtered(lambda l: l.is_fiserv_interest)[:1]
+        if interest_line:
+            command = (1, interest_line.id, line_vals)
+        else:
+            command = (0, 0, dict(line_vals, **{
+                'product_id': product.id,
+                'name': product.display_name,
+                'is_fiserv_interest': True,
+                'sequence': 998,
+            }))
+        self.write({'order_line': [command]})
+
     def _handle_fiserv_adjustment(self, current_total, tx):
         """
         Handle amount adjustments for Fiserv transactions.
@@ -380,11 +461,13 @@ class SaleOrder(models.Model):
             self.fiserv_amount_adjusted = True
             return
 
-        self._handle_adjustment_line(self, difference, fiserv_total)
+        self._handle_adjustment_line(self, difference, fiserv_total, tx.provider_id)
 
     def _log_fiserv_calculation(self, current_total, fiserv_total, difference):
         """
-        Centralized logging for Fiserv calculations
+        Centralized logging for Fiserv calculations.
+        Called from _compute_amounts, so the record is queued and only written
+        to disk after the transaction commits.
         """
         log_data = {
             'timestamp': fields.Datetime.now(),
@@ -396,38 +479,54 @@ class SaleOrder(models.Model):
                 'difference': float(difference)
             }
         }
-        self.env['fiserv.transaction.log'].sudo().save_transaction_log(
-            log_data, 
+        self.env['fiserv.transaction.log'].sudo().defer_transaction_log(
+            log_data,
             filename_prefix='fiserv_calculate'
         )
     
-    def _handle_adjustment_line(self, order, difference, fiserv_total):
+    def _get_fiserv_line_profile(self, provider, field_name):
+        """
+        Returns the product configured on the provider in field_name and its
+        taxes mapped through the order fiscal position.
+        The taxes come from the provider's cached profile.
+        """
+        self.ensure_one()
+        product = provider._get_fiserv_product(field_name).sudo(False)
+        tax_ids = provider._get_fiserv_product_profile(product.id, self.company_id.id)
+        taxes = self.fiscal_position_id.map_tax(self.env['account.tax'].sudo().browse(tax_ids))
+        return product, taxes
+
+    def _handle_adjustment_line(self, order, difference, fiserv_total, provider):
         """Handles the creation or update of the adjustment line."""
         adjustment_line = order.order_line.filtered(
             lambda l: l.is_fiserv_adjustment
         )
-        
-        adjustment_product = self.env['product.product'].sudo().search(
-            [('default_code', '=', 'AJUSTE_RED')], limit=1
+
+        adjustment_product, taxes = order._get_fiserv_line_profile(
+            provider, 'fiserv_adjustment_product_id'
         )
-        
+
         if not adjustment_product:
             return
-        
-        tax_factor = Decimal('1.21')
-        adjusted_price = difference / tax_factor
-        
+
+        adjusted_price = self._price_excluding_taxes(
+            difference, taxes, order.currency_id,
+            product=adjustment_product, partner=order.partner_shipping_id
+        )
+
         if adjustment_line:
             if abs(difference) >= Decimal('0.01'):
                 adjustment_line.write({
                     'price_unit': self._decimal_to_float(adjusted_price),
-                    'product_uom_qty': 1.0
+                    'product_uom_qty': 1.0,
+                    'tax_id': [(6, 0, taxes.ids)],
                 })
         else:
             order.write({
                 'order_line': [(0, 0, {
                     'product_id': adjustment_product.id,
                     'name': 'Ajuste por redondeo tarjetas',
+                    'tax_id': [(6, 0, taxes.ids)],
                     'product_uom_qty': 1.0,
                     'price_unit': self._decimal_to_float(adjusted_price),
                     'is_fiserv_adjustment': True,
@@ -493,6 +592,10 @@ class SaleOrder(models.Model):
                         
             return super().action_confirm()
 
+    def _send_order_confirmation_mail(self):
+        with timing.stage('mail'):
+            return super()._send_order_confirmation_mail()
+
     @api.depends('transaction_ids', 'amount_total')
     def _compute_fiserv_interest_amount(self):
         """
@@ -585,30 +688,224 @@ class SaleOrder(models.Model):
         return self.transaction_ids.filtered(
             lambda t: t.provider_code == 'fiserv' and t.state == 'done'
         ).sorted('create_date', reverse=True)[:1]  
+
+    @api.model
+    def _fiserv_resync_history(self, chunk_size=1000, max_chunks=None, dry_run=False,
+                               restart=False, report_path=None):
+        """
+        Re-derive the stored Fiserv interest data of historical orders from their
+        transactions: fiserv_interest_amount, fiserv_amount_adjusted and the
+        interest coefficient of re-priced lines.
+
+        Orders are processed by ascending id in chunks of chunk_size. Each chunk
+        resolves its transactions with one query, updates only the values that
+        differ with one UPDATE per table and is committed on its own. The last
+        processed order id is stored in the fiserv_gateway.resync_last_order_id
+        parameter, so an interrupted run resumes where it stopped.
+
+        With dry_run=True nothing is written nor committed; every difference is
+        appended as one JSON line to report_path instead.
+
+        Usage from an Odoo shell:
+            env['sale.order']._fiserv_resync_history(chunk_size=2000, dry_run=True)
+
+        Returns:
+            dict: Number of chunks, processed orders, changed orders and changed lines
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        last_id = 0
+        if not dry_run and not restart:
+            last_id = int(params.get_param(RESYNC_PARAM, 0))
+
+        if dry_run and not report_path:
+            report_path = os.path.join(
+                get_log_dir(), 'resync', f"fiserv_resync_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+            )
+        report = None
+        if dry_run:
+            os.makedirs(os.path.dirname(report_path), exist_ok=True)
+            report = open(report_path, 'a')
+
+        summary = {'chunks': 0, 'orders': 0, 'changed_orders': 0, 'changed_lines': 0}
+        started = time.monotonic()
+        try:
+            while max_chunks is None or summary['chunks'] < max_chunks:
+                tx_by_order = self._fiserv_resync_fetch_chunk(last_id, chunk_size)
+                if not tx_by_order:
+                    break
+
+                order_changes, line_changes = self._fiserv_resync_chunk(tx_by_order)
+                last_id = max(tx_by_order)
+
+                if dry_run:
+                    for order_id, changes in order_changes.items():
+                        report.write(json.dumps({'order_id': order_id, 'changes': changes}, default=str) + '\n')
+                    for line_id, changes in line_changes.items():
+                        report.write(json.dumps({'line_id': line_id, 'changes': changes}, default=str) + '\n')
+                else:
+                    self._fiserv_resync_apply(order_changes, line_changes)
+                    params.set_param(RESYNC_PARAM, last_id)
+                    self.env.cr.commit()
+
+                summary['chunks'] += 1
+                summary['orders'] += len(tx_by_order)
+                summary['changed_orders'] += len(order_changes)
+                summary['changed_lines'] += len(line_changes)
+                _logger.info(
+                    "Fiserv resync%s: chunk %s done up to order %s, %s orders, "
+                    "%s orders and %s lines changed (%.0f orders/s)",
+                    ' (dry run)' if dry_run else '', summary['chunks'], last_id, summary['orders'],
+                    summary['changed_orders'], summary['changed_lines'],
+                    summary['orders'] / max(time.monotonic() - started, 0.001)
+                )
+
+                # Keep memory flat regardless of the number of orders
+                self.env.invalidate_all()
+        finally:
+            if report:
+                report.close()
+
+        if report_path:
+            summary['report_path'] = report_path
+        return summary
+
+    @api.model
+    def _fiserv_resync_fetch_chunk(self, last_id, limit):
+        """
+        Returns {order_id: transaction_id} for the next orders after last_id
+        that have a done Fiserv transaction, keeping the latest one per order.
+        """
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (rel.sale_order_id) rel.sale_order_id, tx.id
+              FROM sale_order_transaction_rel rel
+              JOIN payment_transaction tx ON tx.id = rel.transaction_id
+              JOIN payment_provider provider ON provider.id = tx.provider_id
+             WHERE rel.sale_order_id > %s
+               AND provider.code = 'fiserv'
+               AND tx.state = 'done'
+          ORDER BY rel.sale_order_id, tx.create_date DESC, tx.id DESC
+             LIMIT %s
+        """, (last_id, limit))
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _fiserv_resync_chunk(self, tx_by_order):
+        """
+        Computes the expected Fiserv values of a chunk of orders and returns
+        the differences with the stored ones as {id: {field: (old, new)}}
+        for orders and for lines.
+        """
+        orders = self.browse(list(tx_by_order))
+        transactions = self.env['payment.transaction'].browse(list(tx_by_order.values()))
+        # Load the whole chunk at once instead of record by record
+        orders.fetch(['amount_total', 'currency_id', 'fiserv_interest_amount', 'fiserv_amount_adjusted'])
+        transactions.fetch(['fiserv_total_with_interest', 'fiserv_interest_amount'])
+        orders.order_line.fetch([
+            'order_id', 'price_unit', 'fiserv_original_price', 'fiserv_interest_coefficient',
+            'is_fiserv_adjustment', 'is_fiserv_interest'
+        ])
+
+        order_changes = {}
+        line_changes = {}
+        for order in orders:
+            tx = transactions.browse(tx_by_order[order.id])
+            rounding = order.currency_id.rounding or 0.01
+            total_with_interest = tx.fiserv_total_with_interest
+            interest_amount = tx.fiserv_interest_amount or 0.0
+
+            expected = {
+                'fiserv_interest_amount': interest_amount,
+                'fiserv_amount_adjusted': bool(total_with_interest) and float_compare(
+                    order.amount_total, total_with_interest, precision_rounding=rounding
+                ) == 0,
+            }
+            changes = {}
+            if float_compare(order.fiserv_interest_amount, expected['fiserv_interest_amount'],
+                             precision_rounding=rounding):
+                changes['fiserv_interest_amount'] = (order.fiserv_interest_amount, expected['fiserv_interest_amount'])
+            if order.fiserv_amount_adjusted != expected['fiserv_amount_adjusted']:
+                changes['fiserv_amount_adjusted'] = (order.fiserv_amount_adjusted, expected['fiserv_amount_adjusted'])
+            if changes:
+                order_changes[order.id] = changes
+
+            base_total = total_with_interest - interest_amount
+            if not total_with_interest or base_total <= 0:
+                continue
+            coefficient = round(total_with_interest / base_total, 6)
+            for line in order.order_line:
+                if not line.fiserv_original_price or line.is_fiserv_adjustment or line.is_fiserv_interest:
+                    continue
+                if float_compare(line.fiserv_interest_coefficient, coefficient, precision_digits=6):
+                    line_changes[line.id] = {
+                        'fiserv_interest_coefficient': (line.fiserv_interest_coefficient, coefficient)
+                    }
+
+        return order_changes, line_changes
+
+    @api.model
+    def _fiserv_resync_apply(self, order_changes, line_changes):
+        """
+        Writes the differences of a chunk with one UPDATE per table.
+        Plain SQL on purpose: these are historical values and must not trigger
+        the recomputation of the order amounts.
+        """
+        if order_changes:
+            ids = list(order_changes)
+            orders = self.browse(ids)
+            amounts = []
+            adjusted = []
+            for order in orders:
+                changes = order_changes[order.id]
+                amounts.append(changes.get('fiserv_interest_amount', (None, order.fiserv_interest_amount))[1])
+                adjusted.append(changes.get('fiserv_amount_adjusted', (None, order.fiserv_amount_adjusted))[1])
+            self.env.cr.execute("""
+                UPDATE sale_order so
+                   SET fiserv_interest_amount = v.interest_amount,
+                       fiserv_amount_adjusted = v.amount_adjusted
+                  FROM (SELECT unnest(%s::int[]) AS id,
+                               unnest(%s::numeric[]) AS interest_amount,
+                               unnest(%s::bool[]) AS amount_adjusted) v
+                 WHERE so.id = v.id
+            """, (ids, amounts, adjusted))
+
+        if line_changes:
+            ids = list(line_changes)
+            coefficients = [line_changes[line_id]['fiserv_interest_coefficient'][1] for line_id in ids]
+            self.env.cr.execute("""
+                UPDATE sale_order_line sol
+                   SET fiserv_interest_coefficient = v.coefficient
+                  FROM (SELECT unnest(%s::int[]) AS id,
+                               unnest(%s::numeric[]) AS coefficient) v
+                 WHERE sol.id = v.id
+            """, (ids, coefficients))
                       
         
-    @api.depends('transaction_ids')
+    @api.depends('transaction_ids', 'transaction_ids.state')
     def _compute_payment_transaction_count(self):
         """
         Compute the total number of payment transactions linked to the order.
         This computed field updates automatically when transactions are added or removed.
         Useful for displaying transaction count in views and determining if an order
         has any associated payments.
-        
+
         Performance optimization:
-        - Skips computation for orders without transactions
+        - Counts the transactions of the whole recordset with a single grouped query
         - Uses filtered domain to count only relevant transactions
         """
+        counts = {}
+        order_ids = [order_id for order_id in self._origin.ids if order_id]
+        if order_ids:
+            counts = {
+                order.id: count
+                for order, count in self.env['payment.transaction']._read_group(
+                    [('sale_order_ids', 'in', order_ids), ('state', '!=', 'draft')],
+                    groupby=['sale_order_ids'],
+                    aggregates=['__count'],
+                )
+            }
         for order in self:
-            if not order.transaction_ids:
-                order.payment_transaction_count = 0
-                continue
-                
-            # Optional: Count only transactions in relevant states
-            order.payment_transaction_count = len(order.transaction_ids.filtered(
-                lambda t: t.state != 'draft'
-            ))
-        
+            order.payment_transaction_count = counts.get(order._origin.id, 0)
+
     @api.depends('transaction_ids', 'transaction_ids.fiserv_total_with_interest',
                  'transaction_ids.fiserv_installments', 'amount_total')
     def _compute_fiserv_payment_data(self):
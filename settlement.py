@@ -0,0 +1,366 @@
+"""
+Streaming parser for Fiserv settlement ("liquidación") files.
+
+Files are memory-mapped and read line by line, so memory stays constant
+whatever their size. Both delimited (CSV) files and fixed-width files are
+supported; columns are mapped to the fields of SettlementRow. Does not
+depend on Odoo, see models/fiserv_settlement.py for the import model.
+
+Large files can be parsed and matched by a pool of processes with
+iter_rows_parallel(): the file is split in byte ranges aligned on line
+boundaries, every worker parses its ranges and the results are merged back
+in file order. Workers are forked, which is only safe from a process that
+runs a single thread (a cron worker or odoo-bin shell), see fork_is_safe().
+"""
+import csv
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+SettlementRow = namedtuple('SettlementRow', [
+    'line_number', 'txn_id', 'approval_code', 'reference', 'amount', 'installments', 'card_brand', 'date',
+])
+
+# Accepted CSV header names for each field, compared lower case
+CSV_COLUMNS = {
+    'txn_id': ('txn_id', 'txnid', 'ipgtransactionid', 'id transaccion', 'nro transaccion'),
+    'approval_code': ('approval_code', 'cod autorizacion', 'codigo autorizacion', 'autorizacion'),
+    'reference': ('reference', 'oid', 'orden', 'order_id', 'referencia'),
+    'amount': ('amount', 'importe', 'monto', 'chargetotal'),
+    'installments': ('installments', 'cuotas'),
+    'card_brand': ('card_brand', 'tarjeta', 'marca'),
+    'date': ('date', 'fecha', 'fecha presentacion', 'fecha operacion'),
+}
+
+# Decimals implied in the amounts of the fixed-width layout ('000000123456' is 1234.56)
+FIXED_WIDTH_IMPLIED_DECIMALS = 2
+
+# Default fixed-width layout: field -> (start, end) columns, 0 based, end excluded
+FIXED_WIDTH_LAYOUT = {
+    'date': (0, 8),
+    'txn_id': (8, 23),
+    'approval_code': (23, 29),
+    'reference': (29, 59),
+    'amount': (59, 74),
+    'installments': (74, 76),
+    'card_brand': (76, 91),
+}
+
+
+def _is_grouped(integer, separator):
+    """True if integer is digits grouped by thousands with separator ('1.234.567')."""
+    groups = integer.split(separator)
+    return 1 <= len(groups[0]) <= 3 and all(len(group) == 3 for group in groups[1:])
+
+
+def parse_amount(value, implied_decimals=None):
+    """
+    Normalizes a settlement amount to Decimal. Returns None when the value
+    is not a number.
+
+    With implied_decimals (the amounts of a fixed-width layout), an amount
+    made of digits only carries that many decimals: '         123456' and
+    '000000123456' are 1234.56. Otherwise the separators decide: when both
+    '.' and ',' appear the last one is the decimal separator ('1.234,56',
+    '1,234.56'); a separator that repeats or is followed by exactly three
+    digits groups thousands ('1.234.567', '15.000'); any other separator is
+    the decimal one ('1234.56', '1234,5'). A sign may lead or trail.
+
+    Unlike payment.transaction._parse_fiserv_amount, which always drops '.'
+    as the thousands separator of the Argentine format and raises on bad
+    input, this runs in the settlement worker processes, without Odoo, on
+    files that mix formats, and reports bad values as None.
+    """
+    value = value.strip()
+    if not value:
+        return None
+    negative = value.endswith('-') or value.startswith('-')
+    value = value.strip('-+ ')
+    if not value.replace('.', '').replace(',', '').isdigit():
+        return None
+
+    last = max(value.rfind('.'), value.rfind(','))
+    if last == -1:
+        amount = Decimal(value)
+        if implied_decimals:
+            amount = amount.scaleb(-implied_decimals)
+        return -amount if negative else amount
+
+    separator = value[last]
+    other = ',' if separator == '.' else '.'
+    integer, decimals = value[:last], value[last + 1:]
+    if other in value:
+        # Both separators: the last one is the decimal separator
+        if other in decimals or not _is_grouped(integer, other):
+            return None
+        integer = integer.replace(other, '')
+    elif value.count(separator) > 1 or len(decimals) == 3:
+        # Thousands separator only
+        if not _is_grouped(value, separator):
+            return None
+        integer, decimals = value.replace(separator, ''), ''
+    if not integer:
+        integer = '0'
+    try:
+        amount = Decimal(f'{integer}.{decimals}' if decimals else integer)
+    except InvalidOperation:
+        return None
+    return -amount if negative else amount
+
+
+def _parse_int(value):
+    value = value.strip()
+    return int(value) if value.isdigit() else None
+
+
+def _make_row(line_number, values, implied_decimals=None):
+    return SettlementRow(
+        line_number,
+        (values.get('txn_id') or '').strip(),
+        (values.get('approval_code') or '').strip(),
+        (values.get('reference') or '').strip(),
+        parse_amount(values.get('amount') or '', implied_decimals),
+        _parse_int(values.get('installments') or ''),
+        (values.get('card_brand') or '').strip(),
+        (values.get('date') or '').strip(),
+    )
+
+
+def _iter_lines(path, encoding, start=0, end=None, first_line=1):
+    """
+    Yields (line_number, text) of a file through a memory map, from byte
+    offset start (a line start) up to the line starting at or after end.
+    """
+    if not os.path.getsize(path):
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        mm.seek(start)
+        line_number = first_line
+        while end is None or mm.tell() < end:
+            line = mm.readline()
+            if not line:
+                break
+            yield line_number, line.decode(encoding).rstrip('\r\n')
+            line_number += 1
+
+
+def _map_header(header):
+    columns = {}
+    names = [name.strip().lower() for name in header]
+    for field, aliases in CSV_COLUMNS.items():
+        for index, name in enumerate(names):
+            if name in aliases:
+                columns[field] = index
+                break
+    if 'amount' not in columns or not ({'txn_id', 'approval_code', 'reference'} & set(columns)):
+        raise ValueError(f"Unrecognized settlement header: {header}")
+    return columns
+
+
+def read_csv_header(path, delimiter=';', encoding='latin-1'):
+    """
+    Returns (columns, offset, line_number) of a delimited file: the column
+    mapping of its header and where its first data line starts.
+    """
+    if os.path.getsize(path):
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line_number, line in enumerate(iter(mm.readline, b''), 1):
+                text = line.decode(encoding).rstrip('\r\n')
+                if text.strip():
+                    return _map_header(next(csv.reader([text], delimiter=delimiter))), mm.tell(), line_number + 1
+    raise ValueError("Empty settlement file")
+
+
+def iter_csv(path, delimiter=';', encoding='latin-1', start=0, end=None, first_line=1, columns=None):
+    """
+    Yields a SettlementRow per data line of a delimited file with a header.
+    A byte range can be given with start/end/first_line, then the columns
+    from read_csv_header() must be given too.
+    """
+    lines = _iter_lines(path, encoding, start, end, first_line)
+    for line_number, text in lines:
+        if not text.strip():
+            continue
+        fields = next(csv.reader([text], delimiter=delimiter))
+        if columns is None:
+            columns = _map_header(fields)
+            continue
+        yield _make_row(line_number, {
+            field: fields[index] if index < len(fields) else ''
+            for field, index in columns.items()
+        })
+
+
+def iter_fixed_width(path, layout=None, encoding='latin-1', start=0, end=None, first_line=1,
+                     implied_decimals=FIXED_WIDTH_IMPLIED_DECIMALS):
+    """
+    Yields a SettlementRow per non empty line of a fixed-width file. Amounts
+    without separators carry implied_decimals decimals.
+    """
+    layout = layout or FIXED_WIDTH_LAYOUT
+    for line_number, text in _iter_lines(path, encoding, start, end, first_line):
+        if not text.strip():
+            continue
+        yield _make_row(
+            line_number,
+            {field: text[start:end] for field, (start, end) in layout.items()},
+            implied_decimals,
+        )
+
+
+def iter_rows(path, file_format='csv', **options):
+    """Yields the SettlementRow of a settlement file in the given format."""
+    if file_format == 'fixed':
+        return iter_fixed_width(path, **options)
+    return iter_csv(path, **options)
+
+
+def short_approval_code(approval_code):
+    """
+    Authorization number of an approval code: the settlement files carry
+    '123456' where the notification carries 'Y:123456:4538652787:PPX :...'.
+    """
+    parts = (approval_code or '').split(':')
+    return parts[1].strip() if len(parts) > 2 else (approval_code or '').strip()
+
+
+def match_row(row, index):
+    """
+    Matches a row against the transaction index, a tuple of dicts
+    (by_txn_id, by_reference, by_approval_code) mapping keys to
+    (transaction_id, amount). Returns (transaction_id, match_type,
+    amount_difference); transaction_id is None when nothing matches.
+    """
+    by_txn_id, by_reference, by_approval_code = index
+    for match_type, lookup, key in (
+        ('txn_id', by_txn_id, row.txn_id),
+        ('reference', by_reference, row.reference),
+        ('approval_code', by_approval_code, row.approval_code),
+    ):
+        entry = lookup.get(key) if key else None
+        if entry:
+            tx_id, tx_amount = entry
+            difference = float(row.amount) - tx_amount if row.amount is not None else 0.0
+            return tx_id, match_type, round(difference, 2)
+    return None, 'none', 0.0
+
+
+def _count_lines(mm, start, end, window=1 << 24):
+    count = 0
+    for offset in range(start, end, window):
+        count += mm[offset:min(offset + window, end)].count(b'\n')
+    return count
+
+
+def split_ranges(path, parts, start=0, first_line=1):
+    """
+    Splits a file from byte offset start in about parts ranges aligned on
+    line starts. Returns a list of (start, end, first_line_number).
+    """
+    size = os.path.getsize(path)
+    if size <= start:
+        return []
+    ranges = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        step = max((size - start) // parts, 1)
+        range_start, line_number = start, first_line
+        while range_start < size:
+            newline = mm.find(b'\n', min(range_start + step, size) - 1)
+            range_end = size if newline == -1 else newline + 1
+            ranges.append((range_start, range_end, line_number))
+            line_number += _count_lines(mm, range_start, range_end)
+            range_start = range_end
+    return ranges
+
+
+_worker_index = None
+
+
+def fork_is_safe():
+    """
+    True when worker processes can be forked: fork is available and this
+    process runs a single thread. A fork copies the locks held by the other
+    threads (logging, database pools) in whatever state they are, so it is
+    never done from the threaded Odoo server.
+    """
+    return 'fork' in multiprocessing.get_all_start_methods() and threading.active_count() == 1
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _parse_range(job):
+    """Parses and matches one byte range in a worker process."""
+    path, file_format, start, end, first_line, options = job
+    started = time.perf_counter()
+    rows = list(iter_rows(path, file_format, start=start, end=end, first_line=first_line, **options))
+    if _worker_index is not None:
+        results = [(row, match_row(row, _worker_index)) for row in rows]
+    else:
+        results = [(row, None) for row in rows]
+    return results, {
+        'worker': os.getpid(),
+        'rows': len(rows),
+        'bytes': end - start,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def iter_rows_parallel(path, file_format='csv', processes=None, index=None, stats=None, **options):
+    """
+    Yields (row, match) for every row of a settlement file, parsed by a pool
+    of processes. match is the result of match_row() when an index is given,
+    None otherwise. Rows come in file order whatever the number of workers.
+    When a stats list is given, the statistics of every range are appended
+    to it, see worker_throughput(). Raises RuntimeError when the current
+    process cannot fork safely (see fork_is_safe()).
+    """
+    if not fork_is_safe():
+        raise RuntimeError("Parallel settlement parsing needs a single threaded process")
+    processes = processes or os.cpu_count() or 1
+    start, first_line = 0, 1
+    if file_format != 'fixed':
+        options['columns'], start, first_line = read_csv_header(
+            path, options.get('delimiter', ';'), options.get('encoding', 'latin-1')
+        )
+    # Several ranges per worker so a slow range does not hold the others
+    jobs = [
+        (path, file_format, range_start, range_end, line_number, options)
+        for range_start, range_end, line_number in split_ranges(path, processes * 4, start, first_line)
+    ]
+    # The index is handed to the workers explicitly through initargs; with
+    # fork it is inherited rather than pickled. Forked workers end with
+    # os._exit and never touch the parent's connections.
+    context = multiprocessing.get_context('fork')
+    with context.Pool(processes, initializer=_init_worker, initargs=(index,)) as pool:
+        for results, range_stats in pool.imap(_parse_range, jobs):
+            if stats is not None:
+                stats.append(range_stats)
+            yield from results
+
+
+def worker_throughput(stats):
+    """
+    Aggregates the range statistics of iter_rows_parallel() by worker.
+    Returns a list of dicts with worker, ranges, rows, bytes, seconds,
+    rows_per_second and mb_per_second, in order of first range.
+    """
+    workers = {}
+    for range_stats in stats:
+        worker = workers.setdefault(range_stats['worker'], {
+            'worker': range_stats['worker'], 'ranges': 0, 'rows': 0, 'bytes': 0, 'seconds': 0.0,
+        })
+        worker['ranges'] += 1
+        for key in ('rows', 'bytes', 'seconds'):
+            worker[key] += range_stats[key]
+    for worker in workers.values():
+        seconds = worker['seconds'] or 1e-9
+        worker['rows_per_second'] = worker['rows'] / seconds
+        worker['mb_per_second'] = worker['bytes'] / seconds / 1e6
+    return list(workers.values())
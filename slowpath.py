@@ -0,0 +1,144 @@
+"""
+Detection of payment requests slower than their latency budget.
+
+    with timing.pipeline('notify'):
+        with slowpath.watch('notify', budget_ms=1000, on_slow=store):
+            ...
+
+When the block takes longer than the budget, on_slow(report) receives the
+stages timed so far by the current timing pipeline, the SQL queries run by
+the thread and, if the request was profiled, the top cumulative functions.
+Profiling is on demand: a breach arms the profiler for the next
+PROFILE_NEXT requests of the same endpoint in the process, so only an
+endpoint that is currently slow pays for cProfile. Does not depend on Odoo.
+"""
+import contextlib
+import cProfile
+import io
+import pstats
+import threading
+import time
+
+from . import timing
+
+# Requests of an endpoint profiled after it breached its budget
+PROFILE_NEXT = 5
+
+# Functions listed in the report of a profiled request
+PROFILE_TOP = 20
+
+_armed = {}
+_lock = threading.Lock()
+
+
+def parse_budgets(value):
+    """
+    {endpoint: milliseconds} from 'prepare_redirect:800,return:1500'.
+    Invalid entries are ignored.
+    """
+    budgets = {}
+    for item in (value or '').split(','):
+        endpoint, _sep, milliseconds = item.partition(':')
+        try:
+            budget = float(milliseconds)
+        except ValueError:
+            continue
+        if endpoint.strip() and budget > 0:
+            budgets[endpoint.strip()] = budget
+    return budgets
+
+
+def arm(endpoint, count=PROFILE_NEXT):
+    """Profiles the next count requests of endpoint in this process."""
+    with _lock:
+        _armed[endpoint] = max(_armed.get(endpoint, 0), count)
+
+
+def _take(endpoint):
+    if not _armed.get(endpoint):
+        return False
+    with _lock:
+        remaining = _armed.get(endpoint, 0)
+        if not remaining:
+            return False
+        _armed[endpoint] = remaining - 1
+        return True
+
+
+def query_counters():
+    """
+    (count, seconds) of the SQL queries run by the current thread, as
+    counted by Odoo's cursor for request threads, or None elsewhere.
+    """
+    thread = threading.current_thread()
+    if not hasattr(thread, 'query_count'):
+        return None
+    return thread.query_count, getattr(thread, 'query_time', 0.0)
+
+
+def top_functions(profile, limit=PROFILE_TOP):
+    """pstats listing of the limit functions with the highest cumulative time."""
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+
+class _Watch:
+    __slots__ = ('endpoint', 'budget_ms', 'on_slow', 'profile', 'queries', 'started')
+
+    def __init__(self, endpoint, budget_ms, on_slow):
+        self.endpoint = endpoint
+        self.budget_ms = budget_ms
+        self.on_slow = on_slow
+        self.profile = None
+
+    def __enter__(self):
+        if _take(self.endpoint):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.profile = profile
+            except ValueError:
+                # Another profiler is active (one at a time since Python 3.12)
+                pass
+        self.queries = query_counters()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        if self.profile is not None:
+            self.profile.disable()
+        if duration_ms <= self.budget_ms:
+            return False
+
+        arm(self.endpoint)
+        run = timing.current()
+        report = {
+            'endpoint': self.endpoint,
+            'key': run.key if run else None,
+            'duration_ms': round(duration_ms, 3),
+            'budget_ms': self.budget_ms,
+            'stages_ms': [[name, round(seconds * 1000, 3)] for name, seconds in run.stages] if run else [],
+            'query_count': None,
+            'query_time_ms': None,
+            'profile': top_functions(self.profile) if self.profile is not None else '',
+            'error': exc_type.__name__ if exc_type else None,
+        }
+        queries = query_counters()
+        if self.queries and queries:
+            report['query_count'] = queries[0] - self.queries[0]
+            report['query_time_ms'] = round((queries[1] - self.queries[1]) * 1000, 3)
+        self.on_slow(report)
+        return False
+
+
+def watch(endpoint, budget_ms, on_slow):
+    """
+    Context manager calling on_slow(report) when its block takes more than
+    budget_ms milliseconds. Does nothing without a budget.
+    """
+    if not budget_ms:
+        return contextlib.nullcontext()
+    return _Watch(endpoint, budget_ms, on_slow)
@@ -1,6 +1,9 @@
 import { rpc } from '@web/core/network/rpc';
 import publicWidget from '@web/legacy/js/public/public_widget';
 
+// Delay before asking the server for installments, lets fast clicks settle
+const INSTALLMENTS_DEBOUNCE_MS = 250;
+
 publicWidget.registry.PaymentForm.include({
     events: Object.assign({}, publicWidget.registry.PaymentForm.prototype.events, {
         'change select[name="o_fiserv_card_brand"]': '_onCardBrandChange',
@@ -20,6 +23,10 @@ publicWidget.registry.PaymentForm.include({
             selectedInstallments: undefined,
             interestRate: 0.0
         };
+        // Installment requests: sequence of the latest one, in-flight request and quotes by (brand, amount)
+        this._installmentsSeq = 0;
+        this._installmentsRequest = null;
+        this._installmentsCache = new Map();
         if (this.paymentContext) {
             this.fiservState.amount = this.paymentContext.amount;
             this.fiservState.providerId = this.paymentContext.providerId;
@@ -369,7 +376,11 @@ publicWidget.registry.PaymentForm.include({
             infoPanel.classList.add('d-none');
         }
 
+        // Any previous request is now stale
+        const seq = ++this._installmentsSeq;
+
         if (!cardBrand) {
+            this._abortInstallmentsRequest();
             await this._resetSelectors();
             return;
         }
@@ -387,23 +398,17 @@ publicWidget.registry.PaymentForm.include({
                 selectedCardBrand: cardBrand
             };
 
-            const response = await rpc('/payment/fiserv/get_installments', {
-                card_brand: cardBrand,
-                amount: parseFloat(amount)
-            });
-            console.log('Tarjeta', cardBrand);
-            console.log('Raw response from get_installments:', response);
-
-            if (response.error) {
-                throw new Error(response.error);
-            }
+            const options = await this._getInstallmentOptions(cardBrand, parseFloat(amount), seq);
 
-            if (response.success && Array.isArray(response.options)) {
-                this._updateInstallmentSelect(response.options);
-            } else {
-                throw new Error('Invalid response format');
+            // A newer brand change superseded this one
+            if (options === null || seq !== this._installmentsSeq) {
+                return;
             }
+            this._updateInstallmentSelect(options);
         } catch (error) {
+            if (seq !== this._installmentsSeq) {
+                return;
+            }
             console.error('[Fiserv] Error loading installments:', error);
             this._displayError(error.message);
             const installmentSelect = this.el.querySelector('select[name="o_fiserv_installments"]');
@@ -415,6 +420,68 @@ publicWidget.registry.PaymentForm.include({
         this.paymentContext.card_brand = cardBrand;
     },
 
+    /**
+     * Returns the installment options of a card brand for an amount.
+     * Quotes already seen are served from memory; otherwise the request is
+     * debounced and any request still in flight is aborted.
+     *
+     * @private
+     * @param {string} cardBrand - Card brand code
+     * @param {number} amount - Amount to finance
+     * @param {number} seq - Sequence of the brand change asking for the options
+     * @returns {Promise<Array|null>} Options, or null if a newer change superseded this one
+     */
+    async _getInstallmentOptions(cardBrand, amount, seq) {
+        const key = `${cardBrand}|${amount}`;
+        if (this._installmentsCache.has(key)) {
+            return this._installmentsCache.get(key);
+        }
+
+        await new Promise(resolve => setTimeout(resolve, INSTALLMENTS_DEBOUNCE_MS));
+        if (seq !== this._installmentsSeq) {
+            return null;
+        }
+
+        this._abortInstallmentsRequest();
+        const request = rpc('/payment/fiserv/get_installments', {
+            card_brand: cardBrand,
+            amount: amount
+        });
+        this._installmentsRequest = request;
+
+        let response;
+        try {
+            response = await request;
+        } finally {
+            if (this._installmentsRequest === request) {
+                this._installmentsRequest = null;
+            }
+        }
+
+        if (response.error) {
+            throw new Error(response.error);
+        }
+        if (!response.success || !Array.isArray(response.options)) {
+            throw new Error('Invalid response format');
+        }
+
+        this._installmentsCache.set(key, response.options);
+        return response.options;
+    },
+
+    /**
+     * Aborts the installment request in flight, if any.
+     * The aborted request never resolves, so its caller simply stops.
+     *
+     * @private
+     */
+    _abortInstallmentsRequest() {
+        if (this._installmentsRequest) {
+            this._installmentsRequest.abort(false);
+            this._installmentsRequest = null;
+        }
+    },
+
     /**
      * Updates the installment select options
      * Clears previous options and adds new ones based on card selection
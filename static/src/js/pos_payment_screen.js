@@ -1,9 +1,13 @@
 import { useState } from '@odoo/owl';
 import { PaymentScreen } from '@point_of_sale/app/screens/payment_screen/payment_screen';
+import { PosStore } from '@point_of_sale/app/store/pos_store';
 import { usePos } from '@point_of_sale/app/store/pos_hook';
-import { rpc } from '@web/core/network/rpc';
 import { patch } from '@web/core/utils/patch';
 
+// Fields loaded with the session, see _load_pos_data_fields on the Python models
+const FISERV_CARD_FIELDS = ['id', 'code', 'name', 'sequence', 'credit', 'debit'];
+const FISERV_INSTALLMENT_FIELDS = ['id', 'card_config_id', 'installments', 'interest_rate', 'installment_to_send'];
+
 /**
  * Handles Fiserv payment processing in POS payment screen
  * Manages card brand selection, installment calculation and payment updates
@@ -43,7 +47,7 @@ class FiservPaymentHandler {
      * Loads card brands and shows payment form
      */
     async initialize() {
-        await this._loadFiservData();
+        this._loadFiservData();
 
         this.screen.state.originalOrderTotal = this.currentOrder?.get_total_with_tax() || 0;
 
@@ -60,6 +64,31 @@ class FiservPaymentHandler {
         this.screen.state.isVisible = true;
     }
 
+    /**
+     * Interest product of the Fiserv payment method when it books the
+     * installment interest as a surcharge line, null in re-pricing mode
+     */
+    get interestProduct() {
+        const method = this.currentOrder?.payment_ids.find(
+            line => line.payment_method_id?.use_fiserv
+        )?.payment_method_id;
+        if (method?.fiserv_interest_mode !== 'surcharge') {
+            return null;
+        }
+        return method.fiserv_interest_product_id || null;
+    }
+
+    /**
+     * Surcharge line of the current order, if any
+     */
+    get interestLine() {
+        const product = this.interestProduct;
+        if (!product) {
+            return null;
+        }
+        return this.currentOrder.get_orderlines().find(line => line.product_id?.id === product.id) || null;
+    }
+
     /**
      *  Retrieves the amount from the payment method.
      */
@@ -71,30 +100,50 @@ class FiservPaymentHandler {
     }
 
     /**
-     * Loads available card brands from backend
+     * Loads available card brands from the session data
      * Updates state with formatted card options
      */
-    async _loadFiservData() {
-        try {
-            const data = await rpc('/payment/fiserv/get_card_brands');
+    _loadFiservData() {
+        const cards = this.pos.models['fiserv.card.config'].getAll()
+            .sort((a, b) => a.sequence - b.sequence || a.id - b.id);
 
-            if (!data || !Array.isArray(data)) {
-                throw new Error('Invalid card brands response format');
-            }
-
-            // We only update the status
-            this.screen.state.cardBrands = data.map(brand => ({
-                id: brand[0],  // code
-                name: brand[1] // name
-            }));
+        // We only update the status
+        this.screen.state.cardBrands = cards.map(card => ({
+            id: card.code,
+            name: card.name
+        }));
 
-            // We update visibility
-            this.screen.state.isVisible = true;
+        // We update visibility
+        this.screen.state.isVisible = true;
+    }
 
-        } catch (error) {
-            console.error('Error loading card brands:', error);
-            this.showError('Error al cargar marcas de tarjetas: ' + error.message);
+    /**
+     * Computes the installment quotes of a card brand for an amount
+     * from the plans loaded with the session
+     * @param {string} cardBrand Card brand code
+     * @param {number} amount Amount to finance
+     * @returns {Array} Raw installment options
+     */
+    _computeInstallmentOptions(cardBrand, amount) {
+        const card = this.pos.models['fiserv.card.config'].find(c => c.code === cardBrand);
+        if (!card) {
+            return [];
         }
+
+        return this.pos.models['fiserv.card.installment']
+            .filter(plan => plan.card_config_id?.id === card.id)
+            .map(plan => {
+                const coefficient = 1 + (plan.interest_rate / 100);
+                const totalWithInterest = Math.round(amount * coefficient * 100) / 100;
+                return {
+                    installments: String(plan.installments),
+                    coefficient: coefficient,
+                    installment_to_send: plan.installment_to_send,
+                    total_with_interest: totalWithInterest,
+                    installment_amount: Math.round(totalWithInterest / plan.installments * 100) / 100,
+                    interest_rate: plan.interest_rate
+                };
+            });
     }
 
     /**
@@ -102,7 +151,7 @@ class FiservPaymentHandler {
      * Resets prices and loads available installments
      * @param {Event} ev Change event from select element
      */
-    async onCardBrandChange(ev) {
+    onCardBrandChange(ev) {
         const cardBrand = ev.target.value;
 
         // First reset all state and prices
@@ -137,19 +186,16 @@ class FiservPaymentHandler {
                 throw new Error('Invalid payment amount');
             }
 
-            const response = await rpc('/payment/fiserv/get_installments', {
-                card_brand: cardBrand,
-                amount: parseFloat(currentAmount)
-            });
+            const options = this._computeInstallmentOptions(cardBrand, parseFloat(currentAmount));
 
-            if (!response?.options?.length) {
+            if (!options.length) {
                 throw new Error('No installment options available');
             }
 
             // Update state
             Object.assign(this.screen.state, {
                 selectedCardBrand: cardBrand,
-                installmentOptions: this._formatInstallmentOptions(response.options),
+                installmentOptions: this._formatInstallmentOptions(options),
                 totalWithInterest: currentAmount
             });
 
@@ -167,7 +213,7 @@ class FiservPaymentHandler {
     * Updates order amounts and payment line with interest
     * @param {Event} ev Change event from select element
     */
-    onInstallmentChange(ev) {
+    async onInstallmentChange(ev) {
         const installments = ev.target.value;
         const option = this.state.installmentOptions.find(
             opt => opt.installments.toString() === installments
@@ -186,10 +232,11 @@ class FiservPaymentHandler {
                     interestRate: parseFloat(option.rate)
                 });
 
-                // 2. Update payment line with new amount
+                // 2. Update payment line with new amount and the plan, synced with the order
                 const paymentLine = this.currentOrder?.get_selected_paymentline();
                 if (paymentLine) {
                     paymentLine.set_amount(totalWithInterest);
+                    this._setPaymentPlan(paymentLine, this.state.selectedCardBrand, option.installments);
                 }
 
                 // 3. Calculate new total with all payment methods
@@ -197,8 +244,12 @@ class FiservPaymentHandler {
 
                 const targetTotal = totalPaid;
 
-                // 4. Update order lines with new target total
-                this._updateOrderLinesWithInterest(option.coefficient, targetTotal);
+                // 4. Book the interest: one surcharge line, or re-price every line
+                if (this.interestProduct) {
+                    await this._updateInterestLine(totalWithInterest - this.originalCardsMethodTotal);
+                } else {
+                    this._updateOrderLinesWithInterest(option.coefficient, targetTotal);
+                }
 
                 this.screen.render();
             }
@@ -246,6 +297,40 @@ class FiservPaymentHandler {
         }
     }
 
+    /**
+    * Surcharge mode: books the interest as a single line, whatever the size
+    * of the basket. The amount includes the taxes of the interest product.
+    * @param {number} interestAmount Interest to book, 0 removes the line
+    */
+    async _updateInterestLine(interestAmount) {
+        const order = this.currentOrder;
+        if (!order) return;
+
+        let line = this.interestLine;
+        if (!(interestAmount > 0)) {
+            if (line) {
+                order.removeOrderline(line);
+                order.recomputeOrderData();
+            }
+            return;
+        }
+
+        if (!line) {
+            line = await this.pos.addLineToOrder(
+                { product_id: this.interestProduct, qty: 1, price_unit: interestAmount },
+                order, {}, false
+            );
+        }
+
+        line.set_unit_price(interestAmount);
+        const priceWithTax = line.get_price_with_tax();
+        if (priceWithTax && priceWithTax !== interestAmount) {
+            line.set_unit_price(interestAmount * interestAmount / priceWithTax);
+        }
+
+        order.recomputeOrderData();
+    }
+
     /**
      * Recalculate the order total considering all payment methods..
      */
@@ -395,6 +480,24 @@ class FiservPaymentHandler {
         return `${installments} cuota${installments > 1 ? 's' : ''} de ${formattedAmount} (${interestRate}% interés)`;
     }
 
+    /**
+     * Stores the selected plan on a payment line. card_config_id and
+     * installments are sent with the order and give pos.payment its interest
+     * rate and pos.order its fiserv_payment_id.
+     * @param {Object} paymentLine Fiserv payment line
+     * @param {string|null} cardBrand Card brand code, null clears the plan
+     * @param {string|number} installments Number of installments
+     */
+    _setPaymentPlan(paymentLine, cardBrand, installments) {
+        const card = cardBrand
+            ? this.pos.models['fiserv.card.config'].find(c => c.code === cardBrand)
+            : null;
+        paymentLine.update({
+            card_config_id: card || false,
+            installments: card ? parseInt(installments) : 1,
+        });
+    }
+
     /**
      * Resets prices to original values
      * Clears interest calculations
@@ -403,6 +506,19 @@ class FiservPaymentHandler {
         const order = this.currentOrder;
         if (!order) return;
 
+        // The plan of the previous selection no longer applies
+        order.payment_ids
+            .filter(line => line.payment_method_id?.use_fiserv)
+            .forEach(line => this._setPaymentPlan(line, null));
+
+        // Surcharge mode: line prices were never touched
+        const interestLine = this.interestLine;
+        if (interestLine) {
+            order.removeOrderline(interestLine);
+            order.recomputeOrderData();
+            return;
+        }
+
         // Restore original prices
         order.get_orderlines().forEach(line => {
             try {
@@ -495,6 +611,45 @@ class FiservPaymentHandler {
     }
 }
 
+/**
+ * Keeps the Fiserv card brands and installment plans loaded with the session
+ * up to date when an administrator edits them while the POS is open.
+ */
+patch(PosStore.prototype, {
+    async setup() {
+        await super.setup(...arguments);
+        this.data.connectWebSocket('FISERV_PLANS_UPDATED', () => this.reloadFiservPlans());
+    },
+
+    /**
+     * Reloads card brands and installment plans, dropping the ones that
+     * were deleted or deactivated on the server.
+     */
+    async reloadFiservPlans() {
+        try {
+            const cards = await this.data.searchRead(
+                'fiserv.card.config', [['active', '=', true]], FISERV_CARD_FIELDS
+            );
+            const plans = await this.data.searchRead(
+                'fiserv.card.installment',
+                [['active', '=', true], ['card_config_id.active', '=', true]],
+                FISERV_INSTALLMENT_FIELDS
+            );
+            const loaded = {
+                'fiserv.card.config': new Set(cards.map(card => card.id)),
+                'fiserv.card.installment': new Set(plans.map(plan => plan.id)),
+            };
+            for (const [model, ids] of Object.entries(loaded)) {
+                this.models[model].getAll()
+                    .filter(record => !ids.has(record.id))
+                    .forEach(record => record.delete());
+            }
+        } catch (error) {
+            console.error('Error reloading Fiserv plans:', error);
+        }
+    },
+});
+
 /**
  * Initializes PaymentScreen with Fiserv functionality.
  * Sets up state management and payment handler for card payments.
@@ -544,7 +699,7 @@ patch(PaymentScreen.prototype, {
      */
     async addNewPaymentLine(paymentMethod) {
         await super.addNewPaymentLine(paymentMethod);
-        if (paymentMethod.name === 'Tarjetas') {
+        if (paymentMethod.use_fiserv) {
             await this.fiservHandler.initialize();
             this.render();
         }
@@ -0,0 +1,3 @@
+from . import test_card_config
+from . import test_pos_order
+from . import test_sale_order
@@ -0,0 +1,44 @@
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.fiserv_gateway import const
+
+
+@tagged('post_install', '-at_install')
+class TestCardConfigSeed(TransactionCase):
+
+    def _seed(self, missing_codes):
+        """Deletes the brands of missing_codes, seeds them again and returns the query count of the seeding."""
+        cards = self.env['fiserv.card.config'].with_context(active_test=False)
+        cards.search([('code', 'in', list(missing_codes))]).unlink()
+        self.env.flush_all()
+        self.env.invalidate_all()
+        start = self.cr.sql_log_count
+        cards.init()
+        self.env.flush_all()
+        return self.cr.sql_log_count - start
+
+    def test_seed_creates_brands_and_plans(self):
+        self._seed(const.SUPPORTED_CARD_BRANDS)
+        cards = self.env['fiserv.card.config'].search([('code', 'in', list(const.SUPPORTED_CARD_BRANDS))])
+        self.assertEqual(set(cards.mapped('code')), set(const.SUPPORTED_CARD_BRANDS))
+        for card in cards:
+            self.assertEqual(
+                sorted(card.installments.mapped('installments')),
+                sorted(installments for installments, _rate in const.DEFAULT_INSTALLMENT_PLANS),
+            )
+
+    def test_seed_query_count_does_not_grow_with_brands(self):
+        """Seeding every brand takes as many queries as seeding a single one."""
+        first_code = next(iter(const.SUPPORTED_CARD_BRANDS))
+        # Warm up the caches
+        self._seed([first_code])
+
+        one_brand = self._seed([first_code])
+        all_brands = self._seed(const.SUPPORTED_CARD_BRANDS)
+        self.assertEqual(all_brands, one_brand)
+
+    def test_seed_without_missing_brands(self):
+        """With every brand present the seeding only reads the existing codes."""
+        self._seed([])
+        with self.assertQueryCount(2):
+            self.env['fiserv.card.config'].init()
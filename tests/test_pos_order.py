@@ -0,0 +1,117 @@
+import uuid
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.point_of_sale.tests.common import TestPoSCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPosInterestLine(TestPoSCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.config = cls.basic_config
+        cls.interest_product = cls.env.ref('fiserv_gateway.product_fiserv_interest')
+        cls.interest_product.write({'taxes_id': [(5, 0, 0)], 'available_in_pos': True})
+        cls.product = cls.env['product.product'].create({
+            'name': 'Producto Fiserv',
+            'available_in_pos': True,
+            'list_price': 100.0,
+            'taxes_id': [(5, 0, 0)],
+        })
+
+        cls.provider = cls.env.ref('fiserv_gateway.payment_provider_fiserv')
+        cls.provider.write({
+            'fiserv_interest_mode': 'surcharge',
+            'fiserv_interest_product_id': cls.interest_product.id,
+        })
+        cls.card = cls.env['fiserv.card.config'].create({
+            'code': 'TEST_SURCHARGE',
+            'name': 'Tarjeta de prueba',
+            'installments': [(0, 0, {
+                'installments': installments,
+                'interest_rate': rate,
+                'installment_to_send': str(installments),
+            }) for installments, rate in ((3, 10.0), (6, 20.0))],
+        })
+        cls.method = cls.bank_pm1
+        cls.method.write({
+            'use_fiserv': True,
+            'fiserv_provider_id': cls.provider.id,
+            'card_config_ids': [(6, 0, cls.card.ids)],
+        })
+
+    def _line(self, product, price):
+        return (0, 0, {
+            'product_id': product.id,
+            'qty': 1,
+            'price_unit': price,
+            'price_subtotal': price,
+            'price_subtotal_incl': price,
+            'discount': 0.0,
+            'tax_ids': [(6, 0, [])],
+        })
+
+    def _sync_order(self, installments, interest):
+        """Syncs a paid order of the product plus a surcharge line of interest, paid in installments."""
+        session = self.open_new_session()
+        total = 100.0 + interest
+        order_uuid = str(uuid.uuid4())
+        self.env['pos.order'].sync_from_ui([{
+            'uuid': order_uuid,
+            'name': f'Fiserv {order_uuid}',
+            'session_id': session.id,
+            'pricelist_id': session.config_id.pricelist_id.id,
+            'partner_id': False,
+            'user_id': session.user_id.id,
+            'sequence_number': 1,
+            'date_order': fields.Datetime.to_string(fields.Datetime.now()),
+            'state': 'paid',
+            'amount_tax': 0.0,
+            'amount_total': total,
+            'amount_paid': total,
+            'amount_return': 0.0,
+            'lines': [self._line(self.product, 100.0), self._line(self.interest_product, interest)],
+            'payment_ids': [(0, 0, {
+                'amount': total,
+                'payment_date': fields.Datetime.to_string(fields.Datetime.now()),
+                'payment_method_id': self.method.id,
+                'card_config_id': self.card.id,
+                'installments': installments,
+            })],
+        }])
+        return self.env['pos.order'].search([('uuid', '=', order_uuid)])
+
+    def _mismatch_logs(self, log_error):
+        return [
+            call.args[0] for call in log_error.call_args_list
+            if call.args and call.args[0].get('error_type') == 'pos_interest_line_mismatch'
+        ]
+
+    def test_surcharge_line_flagged(self):
+        """3 installments at 10%: the 10.00 surcharge line matches the payment."""
+        with patch.object(type(self.env['fiserv.transaction.log']), 'log_error', return_value=True) as log_error:
+            order = self._sync_order(3, 10.0)
+
+        self.assertEqual(order.fiserv_payment_id, order.payment_ids)
+        self.assertEqual(order.fiserv_payment_id.interest_rate, 10.0)
+        interest_line = order.lines.filtered(lambda l: l.product_id == self.interest_product)
+        self.assertTrue(interest_line.is_fiserv_interest)
+        self.assertFalse((order.lines - interest_line).filtered('is_fiserv_interest'))
+        self.assertFalse(self._mismatch_logs(log_error))
+
+    def test_surcharge_line_mismatch_logged(self):
+        """6 installments at 20% need 18.33 of interest, the order only booked 10.00."""
+        with patch.object(type(self.env['fiserv.transaction.log']), 'log_error', return_value=True) as log_error:
+            order = self._sync_order(6, 10.0)
+
+        interest_line = order.lines.filtered(lambda l: l.product_id == self.interest_product)
+        self.assertTrue(interest_line.is_fiserv_interest)
+        logs = self._mismatch_logs(log_error)
+        self.assertEqual(len(logs), 1)
+        self.assertEqual(logs[0]['pos_order_id'], order.id)
+        self.assertAlmostEqual(logs[0]['expected_interest'], 18.33)
+        self.assertAlmostEqual(logs[0]['booked_interest'], 10.0)
@@ -0,0 +1,41 @@
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestSaleOrderTransactionCount(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.partner = cls.env['res.partner'].create({'name': 'Cliente Fiserv'})
+        cls.provider = cls.env.ref('fiserv_gateway.payment_provider_fiserv')
+        cls.payment_method = cls.env.ref('payment.payment_method_card')
+
+        # A list page: 80 orders, each with a draft, a pending and a done transaction
+        cls.orders = cls.env['sale.order'].create([{'partner_id': cls.partner.id} for _ in range(80)])
+        cls.env['payment.transaction'].create([{
+            'provider_id': cls.provider.id,
+            'payment_method_id': cls.payment_method.id,
+            'reference': f'{order.name}-{state}',
+            'amount': 100.0,
+            'currency_id': cls.env.company.currency_id.id,
+            'partner_id': cls.partner.id,
+            'state': state,
+            'sale_order_ids': [(6, 0, order.ids)],
+        } for order in cls.orders for state in ('draft', 'pending', 'done')])
+
+    def test_transaction_count_page_of_orders(self):
+        """The count of a whole page is a single grouped query, drafts excluded."""
+        # Warm up the access rights and record rules caches
+        self.orders.mapped('payment_transaction_count')
+        self.env.invalidate_all()
+
+        with self.assertQueryCount(1):
+            counts = self.orders.mapped('payment_transaction_count')
+        self.assertEqual(counts, [2] * 80)
+
+    def test_transaction_count_new_order(self):
+        """Orders not saved yet have no transactions and run no query."""
+        order = self.env['sale.order'].new({'partner_id': self.partner.id})
+        with self.assertQueryCount(0):
+            self.assertEqual(order.payment_transaction_count, 0)
@@ -0,0 +1,131 @@
+"""
+Per-stage timers for the payment pipelines (notification, return,
+prepare_redirect). Every run is added to the fiserv_stage_duration_seconds
+histogram of metrics.py.
+
+    with timing.pipeline('notify', enabled=True):
+        with timing.stage('lookup'):
+            tx = ...
+        timing.set_key(tx.reference)
+        with timing.stage('signature'):
+            ...
+
+Stages nest: a stage opened inside another is recorded as 'outer/inner'.
+The current pipeline is held in a context variable, so code called from a
+pipeline (e.g. action_confirm) can open stages without receiving a timer,
+and a pipeline opened inside another one adds its stages to the outer one.
+When disabled, or outside a pipeline, pipeline() and stage() return a
+shared no-op context manager: the cost is one context variable lookup.
+Does not depend on Odoo.
+"""
+import contextlib
+import contextvars
+import time
+
+from . import metrics
+
+# Stage name of the whole run in the histogram
+TOTAL = 'total'
+
+_current = contextvars.ContextVar('fiserv_timing', default=None)
+_NULL = contextlib.nullcontext()
+
+
+class Timing:
+    """Stages of one run of a pipeline, as a list of (name, seconds)."""
+    __slots__ = ('pipeline', 'key', 'stages', 'total', '_path')
+
+    def __init__(self, pipeline, key=None):
+        self.pipeline = pipeline
+        self.key = key
+        self.stages = []
+        self.total = 0.0
+        self._path = []
+
+    def as_dict(self):
+        return {
+            'pipeline': self.pipeline,
+            'key': self.key,
+            'total_ms': round(self.total * 1000, 3),
+            'stages_ms': [[name, round(seconds * 1000, 3)] for name, seconds in self.stages],
+        }
+
+
+class _Stage:
+    __slots__ = ('timing', 'name', 'started')
+
+    def __init__(self, timing, name):
+        self.timing = timing
+        self.name = name
+
+    def __enter__(self):
+        self.timing._path.append(self.name)
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        path = self.timing._path
+        self.timing.stages.append(('/'.join(path), elapsed))
+        path.pop()
+        return False
+
+
+class _Pipeline:
+    __slots__ = ('timing', 'on_finish', 'started', 'token')
+
+    def __init__(self, name, key, on_finish):
+        self.timing = Timing(name, key)
+        self.on_finish = on_finish
+
+    def __enter__(self):
+        self.token = _current.set(self.timing)
+        self.started = time.perf_counter()
+        return self.timing
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timing.total = time.perf_counter() - self.started
+        _current.reset(self.token)
+        record(self.timing)
+        if self.on_finish:
+            self.on_finish(self.timing)
+        return False
+
+
+def pipeline(name, key=None, enabled=True, on_finish=None):
+    """
+    Context manager timing a pipeline run. When it ends the stages are added
+    to the metrics (see record()) and on_finish(timing) is called. Inside another
+    pipeline, or when not enabled, it does nothing.
+    """
+    if not enabled or _current.get() is not None:
+        return _NULL
+    return _Pipeline(name, key, on_finish)
+
+
+def stage(name):
+    """Context manager timing a stage of the current pipeline, if any."""
+    timing = _current.get()
+    if timing is None:
+        return _NULL
+    return _Stage(timing, name)
+
+
+def current():
+    """Timing of the current pipeline, None outside a pipeline or when disabled."""
+    return _current.get()
+
+
+def set_key(key):
+    """Sets the key (e.g. the transaction reference) of the current pipeline once known."""
+    timing = _current.get()
+    if timing is not None and not timing.key:
+        timing.key = key
+
+
+def record(timing):
+    """
+    Adds the stages and the total of a pipeline run to the stage latency
+    histogram of the metrics, exported by /payment/fiserv/metrics.
+    """
+    for name, seconds in timing.stages + [(TOTAL, timing.total)]:
+        metrics.observe('fiserv_stage_duration_seconds', seconds, pipeline=timing.pipeline, stage=name)
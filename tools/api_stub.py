@@ -0,0 +1,220 @@
+"""
+Local stub of the Fiserv REST API, to exercise fiserv_client.py and the
+jobs built on it without network access or Fiserv credentials.
+
+    python tools/api_stub.py --port 8079
+    python tools/api_stub.py --port 8079 --api-secret SECRET --latency 0.05 --error-rate 0.1
+
+Then set the provider's API URL to http://localhost:8079.
+
+Endpoints (same paths as https://cert.api.firstdata.com/gateway/v2):
+    GET  /orders/<order_id>     Order inquiry, one transaction per order
+    GET  /payments/<id>         Transaction inquiry
+    POST /payments/<id>         Secondary transaction: PostAuthTransaction,
+                                VoidTransaction or ReturnTransaction
+
+The answer depends on the id suffix, so every case can be produced on demand:
+    ...DECLINED  -> transactionStatus DECLINED
+    ...PENDING   -> transactionStatus WAITING
+    ...MISSING   -> HTTP 404
+    anything else -> transactionStatus APPROVED
+
+--error-rate answers that fraction of the requests with HTTP 503, to test
+retries. With --api-secret the Message-Signature header is verified.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ORDER_PATH = re.compile(r'^/orders/([^/]+)$')
+PAYMENT_PATH = re.compile(r'^/payments/([^/]+)$')
+
+REQUEST_TYPES = {
+    'PostAuthTransaction': ('POSTAUTH', 'CAPTURED'),
+    'VoidTransaction': ('VOID', 'VOIDED'),
+    'ReturnTransaction': ('RETURN', 'CAPTURED'),
+}
+
+
+def _status_for(identifier):
+    if identifier.endswith('DECLINED'):
+        return 'DECLINED'
+    if identifier.endswith('PENDING'):
+        return 'WAITING'
+    return 'APPROVED'
+
+
+def _transaction_id(identifier):
+    """Stable numeric transaction id for an order id, like Fiserv's."""
+    return str(84500000000 + zlib.crc32(identifier.encode()) % 100000000)
+
+
+def _transaction(identifier, transaction_type='SALE', state='CAPTURED', amount=None, currency='ARS'):
+    status = _status_for(identifier)
+    transaction_id = _transaction_id(identifier)
+    approval = status == 'APPROVED'
+    return {
+        'ipgTransactionId': transaction_id,
+        'orderId': identifier,
+        'transactionType': transaction_type,
+        'transactionTime': int(time.time()),
+        'transactionStatus': status,
+        'transactionState': state if approval else 'DECLINED',
+        'approvedAmount': {'total': float(amount or 100.0), 'currency': currency},
+        'paymentMethodDetails': {'paymentCard': {'brand': 'VISA', 'last4': '1234'}},
+        'processor': {
+            'approvalCode': f'Y:{transaction_id[-6:]}:{transaction_id}:PPX :{transaction_id}' if approval
+            else 'N:05:Do not honour',
+            'responseCode': '00' if approval else '05',
+            'responseMessage': 'APPROVAL' if approval else 'DO NOT HONOUR',
+        },
+    }
+
+
+class FiservStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FiservStub/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, {'transactionStatus': 'ERROR', 'error': {'code': str(status), 'message': message}})
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode() if length else ''
+
+    def _check_request(self, body):
+        """Simulated latency, random failures and signature check. False if already answered."""
+        self.server.count(self.command)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self._error(503, 'Service temporarily unavailable')
+            return False
+        if self.server.api_secret:
+            message = (
+                f"{self.headers.get('Api-Key', '')}{self.headers.get('Client-Request-Id', '')}"
+                f"{self.headers.get('Timestamp', '')}{body}"
+            )
+            expected = base64.b64encode(hmac.new(
+                self.server.api_secret.encode(), message.encode(), hashlib.sha256
+            ).digest()).decode()
+            if not hmac.compare_digest(expected, self.headers.get('Message-Signature', '')):
+                self._error(401, 'Invalid message signature')
+                return False
+        return True
+
+    def do_GET(self):
+        if not self._check_request(''):
+            return
+        match = ORDER_PATH.match(self.path) or PAYMENT_PATH.match(self.path)
+        if not match:
+            return self._error(404, 'Not found')
+        identifier = match.group(1)
+        if identifier.endswith('MISSING'):
+            return self._error(404, f'{identifier} not found')
+        transaction = _transaction(identifier)
+        if ORDER_PATH.match(self.path):
+            return self._send(200, {'orderId': identifier, 'transactions': [transaction]})
+        return self._send(200, transaction)
+
+    def do_POST(self):
+        body = self._read_body()
+        if not self._check_request(body):
+            return
+        match = PAYMENT_PATH.match(self.path)
+        if not match:
+            return self._error(404, 'Not found')
+        try:
+            payload = json.loads(body or '{}')
+        except ValueError:
+            return self._error(400, 'Invalid JSON')
+        request_type = payload.get('requestType')
+        if request_type not in REQUEST_TYPES:
+            return self._error(400, f'Unsupported requestType {request_type}')
+        identifier = match.group(1)
+        if identifier.endswith('MISSING'):
+            return self._error(404, f'{identifier} not found')
+        transaction_type, state = REQUEST_TYPES[request_type]
+        amount = payload.get('transactionAmount') or {}
+        self._send(200, _transaction(
+            identifier, transaction_type, state, amount.get('total'), amount.get('currency', 'ARS')
+        ))
+
+
+class FiservStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, api_secret=None, latency=0.0, error_rate=0.0, verbose=False):
+        super().__init__(address, FiservStubHandler)
+        self.api_secret = api_secret
+        self.latency = latency
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def count(self, method):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def start_in_thread(port=0, **options):
+    """Starts a stub server in a background thread and returns it (see server.url)."""
+    server = FiservStubServer(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the Fiserv REST API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8079)
+    parser.add_argument('--api-secret', help='Verify the Message-Signature header with this secret')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every answer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = FiservStubServer(
+        (args.host, args.port),
+        api_secret=args.api_secret,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        verbose=args.verbose,
+    )
+    print(f'Fiserv API stub listening on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
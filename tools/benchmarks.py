@@ -0,0 +1,610 @@
+"""
+Micro benchmarks for the Fiserv hot paths.
+
+They work on in-memory records (``new()``) or inside a savepoint that is
+rolled back, so they can be run against any database without leaving data
+behind, and they need no network access. The file logs they cause are
+written to a temporary directory. Run them from an Odoo shell:
+
+    odoo-bin shell -d <db>
+    >>> from odoo.addons.fiserv_gateway.tools import benchmarks
+    >>> benchmarks.run(env)
+    >>> benchmarks.run(env, names=['pos_basket_interest'], sizes=(200, 1000))
+    >>> benchmarks.run(env, names=['pos_sync'], orders=1000)
+    >>> benchmarks.run(env, names=['settlement_import'], rows=1000000)
+
+To compare versions, save the results as JSON and compare two files:
+
+    >>> benchmarks.run(env, output='/tmp/fiserv_bench_1.1.json')
+    >>> benchmarks.compare('/tmp/fiserv_bench_1.0.json', '/tmp/fiserv_bench_1.1.json')
+"""
+import base64
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from odoo import fields, release
+
+from .. import settlement, utils
+from ..models import fiserv_log
+
+_logger = logging.getLogger(__name__)
+
+# name -> function(env, **kwargs) returning {label: seconds}
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark function under name."""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, repeat=5, setup=None):
+    """
+    Runs func repeat times and returns the best and median durations in seconds.
+    setup, when given, is called before every run and is not timed.
+    """
+    timings = []
+    for _i in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {'best': min(timings), 'median': statistics.median(timings)}
+
+
+class _Rollback(Exception):
+    """Raised inside a savepoint to undo what a benchmark wrote."""
+
+
+@contextlib.contextmanager
+def temporary_log_dir():
+    """Sends the Fiserv file logs to a temporary directory."""
+    previous = fiserv_log._log_dir_override
+    with tempfile.TemporaryDirectory(prefix='fiserv_benchmark_') as path:
+        fiserv_log.set_log_dir(path)
+        try:
+            yield path
+        finally:
+            fiserv_log.set_log_dir(previous)
+
+
+def run(env, names=None, output=None, **kwargs):
+    """
+    Runs the selected benchmarks (all by default) and logs their results.
+    With output, the results and the versions they were measured on are
+    also written to that file as JSON, see compare().
+
+    Returns:
+        dict: {benchmark name: {label: {'best': s, 'median': s}}}
+    """
+    results = {}
+    with temporary_log_dir():
+        for name in names or sorted(BENCHMARKS):
+            results[name] = BENCHMARKS[name](env, **kwargs)
+            for label, timing in results[name].items():
+                _logger.info(
+                    "Fiserv benchmark %s [%s]: best %.2f ms, median %.2f ms",
+                    name, label, timing['best'] * 1000, timing['median'] * 1000
+                )
+    if output:
+        module = env['ir.module.module'].sudo().search([('name', '=', 'fiserv_gateway')], limit=1)
+        with open(output, 'w') as f:
+            json.dump({
+                'module_version': module.latest_version,
+                'odoo_version': release.version,
+                'python_version': platform.python_version(),
+                'host': platform.node(),
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'parameters': {key: value for key, value in kwargs.items()},
+                'results': results,
+            }, f, indent=2, default=str)
+    return results
+
+
+def compare(baseline, current, tolerance=0.10):
+    """
+    Compares the median timings of two files written by run(output=...).
+    Logs every benchmark and returns the ones slower than the baseline by
+    more than tolerance, as a list of (name, label, baseline s, current s).
+    """
+    with open(baseline) as f:
+        baseline = json.load(f)
+    with open(current) as f:
+        current = json.load(f)
+    regressions = []
+    for name, labels in current['results'].items():
+        for label, timing in labels.items():
+            before = baseline['results'].get(name, {}).get(label)
+            if not before:
+                continue
+            ratio = timing['median'] / before['median'] if before['median'] else 1.0
+            _logger.info(
+                "Fiserv benchmark %s [%s]: %.2f ms -> %.2f ms (x%.2f)",
+                name, label, before['median'] * 1000, timing['median'] * 1000, ratio
+            )
+            if ratio > 1 + tolerance:
+                regressions.append((name, label, before['median'], timing['median']))
+    return regressions
+
+
+def _clear_log_dir():
+    """Empties the log directory, so log files do not grow across runs."""
+    log_dir = fiserv_log.get_log_dir()
+    for root, _dirs, files in os.walk(log_dir):
+        for filename in files:
+            os.unlink(os.path.join(root, filename))
+
+
+def _new_fiserv_transaction(env, amount=1500.0):
+    """In-memory Fiserv transaction with its provider credentials."""
+    provider = env['payment.provider'].new({
+        'name': 'Benchmark Fiserv',
+        'code': 'fiserv',
+        'fiserv_store_name': '5923000000',
+        'fiserv_shared_secret': 'benchmark-secret',
+        'fiserv_enable_installments': True,
+    })
+    return env['payment.transaction'].new({
+        'provider_id': provider,
+        'reference': 'BENCH-0001',
+        'amount': amount,
+    })
+
+
+def _create_pos_plan(env, interest_rate=10.0, installments=3):
+    """
+    Creates a card brand with one installment plan and a Fiserv payment
+    method. The plan rates are read from the database (_get_plan_rates),
+    so they have to be real records: call it inside a savepoint.
+    """
+    card = env['fiserv.card.config'].create({
+        'code': 'BENCHMARK',
+        'name': 'Benchmark',
+        'installments': [(0, 0, {
+            'installments': installments,
+            'interest_rate': interest_rate,
+            'installment_to_send': str(installments),
+        })],
+    })
+    method = env['pos.payment.method'].create({
+        'name': 'Benchmark Fiserv',
+        'use_fiserv': True,
+        'card_config_ids': [(6, 0, card.ids)],
+    })
+    return card, method
+
+
+def _new_pos_basket(env, size, card, method, installments=3):
+    """
+    Builds an in-memory POS order with size lines paid in installments
+    of card with method (see _create_pos_plan).
+    """
+    product = env['product.product'].search([('sale_ok', '=', True)], limit=1)
+    return env['pos.order'].new({
+        'payment_ids': [(0, 0, {
+            'payment_method_id': method.id,
+            'card_config_id': card.id,
+            'installments': installments,
+            'amount': 100.0 * size,
+        })],
+        'lines': [(0, 0, {
+            'product_id': product.id,
+            'qty': 1,
+            'price_unit': 100.0 + index % 50,
+            'original_price': 100.0 + index % 50,
+        }) for index in range(size)],
+    })
+
+
+@benchmark('pos_basket_interest')
+def bench_pos_basket_interest(env, sizes=(50, 200, 1000), repeat=5, **kwargs):
+    """
+    Interest price of every line of large POS baskets
+    (pos.order.line._compute_price_with_interest). The card brand and the
+    payment method are created in a savepoint and rolled back.
+    """
+    results = {}
+    try:
+        with env.cr.savepoint():
+            card, method = _create_pos_plan(env)
+            for size in sizes:
+                lines = _new_pos_basket(env, size, card, method).lines
+                if not lines.order_id.fiserv_payment_id.interest_rate:
+                    _logger.warning("Fiserv benchmark pos_basket_interest: the plan rate was not applied")
+
+                def compute():
+                    lines.invalidate_recordset(['price_with_interest'])
+                    lines._compute_price_with_interest()
+
+                results[f'{size} lines'] = measure(compute, repeat)
+            raise _Rollback()
+    except _Rollback:
+        pass
+    env.invalidate_all()
+    # The plan rates cached while the brand existed
+    env.registry.clear_cache()
+    return results
+
+
+def _pos_order_payload(session, method, plan, product, index, lines=5):
+    """Order as uploaded by the POS, paid with a Fiserv installment plan."""
+    price = 100.0
+    total = price * lines
+    return {
+        'uuid': str(uuid.uuid4()),
+        'name': f'Fiserv benchmark {index}',
+        'session_id': session.id,
+        'pricelist_id': session.config_id.pricelist_id.id,
+        'partner_id': False,
+        'user_id': session.user_id.id,
+        'sequence_number': index + 1,
+        'date_order': fields.Datetime.to_string(fields.Datetime.now()),
+        'state': 'paid',
+        'amount_tax': 0.0,
+        'amount_total': total,
+        'amount_paid': total,
+        'amount_return': 0.0,
+        'lines': [(0, 0, {
+            'product_id': product.id,
+            'qty': 1,
+            'price_unit': price,
+            'price_subtotal': price,
+            'price_subtotal_incl': price,
+            'discount': 0.0,
+            'tax_ids': [(6, 0, [])],
+        }) for _line in range(lines)],
+        'payment_ids': [(0, 0, {
+            'amount': total,
+            'payment_date': fields.Datetime.to_string(fields.Datetime.now()),
+            'payment_method_id': method.id,
+            'card_config_id': plan.card_config_id.id,
+            'installments': plan.installments,
+        })],
+    }
+
+
+@benchmark('pos_sync')
+def bench_pos_sync(env, orders=1000, repeat=1, **kwargs):
+    """
+    Upload of orders paid in Fiserv installments through
+    pos.order.sync_from_ui, as a POS does when it goes back online.
+    Needs an open session with a payment method flagged use_fiserv.
+    Everything is rolled back.
+    """
+    session = env['pos.session'].search([
+        ('state', '=', 'opened'),
+        ('config_id.payment_method_ids.use_fiserv', '=', True),
+    ], limit=1)
+    if not session:
+        _logger.warning("Fiserv benchmark pos_sync skipped: no open session with a Fiserv payment method")
+        return {}
+
+    method = session.config_id.payment_method_ids.filtered('use_fiserv')[:1]
+    plan = env['fiserv.card.installment'].search([
+        ('card_config_id', 'in', method.card_config_ids.ids),
+        ('installments', '>', 1),
+    ], limit=1)
+    product = env['product.product'].search([('available_in_pos', '=', True)], limit=1)
+    if not plan or not product:
+        _logger.warning("Fiserv benchmark pos_sync skipped: no installment plan or POS product")
+        return {}
+
+    timings = []
+    queries = []
+    for _i in range(repeat):
+        payloads = [_pos_order_payload(session, method, plan, product, index) for index in range(orders)]
+        start_queries = env.cr.sql_log_count
+        start = time.perf_counter()
+        try:
+            with env.cr.savepoint():
+                env['pos.order'].sync_from_ui(payloads)
+                env.flush_all()
+                timings.append(time.perf_counter() - start)
+                queries.append(env.cr.sql_log_count - start_queries)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        env.invalidate_all()
+
+    return {f'{orders} orders': {
+        'best': min(timings),
+        'median': statistics.median(timings),
+        'queries': min(queries),
+    }}
+
+
+@benchmark('card_config_seed')
+def bench_card_config_seed(env, repeat=3, **kwargs):
+    """
+    Seeding of the default card brands and installment plans done on install
+    (fiserv.card.config.init), on an emptied table. Rolled back.
+    """
+    timings = []
+    queries = []
+    for _i in range(repeat):
+        try:
+            with env.cr.savepoint():
+                env['fiserv.card.config'].with_context(active_test=False).search([]).unlink()
+                env.flush_all()
+                start_queries = env.cr.sql_log_count
+                start = time.perf_counter()
+                env['fiserv.card.config'].init()
+                env.flush_all()
+                timings.append(time.perf_counter() - start)
+                queries.append(env.cr.sql_log_count - start_queries)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        env.invalidate_all()
+
+    return {'seed': {
+        'best': min(timings),
+        'median': statistics.median(timings),
+        'queries': min(queries),
+    }}
+
+
+@benchmark('fiserv_hash')
+def bench_fiserv_hash(env, calls=200, repeat=5, **kwargs):
+    """
+    Request hash of the hosted page: _generate_fiserv_hash, which also
+    writes two log records per call, and the bare utils.request_hash.
+    """
+    tx = _new_fiserv_transaction(env)
+    args = ('5923000000', '2026:10:19-10:00:00', '1500', '032', 'benchmark-secret')
+
+    def generate():
+        for _i in range(calls):
+            tx._generate_fiserv_hash(*args)
+
+    def request_hash():
+        for _i in range(calls):
+            utils.request_hash(*args)
+
+    return {
+        f'{calls} _generate_fiserv_hash': measure(generate, repeat, setup=_clear_log_dir),
+        f'{calls} utils.request_hash': measure(request_hash, repeat),
+    }
+
+
+@benchmark('verify_signature')
+def bench_verify_signature(env, calls=200, repeat=5, **kwargs):
+    """_verify_fiserv_signature of notifications and returns."""
+    tx = _new_fiserv_transaction(env)
+    data = {
+        'oid': 'BENCH-0001',
+        'chargetotal': '1500',
+        'currency': '032',
+        'txndatetime': '2026:10:19-10:00:00',
+        'approval_code': 'Y:123456:4538652787:PPX :84538652787',
+    }
+    notification = dict(data, notification_hash=utils.notification_hash(
+        '1500', 'benchmark-secret', '032', data['txndatetime'], '5923000000', data['approval_code']
+    ))
+    response = dict(data, response_hash=utils.response_hash(
+        'benchmark-secret', data['approval_code'], '1500', '032', data['txndatetime'], '5923000000'
+    ))
+
+    def verify(payload):
+        for _i in range(calls):
+            assert tx._verify_fiserv_signature(payload)
+
+    return {
+        f'{calls} notification_hash': measure(lambda: verify(notification), repeat, setup=_clear_log_dir),
+        f'{calls} response_hash': measure(lambda: verify(response), repeat, setup=_clear_log_dir),
+    }
+
+
+@benchmark('parse_amount')
+def bench_parse_amount(env, calls=10000, repeat=5, **kwargs):
+    """
+    Amount normalization: _parse_fiserv_amount on the values seen in
+    notifications and forms, and settlement.parse_amount on settlement files.
+    """
+    tx = _new_fiserv_transaction(env)
+    values = ['1.234,56', '1500', 1500.5, '99,90', ' 15.000,00 ', 12]
+    values = (values * (calls // len(values) + 1))[:calls]
+    settlement_values = ['1.234,56', '1,234.56', '1234.56', '15.000,00-']
+    settlement_values = (settlement_values * (calls // len(settlement_values) + 1))[:calls]
+
+    def parse():
+        for value in values:
+            tx._parse_fiserv_amount(value)
+
+    def parse_settlement():
+        for value in settlement_values:
+            settlement.parse_amount(value)
+
+    def parse_fixed_width():
+        for _i in range(calls):
+            settlement.parse_amount('         123456', settlement.FIXED_WIDTH_IMPLIED_DECIMALS)
+
+    return {
+        f'{calls} _parse_fiserv_amount': measure(parse, repeat),
+        f'{calls} settlement.parse_amount': measure(parse_settlement, repeat),
+        f'{calls} settlement.parse_amount fixed width': measure(parse_fixed_width, repeat),
+    }
+
+
+@benchmark('installment_options')
+def bench_installment_options(env, plans=12, calls=1000, repeat=5, **kwargs):
+    """
+    Installment options of a card brand (_format_installment_options) and
+    the plan rates used by the POS (_get_plan_rates), cold and cached.
+    """
+    provider = _new_fiserv_transaction(env).provider_id
+    card = env['fiserv.card.config'].new({
+        'code': 'BENCH',
+        'name': 'Benchmark',
+        'installments': [(0, 0, {
+            'installments': count,
+            'interest_rate': 2.5 * count,
+            'installment_to_send': str(count),
+        }) for count in range(1, plans + 1)],
+    })
+    installments = env['fiserv.card.installment']
+
+    def format_options():
+        for _i in range(calls):
+            provider._format_installment_options(card)
+
+    def plan_rates_cold():
+        env.registry.clear_cache()
+        installments._get_plan_rates()
+
+    def plan_rates_cached():
+        for _i in range(calls):
+            installments._get_plan_rates()
+
+    return {
+        f'{calls} x {plans} plans _format_installment_options': measure(format_options, repeat),
+        '_get_plan_rates cold': measure(plan_rates_cold, repeat),
+        f'{calls} _get_plan_rates cached': measure(plan_rates_cached, repeat),
+    }
+
+
+@benchmark('transaction_log')
+def bench_transaction_log(env, entries=(100, 1000, 10000), repeat=5, **kwargs):
+    """
+    One save_transaction_log call appending to a log file that already
+    holds entries records (the file is read and rewritten on every call).
+    """
+    logger = env['fiserv.transaction.log']
+    results = {}
+    for count in entries:
+        reference = f'BENCH-{count}'
+
+        def fill():
+            _clear_log_dir()
+            filepath, entry = fiserv_log._prepare_log_entry({'transaction_reference': reference, 'amount': 1500.0})
+            fiserv_log._append_log_entries(filepath, [entry] * count)
+
+        def save():
+            logger.save_transaction_log({'transaction_reference': reference, 'amount': 1500.0})
+
+        results[f'{count} entries'] = measure(save, repeat, setup=fill)
+    return results
+
+
+@benchmark('sale_order_amounts')
+def bench_sale_order_amounts(env, sizes=(50, 200, 1000), repeat=5, **kwargs):
+    """
+    SaleOrder._compute_amounts (Decimal totals of the Fiserv override) on
+    large orders. The orders are created in a savepoint and rolled back.
+    """
+    partner = env['res.partner'].search([], limit=1)
+    product = env['product.product'].search([('sale_ok', '=', True)], limit=1)
+    if not partner or not product:
+        _logger.warning("Fiserv benchmark sale_order_amounts skipped: no partner or saleable product")
+        return {}
+
+    results = {}
+    try:
+        with env.cr.savepoint():
+            for size in sizes:
+                order = env['sale.order'].create({
+                    'partner_id': partner.id,
+                    'order_line': [(0, 0, {
+                        'product_id': product.id,
+                        'product_uom_qty': 1 + index % 3,
+                        'price_unit': 100.0 + index % 50,
+                    }) for index in range(size)],
+                })
+                env.flush_all()
+
+                def compute():
+                    order.invalidate_recordset(['amount_untaxed', 'amount_tax', 'amount_total'])
+                    order._compute_amounts()
+
+                results[f'{size} lines'] = measure(compute, repeat)
+            raise _Rollback()
+    except _Rollback:
+        pass
+    env.invalidate_all()
+    return results
+
+
+def _write_settlement_csv(path, rows, references):
+    """Settlement CSV of rows lines, cycling over references (unmatched if empty)."""
+    with open(path, 'w', encoding='latin-1') as f:
+        f.write('fecha;nro transaccion;cod autorizacion;referencia;importe;cuotas;tarjeta\n')
+        for index in range(rows):
+            reference = references[index % len(references)] if references else f'BENCH-{index}'
+            f.write(f'20240105;{84500000000 + index};{index % 1000000:06d};{reference};'
+                    f'{1000 + index % 9000},{index % 100:02d};{1 + index % 12};VISA\n')
+
+
+@benchmark('settlement_import')
+def bench_settlement_import(env, rows=1000000, processes=1, repeat=1, **kwargs):
+    """
+    Settlement import of a generated CSV of rows lines: parsing and matching
+    alone (settlement.iter_rows + match_row, no database writes), then the
+    whole fiserv.settlement.import, lines and transaction links included.
+    Rows cycle over the references of the done Fiserv transactions. The
+    import is rolled back.
+    """
+    env.cr.execute("""
+        SELECT tx.reference
+          FROM payment_transaction tx
+          JOIN payment_provider provider ON provider.id = tx.provider_id
+         WHERE provider.code = 'fiserv' AND tx.state = 'done'
+         LIMIT 10000
+    """)
+    references = [reference for reference, in env.cr.fetchall()]
+    Import = env['fiserv.settlement.import']
+
+    with tempfile.TemporaryDirectory(prefix='fiserv_benchmark_') as directory:
+        path = os.path.join(directory, 'settlement.csv')
+        _write_settlement_csv(path, rows, references)
+        index = Import._build_transaction_index()
+
+        def parse_and_match():
+            for row in settlement.iter_rows(path, 'csv'):
+                settlement.match_row(row, index)
+
+        results = {f'{rows} rows parse and match': measure(parse_and_match, repeat)}
+
+        with open(path, 'rb') as f:
+            content = base64.b64encode(f.read())
+
+    timings = []
+    queries = []
+    for _i in range(repeat):
+        try:
+            with env.cr.savepoint():
+                record = Import.create({
+                    'name': 'Benchmark',
+                    'settlement_file': content,
+                    'filename': 'settlement.csv',
+                    'processes': processes,
+                })
+                env.flush_all()
+                start_queries = env.cr.sql_log_count
+                start = time.perf_counter()
+                record._import_settlement()
+                env.flush_all()
+                timings.append(time.perf_counter() - start)
+                queries.append(env.cr.sql_log_count - start_queries)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        env.invalidate_all()
+
+    results[f'{rows} rows import'] = {
+        'best': min(timings),
+        'median': statistics.median(timings),
+        'queries': min(queries),
+    }
+    return results
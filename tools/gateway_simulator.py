@@ -0,0 +1,314 @@
+"""
+Local simulator of the Fiserv Connect hosted payment page, for end-to-end
+load tests of the checkout without Fiserv.
+
+    python tools/gateway_simulator.py --store-name 5923... --shared-secret SECRET \
+        --callback-base http://localhost:8069 --approval-rate 0.8 --latency 0.5 \
+        --duplicate-rate 0.1 --reorder-rate 0.2
+
+Then set the system parameter fiserv_gateway.test_redirect_url to
+http://localhost:8078/connect/gateway/processing (test environment only).
+
+It is a plain WSGI application (GatewaySimulator) served by wsgiref:
+    POST /connect/gateway/processing  Hosted page request as built by
+                                      _get_specific_rendering_values(); the
+                                      'hash' is checked with the store's
+                                      shared secret
+    GET  /stats                       Counters as JSON
+
+For every valid request the simulator decides an outcome and calls back
+transactionNotificationURL (notification_hash) and responseSuccessURL or
+responseFailURL (response_hash), signed like Fiserv with utils.py. The
+callbacks go out from a thread pool, each after a random delay of up to
+--latency seconds; --duplicate-rate resends a callback and --reorder-rate
+delivers the return before the notification. With --return-mode browser
+the return is left to the browser through an auto-submitted form, as the
+real hosted page does.
+
+The outcome is drawn from the approval/pending rates, stable for a given
+oid and --seed, unless the oid ends with DECLINED or PENDING.
+"""
+import argparse
+import html
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from urllib import error, parse, request
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+try:
+    from .. import utils
+except ImportError:  # run as a script
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import utils
+
+PROCESSING_PATH = '/connect/gateway/processing'
+
+REQUIRED_FIELDS = ('storename', 'txndatetime', 'chargetotal', 'currency', 'hash', 'oid')
+
+OUTCOMES = {
+    # status, approval code prefix, return URL field
+    'approved': ('APROBADO', 'Y', 'responseSuccessURL'),
+    'declined': ('RECHAZADO', 'N', 'responseFailURL'),
+    'pending': ('PENDING', '?', 'responseSuccessURL'),
+}
+
+
+class _NoRedirect(request.HTTPRedirectHandler):
+    """Keeps the redirect of the return route as the answer."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_opener = request.build_opener(_NoRedirect)
+
+
+class GatewaySimulator:
+    """WSGI application simulating the hosted payment page of one store."""
+
+    def __init__(self, store_name, shared_secret, callback_base=None, approval_rate=1.0, pending_rate=0.0,
+                 latency=0.0, duplicate_rate=0.0, reorder_rate=0.0, return_mode='server',
+                 callback_workers=16, seed=0, verbose=False, on_callback=None):
+        self.store_name = store_name
+        self.shared_secret = shared_secret
+        self.callback_base = callback_base
+        self.approval_rate = approval_rate
+        self.pending_rate = pending_rate
+        self.latency = latency
+        self.duplicate_rate = duplicate_rate
+        self.reorder_rate = reorder_rate
+        self.return_mode = return_mode
+        self.seed = seed
+        self.verbose = verbose
+        # Called with (name, status, seconds, body) after every callback
+        self.on_callback = on_callback
+        self.executor = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix='fiserv-callback')
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def count(self, key, value=1):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + value
+
+    # WSGI entry point
+    def __call__(self, environ, start_response):
+        method, path = environ['REQUEST_METHOD'], environ.get('PATH_INFO', '')
+        if method == 'GET' and path == '/stats':
+            with self._lock:
+                return self._respond(start_response, '200 OK', json.dumps(self.stats), 'application/json')
+        if method == 'POST' and path == PROCESSING_PATH:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            form = dict(parse.parse_qsl(environ['wsgi.input'].read(length).decode('utf-8')))
+            return self._process(form, start_response)
+        return self._respond(start_response, '404 Not Found', 'Not found')
+
+    def _respond(self, start_response, status, body, content_type='text/html; charset=utf-8'):
+        body = body.encode('utf-8')
+        start_response(status, [('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        return [body]
+
+    def _process(self, form, start_response):
+        self.count('requests')
+        missing = [field for field in REQUIRED_FIELDS if not form.get(field)]
+        if missing:
+            self.count('invalid_request')
+            return self._respond(start_response, '400 Bad Request', f"Missing fields: {', '.join(missing)}")
+        expected = utils.request_hash(
+            self.store_name, form['txndatetime'], form['chargetotal'], form['currency'], self.shared_secret
+        )
+        if form['storename'] != self.store_name or form['hash'] != expected:
+            self.count('invalid_hash')
+            return self._respond(start_response, '400 Bad Request', 'Invalid hash')
+
+        outcome = self._pick_outcome(form)
+        self.count(outcome)
+        notification, response = self._build_callbacks(form, outcome)
+        callbacks = [('notify', self._callback_url(form.get('transactionNotificationURL')), notification)]
+        return_url = self._callback_url(form.get(OUTCOMES[outcome][2]))
+        if self.return_mode == 'server':
+            callbacks.append(('return', return_url, response))
+        self.executor.submit(self._deliver, form['oid'], callbacks)
+
+        if self.return_mode == 'browser':
+            inputs = ''.join(
+                f'<input type="hidden" name="{html.escape(key)}" value="{html.escape(str(value))}"/>'
+                for key, value in response.items()
+            )
+            return self._respond(start_response, '200 OK', (
+                f'<html><body onload="document.forms[0].submit()">'
+                f'<form method="post" action="{html.escape(return_url or "")}">{inputs}</form></body></html>'
+            ))
+        return self._respond(start_response, '200 OK', f"{html.escape(form['oid'])}: {notification['status']}")
+
+    def _pick_outcome(self, form):
+        oid = form['oid']
+        if oid.endswith('DECLINED'):
+            return 'declined'
+        if oid.endswith('PENDING'):
+            return 'pending'
+        draw = zlib.crc32(f"{self.seed}:{oid}:{form['txndatetime']}".encode()) / 2 ** 32
+        if draw < self.approval_rate:
+            return 'approved'
+        if draw < self.approval_rate + self.pending_rate:
+            return 'pending'
+        return 'declined'
+
+    def _build_callbacks(self, form, outcome):
+        """Returns the (notification, response) payloads of a request."""
+        status, code, _url_field = OUTCOMES[outcome]
+        txnid = str(84500000000 + zlib.crc32(form['oid'].encode()) % 100000000)
+        if code == 'Y':
+            approval_code = f'Y:{txnid[-6:]}:{txnid}:PPX :{txnid}'
+        elif code == 'N':
+            approval_code = 'N:05:Do not honour'
+        else:
+            approval_code = '?:waiting 3dsecure'
+        payload = {
+            'oid': form['oid'],
+            'txndatetime': form['txndatetime'],
+            'chargetotal': form['chargetotal'],
+            'currency': form['currency'],
+            'approval_code': approval_code,
+            'status': status,
+            'txnid': txnid,
+            'paymentMethod': form.get('paymentMethod', ''),
+            'cardnumber': '(VISA) 450799...1234',
+            'number_of_installments': form.get('numberOfInstallments') or '1',
+            'bname': form.get('bname', ''),
+        }
+        if code == 'N':
+            payload['fail_reason'] = 'Do not honour'
+        notification = dict(payload, notification_hash=utils.notification_hash(
+            form['chargetotal'], self.shared_secret, form['currency'], form['txndatetime'],
+            self.store_name, approval_code
+        ))
+        response = dict(payload, response_hash=utils.response_hash(
+            self.shared_secret, approval_code, form['chargetotal'], form['currency'],
+            form['txndatetime'], self.store_name
+        ))
+        return notification, response
+
+    def _callback_url(self, url):
+        if not url or not self.callback_base:
+            return url
+        base, target = parse.urlsplit(self.callback_base), parse.urlsplit(url)
+        return parse.urlunsplit((base.scheme, base.netloc, target.path, target.query, ''))
+
+    def _deliver(self, oid, callbacks):
+        """Sends the callbacks of a transaction, with latency, duplicates and reordering."""
+        with self._lock:
+            reorder = self._random.random() < self.reorder_rate
+            duplicate = self._random.random() < self.duplicate_rate
+            delays = [self._random.uniform(0, self.latency) for _i in range(len(callbacks) + 1)]
+        if reorder:
+            callbacks = callbacks[::-1]
+            self.count('reordered')
+        if duplicate:
+            callbacks = callbacks + [callbacks[0]]
+            self.count('duplicated')
+        for (name, url, payload), delay in zip(callbacks, delays):
+            if not url:
+                self.count(f'{name}_skipped')
+                continue
+            if delay:
+                time.sleep(delay)
+            self._post(oid, name, url, payload)
+
+    def _post(self, oid, name, url, payload):
+        started = time.perf_counter()
+        data = parse.urlencode(payload).encode('utf-8')
+        try:
+            with _opener.open(request.Request(url, data=data), timeout=30) as response:
+                status, body = response.status, response.read(200).decode('utf-8', 'replace')
+        except error.HTTPError as e:
+            status, body = e.code, ''
+        except (error.URLError, OSError) as e:
+            status, body = 'error', str(e)
+        seconds = time.perf_counter() - started
+        self.count(f'{name}_{status}')
+        self.count(f'{name}_seconds', seconds)
+        if self.on_callback:
+            self.on_callback(name, status, seconds, body)
+        if name == 'notify' and body.startswith('ERROR'):
+            self.count('notify_rejected')
+        if self.verbose:
+            print(f'{oid} {name} -> {status} {body[:80]!r}', flush=True)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        if getattr(self.server, 'verbose', False):
+            super().log_message(format, *args)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def make_simulator_server(host, port, app):
+    server = make_server(host, port, app, server_class=ThreadingWSGIServer, handler_class=_QuietHandler)
+    server.verbose = app.verbose
+    return server
+
+
+def start_in_thread(port=0, **options):
+    """Starts a simulator in a background thread and returns (server, app)."""
+    app = GatewaySimulator(**options)
+    server = make_simulator_server('127.0.0.1', port, app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local simulator of the Fiserv hosted payment page')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8078)
+    parser.add_argument('--store-name', required=True)
+    parser.add_argument('--shared-secret', required=True)
+    parser.add_argument('--callback-base', help='Send the callbacks to this scheme://host:port instead')
+    parser.add_argument('--approval-rate', type=float, default=1.0)
+    parser.add_argument('--pending-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0, help='Maximum delay before each callback (s)')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help='Fraction of transactions with a callback sent twice')
+    parser.add_argument('--reorder-rate', type=float, default=0.0, help='Fraction of transactions with the return first')
+    parser.add_argument('--return-mode', choices=['server', 'browser'], default='server')
+    parser.add_argument('--callback-workers', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    app = GatewaySimulator(
+        args.store_name,
+        args.shared_secret,
+        callback_base=args.callback_base,
+        approval_rate=args.approval_rate,
+        pending_rate=args.pending_rate,
+        latency=args.latency,
+        duplicate_rate=args.duplicate_rate,
+        reorder_rate=args.reorder_rate,
+        return_mode=args.return_mode,
+        callback_workers=args.callback_workers,
+        seed=args.seed,
+        verbose=args.verbose,
+    )
+    server = make_simulator_server(args.host, args.port, app)
+    print(f'Fiserv gateway simulator listening on http://{args.host}:{args.port}{PROCESSING_PATH}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        app.executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    main()
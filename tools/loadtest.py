@@ -0,0 +1,387 @@
+"""
+Checkout load test of the Fiserv payment path against a local Odoo.
+
+Every simulated shopper pays a sale order the way the website does:
+    /payment/fiserv/get_installments -> /payment/fiserv/prepare_redirect
+    -> hosted page (tools/gateway_simulator.py) -> /payment/fiserv/notify
+    and the success / fail return URL
+
+    python tools/loadtest.py --url http://localhost:8069 --db loadtest \
+        --login admin --password admin --shoppers 20 --orders 500 \
+        --dsn "dbname=loadtest" --json loadtest.json
+
+Run it against a copy of the database: it creates a partner and --orders
+sale orders, and points the test environment of the Fiserv provider at the
+simulator (system parameter fiserv_gateway.test_redirect_url, restored at
+the end). The provider must be in the test environment.
+
+Reports p50/p95/p99 latency and throughput per endpoint, the checkouts per
+second, the resulting transaction states and, with --dsn, the PostgreSQL
+lock waits sampled from pg_stat_activity during the run.
+"""
+import argparse
+import json
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    from . import gateway_simulator
+    from .. import const
+except ImportError:  # run as a script
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import gateway_simulator
+    import const
+
+ENDPOINTS = ('get_installments', 'prepare_redirect', 'gateway', 'notify', 'return')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+class Recorder:
+    """Thread-safe latency and error samples per endpoint."""
+
+    def __init__(self):
+        self.samples = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.error_messages = {}
+        self.checkouts = {'accepted': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, error=None):
+        with self._lock:
+            self.samples[endpoint].append(seconds)
+            if error:
+                self.errors[endpoint] += 1
+                message = f'{endpoint}: {str(error)[:120]}'
+                self.error_messages[message] = self.error_messages.get(message, 0) + 1
+
+    def add_checkout(self, accepted):
+        with self._lock:
+            self.checkouts['accepted' if accepted else 'failed'] += 1
+
+    def on_callback(self, name, status, seconds, body):
+        error = body if body.startswith('ERROR') else None
+        if status not in (200, 303):
+            error = f'HTTP {status} {body}'.strip()
+        self.add(name, seconds, error)
+
+    def summary(self, wall_seconds):
+        result = {}
+        for endpoint in ENDPOINTS:
+            values = sorted(self.samples[endpoint])
+            result[endpoint] = {
+                'count': len(values),
+                'errors': self.errors[endpoint],
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': (values[-1] if values else 0.0) * 1000,
+                'per_second': len(values) / wall_seconds if wall_seconds else 0.0,
+            }
+        return result
+
+
+class LockMonitor(threading.Thread):
+    """
+    Samples pg_stat_activity of the database every interval seconds and
+    counts the backends waiting on a lock. The wait time is estimated from
+    the samples (waiting backends x interval).
+    """
+
+    def __init__(self, dsn, interval=0.2):
+        super().__init__(daemon=True)
+        import psycopg2
+        self.connection = psycopg2.connect(dsn)
+        self.connection.autocommit = True
+        self.interval = interval
+        self.samples = 0
+        self.waiting_samples = 0
+        self.max_waiting = 0
+        self.waiting_total = 0
+        self.wait_events = {}
+        self._stopping = threading.Event()
+        self.deadlocks_before = self._deadlocks()
+
+    def _deadlocks(self):
+        with self.connection.cursor() as cr:
+            cr.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+            return cr.fetchone()[0]
+
+    def run(self):
+        with self.connection.cursor() as cr:
+            while not self._stopping.wait(self.interval):
+                cr.execute("""
+                    SELECT wait_event, count(*)
+                      FROM pg_stat_activity
+                     WHERE datname = current_database()
+                       AND pid <> pg_backend_pid()
+                       AND wait_event_type = 'Lock'
+                  GROUP BY wait_event
+                """)
+                rows = cr.fetchall()
+                waiting = sum(count for _event, count in rows)
+                self.samples += 1
+                self.waiting_total += waiting
+                self.max_waiting = max(self.max_waiting, waiting)
+                if waiting:
+                    self.waiting_samples += 1
+                for event, count in rows:
+                    self.wait_events[event] = self.wait_events.get(event, 0) + count
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+        deadlocks = self._deadlocks() - self.deadlocks_before
+        self.connection.close()
+        return {
+            'samples': self.samples,
+            'samples_with_lock_waits': self.waiting_samples,
+            'max_backends_waiting': self.max_waiting,
+            'estimated_lock_wait_seconds': self.waiting_total * self.interval,
+            'wait_events': self.wait_events,
+            'deadlocks': deadlocks,
+        }
+
+
+class Odoo:
+    """Minimal XML-RPC access for the setup of the run."""
+
+    def __init__(self, url, db, login, password):
+        self.url, self.db, self.password = url, db, password
+        self.uid = xmlrpc.client.ServerProxy(f'{url}/xmlrpc/2/common').authenticate(db, login, password, {})
+        if not self.uid:
+            raise SystemExit('Authentication failed')
+        self.models = xmlrpc.client.ServerProxy(f'{url}/xmlrpc/2/object', allow_none=True)
+
+    def call(self, model, method, *args, **kwargs):
+        return self.models.execute_kw(self.db, self.uid, self.password, model, method, list(args), kwargs)
+
+
+def prepare_run(odoo, orders_count, simulator_url):
+    """Creates the orders to pay and returns the checkout context."""
+    providers = odoo.call('payment.provider', 'search_read', [('code', '=', 'fiserv')], fields=[
+        'fiserv_store_name', 'fiserv_shared_secret', 'fiserv_environment', 'payment_method_ids', 'company_id',
+    ], limit=1)
+    if not providers or providers[0]['fiserv_environment'] != 'test':
+        raise SystemExit('A Fiserv provider in the test environment is required')
+    provider = providers[0]
+    card_brands = [card['code'] for card in odoo.call(
+        'fiserv.card.config', 'search_read', [('active', '=', True)], fields=['code'])]
+    company = odoo.call('res.company', 'read', [provider['company_id'][0]], fields=['currency_id'])[0]
+    product_ids = odoo.call('product.product', 'search', [('sale_ok', '=', True), ('list_price', '>', 0)], limit=1)
+    if not card_brands or not product_ids:
+        raise SystemExit('Active card configurations and a saleable product are required')
+    partner_id = odoo.call('res.partner', 'create', {'name': 'Fiserv load test', 'email': 'loadtest@example.com'})
+
+    order_ids = []
+    for start in range(0, orders_count, 100):
+        order_ids += odoo.call('sale.order', 'create', [{
+            'partner_id': partner_id,
+            'order_line': [(0, 0, {'product_id': product_ids[0], 'product_uom_qty': random.randint(1, 5)})],
+        } for _i in range(start, min(start + 100, orders_count))])
+    orders = odoo.call('sale.order', 'read', order_ids, fields=['amount_total'])
+
+    previous_url = odoo.call('ir.config_parameter', 'get_param', const.TEST_REDIR_URL_PARAM)
+    odoo.call('ir.config_parameter', 'set_param', const.TEST_REDIR_URL_PARAM, simulator_url)
+    return {
+        'provider': provider,
+        'payment_method_id': provider['payment_method_ids'][0],
+        'currency_id': company['currency_id'][0],
+        'partner_id': partner_id,
+        'card_brands': card_brands,
+        'orders': orders,
+        'previous_url': previous_url or '',
+    }
+
+
+def json_rpc(session, url, params):
+    response = session.post(url, json={'jsonrpc': '2.0', 'method': 'call', 'params': params}, timeout=60)
+    response.raise_for_status()
+    payload = response.json()
+    if payload.get('error'):
+        raise RuntimeError(payload['error'].get('data', {}).get('message') or payload['error'].get('message'))
+    result = payload.get('result')
+    if isinstance(result, dict) and (result.get('error') or result.get('success') is False):
+        raise RuntimeError(result.get('error'))
+    return result
+
+
+def timed(recorder, endpoint, func, *args):
+    started = time.perf_counter()
+    try:
+        result = func(*args)
+    except Exception as e:
+        recorder.add(endpoint, time.perf_counter() - started, e)
+        return None
+    recorder.add(endpoint, time.perf_counter() - started)
+    return result
+
+
+def checkout(session, args, context, order, recorder):
+    """One shopper paying one order. Returns True when the hosted page accepted it."""
+    card_brand = random.choice(context['card_brands'])
+    installments = timed(recorder, 'get_installments', json_rpc, session,
+                         f'{args.url}/payment/fiserv/get_installments', {
+                             'provider_id': context['provider']['id'],
+                             'card_brand': card_brand,
+                             'amount': order['amount_total'],
+                         })
+    options = (installments or {}).get('options') if isinstance(installments, dict) else None
+    option = random.choice(options) if options else {
+        'installments': '1', 'total_with_interest': order['amount_total'], 'interest_rate': 0.0,
+    }
+    if args.think_time:
+        time.sleep(random.uniform(0, args.think_time))
+
+    redirect = timed(recorder, 'prepare_redirect', json_rpc, session,
+                     f'{args.url}/payment/fiserv/prepare_redirect', {
+                         'provider_id': context['provider']['id'],
+                         'payment_method_id': context['payment_method_id'],
+                         'currency_id': context['currency_id'],
+                         'partner_id': context['partner_id'],
+                         'sale_order_id': order['id'],
+                         'card_brand': card_brand,
+                         'installments': option['installments'],
+                         'amount': order['amount_total'],
+                         'total_with_interest': option['total_with_interest'],
+                         'interest_rate': option['interest_rate'],
+                     })
+    if not redirect:
+        return False
+
+    def post_form():
+        response = session.post(redirect['redirect_url'], data=redirect['form_data'], timeout=60)
+        response.raise_for_status()
+        return response
+
+    return timed(recorder, 'gateway', post_form) is not None
+
+
+def shopper(args, context, orders, recorder):
+    session = requests.Session()
+    session.get(f'{args.url}/web/login', params={'db': args.db}, timeout=60)
+    while True:
+        try:
+            order = orders.get_nowait()
+        except queue.Empty:
+            return
+        recorder.add_checkout(checkout(session, args, context, order, recorder))
+
+
+def print_report(report):
+    print(f"\n{'endpoint':<18}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'req/s':>9}")
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<18}{row['count']:>8}{row['errors']:>8}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}{row['per_second']:>9.1f}")
+    run = report['run']
+    print(f"\n{run['checkouts']} checkouts by {run['shoppers']} shoppers in {run['seconds']:.1f}s: "
+          f"{run['checkouts_per_second']:.2f}/s, {run['failed']} failed")
+    print(f"Transactions: {report['transactions']}")
+    if report.get('database'):
+        db = report['database']
+        print(f"Lock waits: {db['samples_with_lock_waits']}/{db['samples']} samples, max {db['max_backends_waiting']} "
+              f"backends waiting, ~{db['estimated_lock_wait_seconds']:.1f}s waited, {db['deadlocks']} deadlocks "
+              f"{db['wait_events'] or ''}")
+    for message, count in sorted(report['errors'].items(), key=lambda item: -item[1])[:10]:
+        print(f'  {count:>5} x {message}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checkout load test of the Fiserv payment path')
+    parser.add_argument('--url', default='http://localhost:8069')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--login', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--shoppers', type=int, default=10, help='Concurrent shoppers')
+    parser.add_argument('--orders', type=int, default=100, help='Checkouts to run')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Maximum pause of a shopper (s)')
+    parser.add_argument('--simulator-port', type=int, default=8078)
+    parser.add_argument('--approval-rate', type=float, default=0.9)
+    parser.add_argument('--latency', type=float, default=0.0, help='Maximum delay of the gateway callbacks (s)')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--reorder-rate', type=float, default=0.0)
+    parser.add_argument('--dsn', help='PostgreSQL DSN of the database, to sample lock waits')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write the report to this file')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    odoo = Odoo(args.url, args.db, args.login, args.password)
+    recorder = Recorder()
+    simulator_url = f'http://127.0.0.1:{args.simulator_port}{gateway_simulator.PROCESSING_PATH}'
+    context = prepare_run(odoo, args.orders, simulator_url)
+    server, simulator = gateway_simulator.start_in_thread(
+        port=args.simulator_port,
+        store_name=context['provider']['fiserv_store_name'],
+        shared_secret=context['provider']['fiserv_shared_secret'],
+        callback_base=args.url,
+        approval_rate=args.approval_rate,
+        latency=args.latency,
+        duplicate_rate=args.duplicate_rate,
+        reorder_rate=args.reorder_rate,
+        callback_workers=max(args.shoppers, 4),
+        seed=args.seed,
+        on_callback=recorder.on_callback,
+    )
+    orders = queue.Queue()
+    for order in context['orders']:
+        orders.put(order)
+    monitor = LockMonitor(args.dsn) if args.dsn else None
+
+    try:
+        if monitor:
+            monitor.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.shoppers) as executor:
+            for future in [executor.submit(shopper, args, context, orders, recorder)
+                           for _i in range(args.shoppers)]:
+                future.result()
+        # Wait for the pending notifications and returns
+        simulator.executor.shutdown(wait=True)
+        seconds = time.perf_counter() - started
+        database = monitor.stop() if monitor else None
+    finally:
+        server.shutdown()
+        odoo.call('ir.config_parameter', 'set_param', const.TEST_REDIR_URL_PARAM, context['previous_url'])
+
+    transactions = {}
+    for tx in odoo.call('payment.transaction', 'search_read',
+                        [('sale_order_ids', 'in', [order['id'] for order in context['orders']])], fields=['state']):
+        transactions[tx['state']] = transactions.get(tx['state'], 0) + 1
+    counters = recorder.checkouts
+    report = {
+        'run': {
+            'shoppers': args.shoppers,
+            'checkouts': counters['accepted'],
+            'failed': counters['failed'],
+            'seconds': seconds,
+            'checkouts_per_second': counters['accepted'] / seconds if seconds else 0.0,
+        },
+        'endpoints': recorder.summary(seconds),
+        'transactions': transactions,
+        'database': database,
+        'simulator': simulator.stats,
+        'errors': recorder.error_messages,
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""
+Hashes of the Fiserv Connect hosted payment page.
+
+Fiserv hashes the hexadecimal representation of the concatenated fields
+with SHA1; only the fields and their order change between the request hash
+and the two hashes Fiserv sends back. Does not depend on Odoo so the gateway
+simulator (tools/gateway_simulator.py) signs exactly like the module checks.
+"""
+import hashlib
+
+
+def fiserv_sha1(*parts):
+    """SHA1 of the ASCII hex representation of the concatenated parts."""
+    return hashlib.sha1(''.join(parts).encode('utf-8').hex().encode('utf-8')).hexdigest()
+
+
+def request_hash(store_name, txndatetime, chargetotal, currency, shared_secret):
+    """'hash' field of the hosted page request."""
+    return fiserv_sha1(store_name, txndatetime, chargetotal, currency, shared_secret)
+
+
+def notification_hash(chargetotal, shared_secret, currency, txndatetime, store_name, approval_code):
+    """'notification_hash' of the server to server notification."""
+    return fiserv_sha1(chargetotal, shared_secret, currency, txndatetime, store_name, approval_code)
+
+
+def response_hash(shared_secret, approval_code, chargetotal, currency, txndatetime, store_name):
+    """'response_hash' of the return to responseSuccessURL / responseFailURL."""
+    return fiserv_sha1(shared_secret, approval_code, chargetotal, currency, txndatetime, store_name)